@@ -0,0 +1,228 @@
+import hmac
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework.authentication import (
+    BaseAuthentication,
+    BasicAuthentication,
+    SessionAuthentication,
+    get_authorization_header,
+)
+
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from fleet.models import User, UserRole
+
+from backend.common import is_cache_shared
+
+from terminal.models import Terminal, TerminalApiKey, TerminalTokenDenial
+
+
+# Claims added to tokens, in the order of the fields of UserRole (see User.role)
+ROLE_CLAIMS = ("role", "customer_id", "terminal_id")
+
+
+def set_role_claims(token, user: User):
+    for claim, value in zip(ROLE_CLAIMS, user.role):
+        token[claim] = value
+
+
+def get_user_with_role(user_id):
+    return User.objects.select_related(*User.ROLE_RELATIONS).get(
+        **{api_settings.USER_ID_FIELD: user_id}
+    )
+
+
+# Deny list of terminals deactivated while their access tokens are still valid
+# Entries expire with the last access token issued before the deactivation (refreshing tokens checks the user).
+# They are stored in the database (see TerminalTokenDenial), and cached only if the cache is shared
+# between processes: a cache local to each process would not see terminals deactivated by other processes.
+
+
+def _get_deny_list_cache_key(terminal_id):
+    return "terminal_token_denied:{}".format(terminal_id)
+
+
+def deny_terminal_tokens(terminal_id):
+    lifetime = api_settings.ACCESS_TOKEN_LIFETIME
+
+    TerminalTokenDenial.objects.update_or_create(
+        terminal_id=terminal_id, defaults={"expires": timezone.now() + lifetime}
+    )
+
+    if is_cache_shared():
+        cache.set(
+            _get_deny_list_cache_key(terminal_id),
+            True,
+            int(lifetime.total_seconds()),
+        )
+
+
+def allow_terminal_tokens(terminal_id):
+    TerminalTokenDenial.objects.filter(terminal_id=terminal_id).delete()
+
+    if is_cache_shared():
+        cache.delete(_get_deny_list_cache_key(terminal_id))
+
+
+def _is_terminal_denied(terminal_id):
+    if not is_cache_shared():
+        return TerminalTokenDenial.objects.filter(
+            terminal_id=terminal_id, expires__gt=timezone.now()
+        ).exists()
+
+    cache_key = _get_deny_list_cache_key(terminal_id)
+    denied = cache.get(cache_key)
+
+    if denied is None:
+        # Not cached yet, or evicted from the cache
+        expires = (
+            TerminalTokenDenial.objects.filter(
+                terminal_id=terminal_id, expires__gt=timezone.now()
+            )
+            .values_list("expires", flat=True)
+            .first()
+        )
+        denied = expires is not None
+        timeout = (
+            (expires - timezone.now()).total_seconds()
+            if denied
+            else api_settings.ACCESS_TOKEN_LIFETIME.total_seconds()
+        )
+        # Not set if the terminal has been denied meanwhile
+        cache.add(cache_key, denied, max(int(timeout), 1))
+
+    return denied
+
+
+def _check_terminal_allowed(terminal_id):
+    if _is_terminal_denied(terminal_id):
+        raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+
+class UserWithRoleJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication fetching the customer and the terminal of the user in the same query as the user,
+    so that User.role does not query them afterwards
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        try:
+            user = get_user_with_role(user_id)
+        except User.DoesNotExist:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        return user
+
+
+class TerminalTokenUser(TokenUser):
+    """
+    User of a terminal built from the claims of its token (or of its API key), without any query
+    """
+
+    @cached_property
+    def role(self):
+        return UserRole(*(self.token[claim] for claim in ROLE_CLAIMS))
+
+    def is_terminal_user(self):
+        return True
+
+    def is_customer_user(self):
+        return False
+
+    def get_customer(self):
+        return None
+
+    @cached_property
+    def _terminal(self):
+        return Terminal.objects.get(pk=self.role.terminal_id)
+
+    def get_terminal(self):
+        return self._terminal
+
+
+class TerminalJWTAuthentication(UserWithRoleJWTAuthentication):
+    """
+    JWT authentication of the endpoints called by terminals (see TERMINAL_AUTHENTICATION_CLASSES)
+
+    Terminal users are built from the claims of their token (see TerminalTokenUser), unless the terminal
+    has been deactivated. Other users, and tokens issued without role claims, are loaded from the database.
+    """
+
+    def get_user(self, validated_token):
+        if validated_token.get("role") != User.TERMINAL_ROLE:
+            return super().get_user(validated_token)
+
+        _check_terminal_allowed(validated_token["terminal_id"])
+
+        return TerminalTokenUser(validated_token)
+
+
+class TerminalApiKeyAuthentication(BaseAuthentication):
+    """
+    Authentication of terminals with the header "Authorization: Api-Key <key_id>.<secret>" (see TerminalApiKey)
+
+    The secret is checked with a constant-time comparison of its HMAC with the cached digest of the key.
+    """
+
+    keyword = "Api-Key"
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+
+        if len(auth) != 2:
+            raise AuthenticationFailed(_("Invalid API key header"))
+
+        try:
+            key_id, secret = auth[1].decode().split(".", 1)
+        except (UnicodeError, ValueError):
+            raise AuthenticationFailed(_("Invalid API key"))
+
+        api_key = TerminalApiKey.get_cached(key_id)
+
+        if not api_key or not hmac.compare_digest(
+            TerminalApiKey.compute_digest(secret), api_key["digest"]
+        ):
+            raise AuthenticationFailed(_("Invalid API key"))
+
+        _check_terminal_allowed(api_key["terminal_id"])
+
+        user = TerminalTokenUser(
+            {
+                api_settings.USER_ID_CLAIM: api_key["user_id"],
+                "role": User.TERMINAL_ROLE,
+                "customer_id": api_key["customer_id"],
+                "terminal_id": api_key["terminal_id"],
+            }
+        )
+        return user, None
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+
+# Authentication classes of the endpoints called by terminals
+TERMINAL_AUTHENTICATION_CLASSES = [
+    TerminalJWTAuthentication,
+    TerminalApiKeyAuthentication,
+    *([BasicAuthentication] if settings.BASIC_AUTHENTICATION else []),
+    SessionAuthentication,
+]
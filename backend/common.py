@@ -1,3 +1,12 @@
+import datetime
+
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+
 # Terminal donation formula
 
 DONATION_FORMULA_CLASSIC = "Classique"
@@ -11,3 +20,62 @@ DONATION_FORMULAS = (
     (DONATION_FORMULA_MECENAT, "Mécénat"),
     (DONATION_FORMULA_SHARE, "Partage"),
 )
+
+
+# Dates and durations
+
+
+def start_of_day(day: datetime.date):
+    """
+    Return the aware datetime of the start of a day, in the current time zone
+    """
+
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time()))
+
+
+def format_duration(duration):
+    """
+    Format a timedelta as HH:MM:SS, or return an empty string if there is no duration
+    """
+
+    if not duration:
+        return ""
+
+    hours, remainder = divmod(int(duration.total_seconds()), 3600)
+    minutes, seconds = divmod(remainder, 60)
+
+    return "{:02}:{:02}:{:02}".format(hours, minutes, seconds)
+
+
+# Cache
+
+
+def is_cache_shared():
+    """
+    Whether the default cache is shared between processes. A cache local to each process is not cleared
+    when another process changes what it caches, so it must not cache anything that can change.
+    """
+
+    return not isinstance(caches["default"], LocMemCache)
+
+
+# Querysets
+
+
+def count_subquery(queryset, field):
+    """
+    Subquery counting the rows of a queryset whose field references the row of the outer query,
+    to annotate counts of related objects instead of running one COUNT per row
+    """
+
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef("pk")})
+            .order_by()
+            .values(field)
+            .annotate(value=Count("*"))
+            .values("value"),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
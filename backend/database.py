@@ -0,0 +1,92 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.dispatch import receiver
+
+
+# Alias of the optional read-only replica (see REPLICA_DATABASE_URL in settings)
+READ_REPLICA = "replica"
+
+_use_read_replica = ContextVar("use_read_replica", default=False)
+
+
+def get_read_replica_alias():
+    """
+    Return the alias of the read replica, or the alias of the primary database if there is no replica
+    """
+
+    return READ_REPLICA if READ_REPLICA in settings.DATABASES else DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def use_read_replica():
+    """
+    Send reads made in this block to the read replica (see ReadReplicaRouter)
+    """
+
+    token = _use_read_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_read_replica.reset(token)
+
+
+class ReadReplicaRouter:
+    """
+    Send reads to the read replica inside use_read_replica blocks, everything else to the primary database
+    """
+
+    def db_for_read(self, model, **hints):
+        if _use_read_replica.get():
+            return get_read_replica_alias()
+
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # The replica is a copy of the primary database
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != READ_REPLICA
+
+
+class ReadReplicaMixin:
+    """
+    Mixin of the views of statistics and exports, reading from the read replica
+    so that they do not compete with the payments sent by terminals
+
+    Querysets evaluated after the view returns (streamed responses) must be bound with
+    .using(get_read_replica_alias()).
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        with use_read_replica():
+            return super().dispatch(request, *args, **kwargs)
+
+
+@receiver(request_started)
+def check_database_connections(**kwargs):
+    """
+    Close persistent connections that are not usable anymore (for example after a restart of the database)
+    at the start of each request, so that they are opened again instead of failing the request
+    (see DATABASE_HEALTH_CHECKS in settings)
+
+    Django calls close_if_unusable_or_obsolete on each connection before this receiver (see close_old_connections),
+    which closes connections older than CONN_MAX_AGE but checks with is_usable only connections that had an error.
+    Connections that are not open are not checked.
+    """
+
+    if not settings.DATABASE_HEALTH_CHECKS:
+        return
+
+    for connection in connections.all():
+        if connection.connection is None or connection.in_atomic_block:
+            continue
+
+        if not connection.is_usable():
+            connection.close()
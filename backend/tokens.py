@@ -0,0 +1,52 @@
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer,
+    TokenRefreshSerializer,
+)
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+
+from fleet.models import User
+
+from backend.authentication import get_user_with_role, set_role_claims
+
+
+class TokenObtainPairWithRoleSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        set_role_claims(token, user)
+        return token
+
+
+class TokenRefreshWithRoleSerializer(TokenRefreshSerializer):
+    """
+    Refresh the access token only if the user is still active, with the current role of the user
+    """
+
+    def validate(self, attrs):
+        refresh = RefreshToken(attrs["refresh"])
+
+        try:
+            user = get_user_with_role(refresh[api_settings.USER_ID_CLAIM])
+        except (KeyError, User.DoesNotExist):
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        access = refresh.access_token
+        set_role_claims(access, user)
+
+        return {"access": str(access)}
+
+
+class TokenObtainPairWithRoleView(TokenObtainPairView):
+    serializer_class = TokenObtainPairWithRoleSerializer
+
+
+class TokenRefreshWithRoleView(TokenRefreshView):
+    serializer_class = TokenRefreshWithRoleSerializer
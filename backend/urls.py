@@ -19,12 +19,13 @@ from django.urls import path, include
 from django.conf.urls.static import static
 from django.conf import settings
 
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from rest_framework.routers import DefaultRouter
 
+from backend.tokens import TokenObtainPairWithRoleView, TokenRefreshWithRoleView
+
 from fleet.views import *
 from screensaver.views import *
-from game.views import GameViewSet
+from game.views import GameViewSet, FileUploadViewSet
 
 from terminal.views.my_terminal import MyTerminalViewSet
 from terminal.views.terminals import TerminalViewSet
@@ -52,6 +53,7 @@ router.register(r"terminals", TerminalViewSet)
 router.register(r"my-terminal", MyTerminalViewSet, basename="my_terminal")
 router.register(r"donator", DonatorViewSet)
 router.register(r"games", GameViewSet)
+router.register(r"uploads", FileUploadViewSet)
 router.register(r"session", SessionViewSet)
 router.register(
     r"payment/filtered", PaymentFilteredViewSet, basename="filtered_payments"
@@ -63,8 +65,8 @@ router.register(r"screensaver-broadcasts", ScreenSaverBroadcastViewSet)
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api-auth", include("rest_framework.urls")),
-    path("auth/token/", TokenObtainPairView.as_view()),
-    path("auth/token/refresh/", TokenRefreshView.as_view()),
+    path("auth/token/", TokenObtainPairWithRoleView.as_view()),
+    path("auth/token/refresh/", TokenRefreshWithRoleView.as_view()),
     path("auth/self/", UserSelf.as_view()),
     path("user/", UserList.as_view()),
     path("user/<int:pk>/", UserDetail.as_view()),
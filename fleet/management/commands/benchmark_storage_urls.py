@@ -0,0 +1,72 @@
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from fleet.models import Campaign, prefetch_last_donations
+from fleet.serializers import CampaignFullSerializer
+from fleet.storage import CachedUrlS3Storage
+from game.models import Game
+from terminal.views.my_terminal import _GameSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Print the time taken to serialize the catalog (campaigns and games with their files) "
+        "with S3Boto3Storage, then with CachedUrlS3Storage. Urls are signed locally, S3 is not called."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rounds",
+            type=int,
+            default=20,
+            help="Number of times the catalog is serialized with each storage",
+        )
+
+    def handle(self, *args, **options):
+        if options["rounds"] < 1:
+            raise CommandError("--rounds must be positive")
+
+        # Rows are fetched once, so that only the serialization is measured
+        campaigns = list(
+            Campaign.objects.with_stats().prefetch_related("donationSteps")
+        )
+        prefetch_last_donations(campaigns)
+        games = list(Game.objects.with_nb_terminals().with_files())
+
+        self.stdout.write(
+            "Catalog of {} campaigns and {} games".format(len(campaigns), len(games))
+        )
+
+        previous_storage = default_storage._wrapped
+
+        try:
+            for storage_class in (S3Boto3Storage, CachedUrlS3Storage):
+                # Files fields use default_storage, which is replaced by an instance of the benchmarked storage
+                default_storage._wrapped = storage_class()
+                self._benchmark(storage_class, campaigns, games, options["rounds"])
+        finally:
+            default_storage._wrapped = previous_storage
+
+    def _benchmark(self, storage_class, campaigns, games, rounds):
+        durations = []
+
+        for _ in range(rounds):
+            start = time.perf_counter()
+            CampaignFullSerializer(campaigns, many=True).data
+            _GameSerializer(games, many=True).data
+            durations.append(time.perf_counter() - start)
+
+        # The first round signs all urls, following rounds reuse them with CachedUrlS3Storage
+        following_durations = durations[1:] or durations
+
+        self.stdout.write(
+            "{} : first {:.1f} ms, then {:.1f} ms on average".format(
+                storage_class.__name__,
+                durations[0] * 1000,
+                sum(following_durations) / len(following_durations) * 1000,
+            )
+        )
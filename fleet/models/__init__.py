@@ -1,12 +1,27 @@
 import datetime
+from collections import namedtuple
 
-from django.db import models
+from django.apps import apps
+from django.db import connections, models
+from django.db.models import OuterRef, Subquery, Sum, prefetch_related_objects
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 
+from backend.common import count_subquery, start_of_day
+
 from .customer import Customer
 
 
+# Number of payments returned by Campaign.last_donations
+LAST_DONATIONS_COUNT = 5
+
+
+# Role of a user, see User.role
+UserRole = namedtuple("UserRole", ("name", "customer_id", "terminal_id"))
+
+
 class User(AbstractUser):
     """
     user can be assigned to a terminal (user.terminal != None),
@@ -20,6 +35,13 @@ class User(AbstractUser):
     # Referenced my Customer model with related name 'customer'
     # Referenced my Campaign model with related name 'campaigns'
 
+    STAFF_ROLE = "staff"
+    CUSTOMER_ROLE = "customer"
+    TERMINAL_ROLE = "terminal"
+
+    # Reverse relations defining the role of the user
+    ROLE_RELATIONS = ("customer", "terminal")
+
     is_staff = models.BooleanField(
         _("Admin"),
         default=False,
@@ -67,14 +89,143 @@ class User(AbstractUser):
 
         return None
 
+    @cached_property
+    def role(self):
+        """
+        Role of the user, resolved once per user object (so once per request for request.user) :
+        UserRole(name, customer_id, terminal_id), where name is STAFF_ROLE, CUSTOMER_ROLE, TERMINAL_ROLE or None
+        """
+
+        self._fetch_role_relations()
+
+        terminal = self.get_terminal()
+        if terminal is not None:
+            return UserRole(self.TERMINAL_ROLE, terminal.customer_id, terminal.pk)
+
+        customer = self.get_customer()
+        if customer is not None:
+            return UserRole(self.CUSTOMER_ROLE, customer.pk, None)
+
+        if self.is_staff:
+            return UserRole(self.STAFF_ROLE, None, None)
+
+        return UserRole(None, None, None)
+
+    def _fetch_role_relations(self):
+        """
+        Fetch the customer and the terminal of the user in a single query,
+        unless they have already been fetched (see backend.authentication)
+        """
+
+        relations = [self._meta.get_field(name) for name in self.ROLE_RELATIONS]
+
+        if self.pk is None or all(relation.is_cached(self) for relation in relations):
+            return
+
+        user = User.objects.select_related(*self.ROLE_RELATIONS).get(pk=self.pk)
+
+        for relation in relations:
+            relation.set_cached_value(self, relation.get_cached_value(user, None))
+
     def is_terminal_user(self):
-        return self.get_terminal() is not None
+        return self.role.name == self.TERMINAL_ROLE
 
     def is_customer_user(self):
-        return self.get_customer() is not None
+        return self.role.name == self.CUSTOMER_ROLE
+
+
+def _aggregate_by_campaign(queryset, aggregate, output_field):
+    """
+    Subquery computing an aggregate of the rows of the campaign of the outer query
+    """
+
+    return Subquery(
+        queryset.filter(campaign=OuterRef("pk"))
+        .order_by()
+        .values("campaign")
+        .annotate(value=aggregate)
+        .values("value"),
+        output_field=output_field,
+    )
+
+
+class CampaignQuerySet(models.QuerySet):
+    def with_stats(self):
+        """
+        Annotate the values of the nb_terminals, avg_donation, total_today and total_ever properties,
+        computed from payment rollups, so that they are computed in the query fetching campaigns
+        instead of four queries per campaign
+        """
+
+        PaymentDailyRollup = apps.get_model("terminal", "PaymentDailyRollup")
+        accepted_rollups = PaymentDailyRollup.objects.filter(status="Accepted")
+
+        return self.annotate(
+            annotated_nb_terminals=count_subquery(
+                Campaign.terminals.through.objects.all(), "campaign"
+            ),
+            annotated_nb_donations=_aggregate_by_campaign(
+                accepted_rollups, Sum("nb_payments"), models.IntegerField()
+            ),
+            annotated_total_ever=_aggregate_by_campaign(
+                accepted_rollups, Sum("total_amount"), models.FloatField()
+            ),
+            annotated_total_today=_aggregate_by_campaign(
+                accepted_rollups.filter(day=timezone.localdate()),
+                Sum("total_amount"),
+                models.FloatField(),
+            ),
+        )
+
+
+def prefetch_last_donations(campaigns):
+    """
+    Fetch the last donations of some campaigns at once (see Campaign.last_donations), like prefetch_related_objects
+
+    Each campaign has its own query, reading its last accepted payments from the campaign, status and date
+    index, instead of a query ranking every payment of the campaigns. These queries are sent at once
+    as a UNION ALL on databases supporting it.
+    """
+
+    if not campaigns:
+        return
+
+    Payment = apps.get_model("terminal", "Payment")
+    using = campaigns[0]._state.db
+
+    querysets = [
+        Payment.objects.using(using)
+        .filter(campaign=campaign.pk, status="Accepted")
+        .order_by("-date", "-id")[:LAST_DONATIONS_COUNT]
+        for campaign in campaigns
+    ]
+
+    if (
+        len(querysets) > 1
+        and connections[using].features.supports_slicing_ordering_in_compound
+    ):
+        payments = list(querysets[0].union(*querysets[1:], all=True))
+    else:
+        payments = [payment for queryset in querysets for payment in queryset]
+
+    prefetch_related_objects(payments, "game")
+
+    last_donations = {campaign.pk: [] for campaign in campaigns}
+    for payment in payments:
+        last_donations[payment.campaign_id].append(payment)
+
+    for campaign in campaigns:
+        # The order of the rows of a UNION is not defined
+        campaign.prefetched_last_donations = sorted(
+            last_donations[campaign.pk],
+            key=lambda payment: (payment.date, payment.id),
+            reverse=True,
+        )
 
 
 class Campaign(models.Model):
+    objects = CampaignQuerySet.as_manager()
+
     author = models.ForeignKey(
         User, on_delete=models.PROTECT, null=True, related_name="campaigns"
     )
@@ -109,30 +260,59 @@ class Campaign(models.Model):
 
     @property
     def nb_terminals(self):
+        if hasattr(self, "annotated_nb_terminals"):
+            return self.annotated_nb_terminals
+
         return self.terminals.count()
 
     @property
     def avg_donation(self):
+        if hasattr(self, "annotated_total_ever"):
+            if not self.annotated_nb_donations:
+                return None
+
+            return self.annotated_total_ever / self.annotated_nb_donations
+
         return self.payments.filter(campaign=self.pk, status="Accepted").aggregate(
             models.Avg("amount")
         )["amount__avg"]
 
     @property
     def total_today(self):
+        if hasattr(self, "annotated_total_today"):
+            return self.annotated_total_today
+
+        today = timezone.localdate()
+
         return self.payments.filter(
-            campaign=self.pk, status="Accepted", date=datetime.datetime.today()
+            campaign=self.pk,
+            status="Accepted",
+            date__gte=start_of_day(today),
+            date__lt=start_of_day(today + datetime.timedelta(days=1)),
         ).aggregate(models.Sum("amount"))["amount__sum"]
 
     @property
     def total_ever(self):
+        if hasattr(self, "annotated_total_ever"):
+            return self.annotated_total_ever
+
         return self.payments.filter(campaign=self.pk, status="Accepted").aggregate(
             models.Sum("amount")
         )["amount__sum"]
 
     @property
     def last_donations(self):
-        return self.payments.filter(campaign=self.pk, status="Accepted").order_by(
-            "date"
+        """
+        The last LAST_DONATIONS_COUNT accepted payments of the campaign, most recent first
+        """
+
+        if hasattr(self, "prefetched_last_donations"):
+            return self.prefetched_last_donations
+
+        return (
+            self.payments.filter(campaign=self.pk, status="Accepted")
+            .select_related("game")
+            .order_by("-date", "-id")[:LAST_DONATIONS_COUNT]
         )
 
     def __str__(self):
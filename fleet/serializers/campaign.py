@@ -61,12 +61,7 @@ class CampaignFullSerializer(serializers.ModelSerializer):
             return campaign.logo
 
     def get_collected(self, campaign):
-        return (
-            Payment.objects.filter(campaign=campaign.id, status="Accepted").aggregate(
-                Sum("amount")
-            )["amount__sum"]
-            or 0
-        )
+        return campaign.total_ever or 0
 
 
 # Serializer pour le model Campaign
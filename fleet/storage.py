@@ -0,0 +1,72 @@
+import threading
+import time
+
+from django.conf import settings
+
+from storages.backends.s3boto3 import S3Boto3Storage
+
+
+# Maximum number of signed urls cached by each process (see CachedUrlS3Storage)
+URL_CACHE_SIZE = getattr(settings, "STORAGE_URL_CACHE_SIZE", 10000)
+
+
+def get_s3_object(storage: S3Boto3Storage, name):
+    """
+    Return the boto3 object of a file of a S3 storage, with the same key as S3Boto3Storage._save
+    """
+
+    return storage.bucket.Object(
+        storage._encode_name(storage._normalize_name(storage._clean_name(name)))
+    )
+
+
+class CachedUrlS3Storage(S3Boto3Storage):
+    """
+    S3 storage reusing signed urls of files instead of signing them again each time they are serialized
+
+    Urls are cached in the memory of the process, keyed by file name, for a quarter of their lifetime:
+    configurations of terminals are cached for half of it (see Terminal.config_etag), so urls they contain
+    are always valid for a quarter of their lifetime after they are served.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._urls = {}
+        self._urls_lock = threading.Lock()
+
+    def url(self, name, parameters=None, expire=None):
+        if parameters or not self.querystring_auth:
+            return super().url(name, parameters=parameters, expire=expire)
+
+        if expire is None:
+            expire = self.querystring_expire
+
+        key = (name, expire)
+        now = time.monotonic()
+
+        cached = self._urls.get(key)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+
+        url = super().url(name, expire=expire)
+
+        with self._urls_lock:
+            if len(self._urls) >= URL_CACHE_SIZE:
+                # Evict the oldest url, dicts keep the order of insertion
+                self._urls.pop(next(iter(self._urls)), None)
+
+            self._urls.pop(key, None)
+            self._urls[key] = (url, now + expire // 4)
+
+        return url
+
+    def delete(self, name):
+        super().delete(name)
+
+        with self._urls_lock:
+            for key in [key for key in self._urls if key[0] == name]:
+                del self._urls[key]
+
+    def clear_url_cache(self):
+        with self._urls_lock:
+            self._urls.clear()
@@ -1,3 +1,172 @@
-from django.test import TestCase
+import datetime
+from unittest import mock
 
-# Create your tests here.
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+
+from backend.authentication import get_user_with_role
+from terminal.models import Payment, Terminal
+
+from .models import Campaign, Customer, User, prefetch_last_donations
+from .storage import CachedUrlS3Storage
+
+
+class CachedUrlS3StorageTest(SimpleTestCase):
+    def setUp(self):
+        self.storage = CachedUrlS3Storage(querystring_expire=3600)
+
+    def test_url_is_reused_until_a_quarter_of_its_lifetime(self):
+        with mock.patch("fleet.storage.time.monotonic", return_value=1000):
+            url = self.storage.url("games/logos/jeu.png")
+
+            with mock.patch(
+                "storages.backends.s3boto3.S3Boto3Storage.url"
+            ) as signed_url:
+                self.assertEqual(self.storage.url("games/logos/jeu.png"), url)
+                signed_url.assert_not_called()
+
+            self.assertNotEqual(self.storage.url("games/logos/autre.png"), url)
+
+        with mock.patch("fleet.storage.time.monotonic", return_value=1000 + 900):
+            with mock.patch(
+                "storages.backends.s3boto3.S3Boto3Storage.url",
+                return_value="https://signed-again",
+            ):
+                self.assertEqual(
+                    self.storage.url("games/logos/jeu.png"), "https://signed-again"
+                )
+
+    def test_url_is_forgotten_when_file_is_deleted(self):
+        url = self.storage.url("games/logos/jeu.png")
+
+        with mock.patch("storages.backends.s3boto3.S3Boto3Storage.delete"):
+            self.storage.delete("games/logos/jeu.png")
+
+        with mock.patch(
+            "storages.backends.s3boto3.S3Boto3Storage.url",
+            return_value="https://signed-again",
+        ):
+            self.assertNotEqual(self.storage.url("games/logos/jeu.png"), url)
+
+
+class CampaignLastDonationsTest(TestCase):
+    def setUp(self):
+        self.terminal = Terminal.objects.create(
+            name="Borne",
+            owner=User.objects.create(username="terminal"),
+            customer=Customer.objects.create(company="Client"),
+            donation_formula="Classique",
+        )
+        self.campaigns = [
+            Campaign.objects.create(
+                name="Campagne {}".format(index),
+                logo="campaigns/logos/campagne.png",
+                description="",
+                goal_amount=100,
+                link="",
+            )
+            for index in range(2)
+        ]
+
+        now = timezone.now()
+
+        for index in range(8):
+            for campaign in self.campaigns:
+                Payment.objects.create(
+                    terminal=self.terminal,
+                    campaign=campaign,
+                    date=now - datetime.timedelta(minutes=index),
+                    method="CB",
+                    status="Refused" if index == 1 else "Accepted",
+                    amount=index,
+                    currency="EUR",
+                )
+
+        self.client = APIClient()
+        self.client.force_authenticate(
+            User.objects.create(username="admin", is_staff=True)
+        )
+
+    def test_last_donations_are_fetched_with_campaigns(self):
+        campaigns = list(Campaign.objects.all())
+
+        # Payments (a single UNION ALL query where supported) and games
+        if connection.features.supports_slicing_ordering_in_compound:
+            nb_queries = 2
+        else:
+            nb_queries = len(campaigns) + 1
+
+        with self.assertNumQueries(nb_queries):
+            prefetch_last_donations(campaigns)
+
+        with self.assertNumQueries(0):
+            for campaign in campaigns:
+                self.assertEqual(
+                    [payment.amount for payment in campaign.last_donations],
+                    [0, 2, 3, 4, 5],
+                )
+                self.assertEqual(campaign.last_donations[0].campaign_id, campaign.pk)
+
+    def test_campaign_list(self):
+        response = self.client.get("/campaign/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [
+                [payment["amount"] for payment in campaign["last_donations"]]
+                for campaign in response.json()
+            ],
+            [[0, 2, 3, 4, 5]] * 2,
+        )
+
+
+class UserRoleTest(TestCase):
+    def setUp(self):
+        self.customer_user = User.objects.create(username="client")
+        self.customer = Customer.objects.create(
+            company="Client", user=self.customer_user
+        )
+        self.terminal_user = User.objects.create(username="terminal")
+        self.terminal = Terminal.objects.create(
+            name="Borne",
+            owner=self.terminal_user,
+            customer=self.customer,
+            donation_formula="Classique",
+        )
+
+    def test_roles(self):
+        self.assertEqual(
+            User.objects.get(pk=self.terminal_user.pk).role,
+            (User.TERMINAL_ROLE, self.customer.pk, self.terminal.pk),
+        )
+        self.assertEqual(
+            User.objects.get(pk=self.customer_user.pk).role,
+            (User.CUSTOMER_ROLE, self.customer.pk, None),
+        )
+        self.assertEqual(
+            User.objects.create(username="admin", is_staff=True).role,
+            (User.STAFF_ROLE, None, None),
+        )
+        self.assertEqual(User.objects.create(username="autre").role, (None, None, None))
+
+    def test_role_is_resolved_once(self):
+        user = User.objects.get(pk=self.customer_user.pk)
+
+        # Customer and terminal of the user are fetched together
+        with self.assertNumQueries(1):
+            self.assertTrue(user.is_customer_user())
+
+        with self.assertNumQueries(0):
+            self.assertFalse(user.is_terminal_user())
+            self.assertEqual(user.get_customer(), self.customer)
+            self.assertEqual(user.role.customer_id, self.customer.pk)
+
+    def test_role_of_user_fetched_with_its_relations(self):
+        user = get_user_with_role(self.terminal_user.pk)
+
+        with self.assertNumQueries(0):
+            self.assertTrue(user.is_terminal_user())
+            self.assertEqual(user.role.terminal_id, self.terminal.pk)
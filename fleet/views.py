@@ -1,6 +1,15 @@
-from .models import Customer, Campaign, User, DonationStep
+from .models import (
+    Customer,
+    Campaign,
+    User,
+    DonationStep,
+    LAST_DONATIONS_COUNT,
+    prefetch_last_donations,
+)
 from terminal.views import Payment
-from terminal.serializers import PaymentFullSerializer
+from terminal.models import PaymentDailyRollup
+from terminal.stats import get_accepted_payments_stats
+from terminal.serializers import PaymentStatsSerializer
 from .serializers import (
     CustomerSerializer,
     CustomerSerializerWithUser,
@@ -13,6 +22,7 @@ from rest_framework import generics
 from rest_framework import viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from backend.database import ReadReplicaMixin
 from backend.permissions import (
     NormalUserIsCurrentUser,
     IsAdminOrCustomerUser,
@@ -22,9 +32,9 @@ from django.shortcuts import get_object_or_404
 from rest_framework.response import Response
 from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import Avg, Sum
+from django.utils import timezone
 from rest_framework.views import APIView
 from rest_framework import status
-import json
 import datetime
 
 
@@ -99,16 +109,24 @@ class CampaignViewSet(viewsets.ModelViewSet):
         NonAdminUserCanOnlyGet,
     ]
 
+    def get_queryset(self):
+        if self.action in ("list", "retrieve"):
+            # Statistics serialized with campaigns are fetched with them
+            return Campaign.objects.with_stats().prefetch_related("donationSteps")
+
+        return Campaign.objects.all()
+
     def list(self, request, *args, **kwargs):
-        serializer = self.get_serializer(
-            self.get_queryset().order_by("-featured", "name"), many=True, read_only=True
-        )
+        campaigns = list(self.get_queryset().order_by("-featured", "name"))
+        prefetch_last_donations(campaigns)
+        serializer = self.get_serializer(campaigns, many=True, read_only=True)
         return Response(serializer.data)
 
     def retrieve(self, request, *args, **kwargs):
         instance = get_object_or_404(
             self.get_queryset().filter(is_archived=False), pk=kwargs["pk"]
         )
+        prefetch_last_donations([instance])
         serializer = self.get_serializer(instance)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -143,31 +161,30 @@ class CampaignViewSet(viewsets.ModelViewSet):
         return Response(status=status.HTTP_200_OK)
 
 
-class StatsByCampaign(APIView):
+class StatsByCampaign(ReadReplicaMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, id, format=None):
         try:
-            avg = Payment.objects.filter(campaign=id, status="Accepted").aggregate(
-                Avg("amount")
+            rollups = PaymentDailyRollup.objects.filter(campaign=id)
+            stats_ever = get_accepted_payments_stats(rollups)
+            stats_today = get_accepted_payments_stats(
+                rollups.filter(day=timezone.localdate())
+            )
+            last_donations = (
+                Payment.objects.filter(campaign=id, status="Accepted")
+                .select_related("campaign", "terminal", "game")
+                .order_by("-date", "-id")[:LAST_DONATIONS_COUNT]
             )
-            total_today = Payment.objects.filter(
-                campaign=id, status="Accepted", date=datetime.datetime.today()
-            ).aggregate(Sum("amount"))
-            total_ever = Payment.objects.filter(
-                campaign=id, status="Accepted"
-            ).aggregate(Sum("amount"))
-            last_donations = Payment.objects.filter(
-                campaign=id, status="Accepted"
-            ).order_by("date")[:5]
             stats = {
-                "avg_amount": avg["amount__avg"],
-                "total_today": total_today["amount__sum"] or 0,
-                "total_ever": total_ever["amount__sum"],
-                "last_donations": PaymentFullSerializer(last_donations, many=True).data,
+                "avg_amount": stats_ever["avg_amount"],
+                "total_today": stats_today["total_amount"] or 0,
+                "total_ever": stats_ever["total_amount"],
+                "last_donations": PaymentStatsSerializer(
+                    last_donations, many=True
+                ).data,
             }
-            serializer = json.dumps(stats)
-            return Response(serializer, status=status.HTTP_200_OK)
+            return Response(stats, status=status.HTTP_200_OK)
         except ObjectDoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
 
@@ -0,0 +1,92 @@
+"""
+Streaming of game, core and bios files, whole or by byte range (see MyTerminalViewSet.download)
+
+Files are read from the storage in chunks of DOWNLOAD_CHUNK_SIZE bytes, so they are never held in memory.
+On S3, only the requested range is read, with a ranged GET.
+"""
+
+import re
+
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from fleet.storage import get_s3_object
+
+
+# Files are streamed by chunks of this number of bytes
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class UnsatisfiableRange(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    Return the (first byte, last byte) of a Range header, or None if the whole file must be sent
+
+    Only single ranges are supported, other Range headers are ignored, as allowed by RFC 7233.
+    Raise UnsatisfiableRange if the range is outside of the file.
+    """
+
+    match = _RANGE_RE.match(header.strip()) if header else None
+
+    if match is None or match.groups() == ("", ""):
+        return None
+
+    first, last = match.groups()
+
+    if first == "":  # Suffix range, the last bytes of the file
+        length = int(last)
+        if length == 0 or size == 0:
+            raise UnsatisfiableRange()
+        return max(size - length, 0), size - 1
+
+    first = int(first)
+    last = size - 1 if last == "" else min(int(last), size - 1)
+
+    if first > last:
+        raise UnsatisfiableRange()
+
+    return first, last
+
+
+def iter_file_range(field_file, first, last):
+    """
+    Yield the bytes of a file from first to last (included), by chunks of DOWNLOAD_CHUNK_SIZE bytes
+    """
+
+    if first > last:
+        return
+
+    storage = field_file.storage
+
+    if isinstance(storage, S3Boto3Storage):
+        # Reading the file from the storage would download it whole (see S3Boto3StorageFile)
+        body = get_s3_object(storage, field_file.name).get(
+            Range="bytes={}-{}".format(first, last)
+        )["Body"]
+
+        try:
+            yield from body.iter_chunks(DOWNLOAD_CHUNK_SIZE)
+        finally:
+            body.close()
+
+        return
+
+    file = storage.open(field_file.name, "rb")
+
+    try:
+        file.seek(first)
+        remaining = last - first + 1
+
+        while remaining > 0:
+            chunk = file.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from game.models import BiosFile, CoreFile, GameFile
+
+
+class Command(BaseCommand):
+    help = "Compute the SHA-256 and the size of game, core and bios files uploaded before they were computed on upload"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Compute checksums of all files, even those already computed",
+        )
+
+    def handle(self, *args, **options):
+        for model in (GameFile, CoreFile, BiosFile):
+            files = model.objects.exclude(file="").order_by("pk")
+
+            if not options["all"]:
+                files = files.filter(sha256="")
+
+            for stored_file in files.iterator():
+                try:
+                    stored_file.compute_checksum()
+                except (OSError, ValueError) as e:
+                    self.stderr.write("{} : {}".format(stored_file, e))
+                    continue
+                finally:
+                    stored_file.file.close()
+
+                model.objects.filter(pk=stored_file.pk).update(
+                    sha256=stored_file.sha256, size=stored_file.size
+                )
+                self.stdout.write(
+                    "{} : {} ({} bytes)".format(
+                        stored_file, stored_file.sha256, stored_file.size
+                    )
+                )
+
+        self.stdout.write(self.style.SUCCESS("File checksums computed"))
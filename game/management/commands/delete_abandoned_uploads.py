@@ -0,0 +1,46 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from game.models import FileUpload
+from game.uploads import abort_upload
+
+
+class Command(BaseCommand):
+    help = (
+        "Abort chunked uploads of files started long ago and never completed, "
+        "deleting their parts (or aborting their S3 multipart uploads), and remove completed uploads "
+        "started as long ago, keeping their files. Meant to be run periodically."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours",
+            type=int,
+            default=24,
+            help="Abort uploads started more than this number of hours ago",
+        )
+
+    def handle(self, *args, **options):
+        if options["hours"] < 1:
+            raise CommandError("--hours must be positive")
+
+        limit = timezone.now() - datetime.timedelta(hours=options["hours"])
+        nb_uploads = 0
+
+        for upload in FileUpload.objects.filter(date_added__lt=limit).order_by("pk"):
+            name = str(upload)
+
+            try:
+                abort_upload(upload)
+            except Exception as e:  # pylint: disable=broad-except
+                self.stderr.write("{} : {}".format(name, e))
+                continue
+
+            nb_uploads += 1
+            self.stdout.write("{} aborted".format(name))
+
+        self.stdout.write(
+            self.style.SUCCESS("{} abandoned uploads aborted".format(nb_uploads))
+        )
@@ -0,0 +1,48 @@
+# Generated by Django 3.0.3 on 2026-10-18 08:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("game", "0016_auto_20230606_1618"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="biosfile",
+            name="sha256",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=64
+            ),
+        ),
+        migrations.AddField(
+            model_name="biosfile",
+            name="size",
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="corefile",
+            name="sha256",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=64
+            ),
+        ),
+        migrations.AddField(
+            model_name="corefile",
+            name="size",
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="gamefile",
+            name="sha256",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=64
+            ),
+        ),
+        migrations.AddField(
+            model_name="gamefile",
+            name="size",
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 3.0.3 on 2026-10-18 08:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("game", "0017_file_checksums"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FileUpload",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("rom", "Rom"), ("core", "Core"), ("bios", "Bios")],
+                        max_length=4,
+                    ),
+                ),
+                ("name", models.CharField(max_length=255)),
+                ("size", models.BigIntegerField()),
+                ("sha256", models.CharField(max_length=64)),
+                ("chunk_size", models.IntegerField()),
+                (
+                    "multipart_upload_id",
+                    models.CharField(blank=True, default="", max_length=255),
+                ),
+                ("date_added", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="FileUploadPart",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("number", models.IntegerField()),
+                ("size", models.BigIntegerField()),
+                ("sha256", models.CharField(max_length=64)),
+                ("etag", models.CharField(blank=True, default="", max_length=255)),
+                (
+                    "upload",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="parts",
+                        to="game.FileUpload",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("upload", "number")},
+            },
+        ),
+    ]
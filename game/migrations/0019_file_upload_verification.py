@@ -0,0 +1,40 @@
+# Generated by Django 3.0.3 on 2026-10-18 09:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("game", "0018_file_upload"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="fileupload",
+            name="date_verification_started",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="fileupload",
+            name="error",
+            field=models.CharField(blank=True, default="", max_length=255),
+        ),
+        migrations.AddField(
+            model_name="fileupload",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("uploading", "Uploading"),
+                    ("verifying", "Verifying"),
+                    ("completed", "Completed"),
+                ],
+                default="uploading",
+                max_length=9,
+            ),
+        ),
+        migrations.AddField(
+            model_name="fileupload",
+            name="stored_file_id",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -1,8 +1,52 @@
+import hashlib
+import uuid
+
 from django.db import models
+from django.db.models import Prefetch
+
+from backend.common import count_subquery
+
+
+class StoredFile(models.Model):
+    """
+    File downloaded by terminals, with the SHA-256 and the size of its content,
+    so that terminals only download files that changed (see MyTerminalViewSet.manifest)
+
+    The checksum is computed when a new file is saved, before it is sent to the storage.
+    """
+
+    sha256 = models.CharField(max_length=64, blank=True, default="", editable=False)
+    size = models.BigIntegerField(null=True, blank=True, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def compute_checksum(self):
+        digest = hashlib.sha256()
+
+        for chunk in self.file.chunks():
+            digest.update(chunk)
+
+        self.sha256 = digest.hexdigest()
+        self.size = self.file.size
+
+    def save(self, *args, **kwargs):
+        if (
+            self.file and not self.file._committed
+        ):  # New file, not sent to the storage yet
+            self.compute_checksum()
+
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = set(kwargs["update_fields"]) | {
+                    "sha256",
+                    "size",
+                }
+
+        super().save(*args, **kwargs)
 
 
 # Create your models here.
-class CoreFile(models.Model):
+class CoreFile(StoredFile):
     file = models.FileField(upload_to="games/cores/")
     date_added = models.DateTimeField(auto_now_add=True)
     last_update = models.DateTimeField(auto_now=True)
@@ -11,7 +55,7 @@ class CoreFile(models.Model):
         return "Fichier Core n° {}".format(self.pk)
 
 
-class BiosFile(models.Model):
+class BiosFile(StoredFile):
     file = models.FileField(upload_to="games/bios/")
     date_added = models.DateTimeField(auto_now_add=True)
     last_update = models.DateTimeField(auto_now=True)
@@ -20,7 +64,20 @@ class BiosFile(models.Model):
         return "Fichier Bios n° {}".format(self.pk)
 
 
+class CoreQuerySet(models.QuerySet):
+    def with_nb_games(self):
+        """
+        Annotate the value of the nb_games property, so that it is computed in the query fetching cores
+        """
+
+        return self.annotate(
+            annotated_nb_games=count_subquery(Game.objects.all(), "core")
+        )
+
+
 class Core(models.Model):
+    objects = CoreQuerySet.as_manager()
+
     name = models.CharField(max_length=255)
     path = models.CharField(max_length=255)
     file = models.OneToOneField(CoreFile, on_delete=models.CASCADE)
@@ -35,10 +92,13 @@ class Core(models.Model):
 
     @property
     def nb_games(self):
+        if hasattr(self, "annotated_nb_games"):
+            return self.annotated_nb_games
+
         return self.games.count() or 0
 
 
-class GameFile(models.Model):
+class GameFile(StoredFile):
     file = models.FileField(upload_to="games/roms/")
     date_added = models.DateTimeField(auto_now_add=True)
     last_update = models.DateTimeField(auto_now=True)
@@ -47,7 +107,37 @@ class GameFile(models.Model):
         return "Fichier Rom n° {}".format(self.pk)
 
 
+class GameQuerySet(models.QuerySet):
+    def with_nb_terminals(self):
+        """
+        Annotate the value of the nb_terminals property, so that it is computed in the query fetching games
+        """
+
+        return self.annotate(
+            annotated_nb_terminals=count_subquery(
+                Game.terminals.through.objects.all(), "game"
+            )
+        )
+
+    def with_files(self):
+        """
+        Fetch the rom file and the core of games, with the files and the number of games of the core,
+        so that serializing any number of games takes a constant number of queries
+
+        Cores are prefetched rather than joined, so that their number of games can be annotated.
+        """
+
+        return self.select_related("file").prefetch_related(
+            Prefetch(
+                "core",
+                queryset=Core.objects.with_nb_games().select_related("file", "bios"),
+            )
+        )
+
+
 class Game(models.Model):
+    objects = GameQuerySet.as_manager()
+
     name = models.CharField(max_length=255, verbose_name="Titre")
     path = models.CharField(
         max_length=255, verbose_name="Nom du fichier rom ou répertoire du jeu sur Hera"
@@ -113,7 +203,99 @@ class Game(models.Model):
 
     @property
     def nb_terminals(self):
+        if hasattr(self, "annotated_nb_terminals"):
+            return self.annotated_nb_terminals
+
         return self.terminals.count()
 
     def __str__(self):
         return self.name
+
+
+class FileUpload(models.Model):
+    """
+    Upload of a game, core or bios file sent in parts, that can be resumed until it is completed
+    (see game.uploads). The file object is only created once the completed upload is verified.
+    """
+
+    ROM = "rom"
+    CORE = "core"
+    BIOS = "bios"
+
+    KIND_CHOICES = (
+        (ROM, "Rom"),
+        (CORE, "Core"),
+        (BIOS, "Bios"),
+    )
+
+    UPLOADING = "uploading"
+    VERIFYING = "verifying"
+    COMPLETED = "completed"
+
+    STATUS_CHOICES = (
+        (UPLOADING, "Uploading"),
+        (VERIFYING, "Verifying"),
+        (COMPLETED, "Completed"),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=4, choices=KIND_CHOICES)
+    name = models.CharField(max_length=255)  # Name of the file in the storage
+    size = models.BigIntegerField()
+    sha256 = models.CharField(max_length=64)  # Expected SHA-256 of the whole file
+    chunk_size = models.IntegerField()
+    multipart_upload_id = models.CharField(
+        max_length=255, blank=True, default=""
+    )  # Id of the S3 multipart upload, if the file is stored on S3
+    status = models.CharField(max_length=9, choices=STATUS_CHOICES, default=UPLOADING)
+    error = models.CharField(
+        max_length=255, blank=True, default=""
+    )  # Why the last verification failed, the parts can then be sent again
+    stored_file_id = models.IntegerField(
+        null=True, blank=True
+    )  # File object created once the upload is verified
+    date_added = models.DateTimeField(auto_now_add=True)
+    date_verification_started = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return "Envoi de {}".format(self.name)
+
+    @property
+    def stored_file_model(self):
+        return {self.ROM: GameFile, self.CORE: CoreFile, self.BIOS: BiosFile}[self.kind]
+
+    @property
+    def stored_file(self):
+        if self.stored_file_id is None:
+            return None
+
+        return self.stored_file_model.objects.get(pk=self.stored_file_id)
+
+    @property
+    def nb_parts(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def get_part_size(self, number):
+        """
+        Return the size of a part, numbered from 1 : every part has the size of a chunk but the last one
+        """
+
+        if number < self.nb_parts:
+            return self.chunk_size
+
+        return self.size - (self.nb_parts - 1) * self.chunk_size
+
+
+class FileUploadPart(models.Model):
+    upload = models.ForeignKey(
+        FileUpload, on_delete=models.CASCADE, related_name="parts"
+    )
+    number = models.IntegerField()
+    size = models.BigIntegerField()
+    sha256 = models.CharField(max_length=64)
+    etag = models.CharField(
+        max_length=255, blank=True, default=""
+    )  # ETag of the part in the S3 multipart upload
+
+    class Meta:
+        unique_together = ("upload", "number")
@@ -1,3 +1,376 @@
-from django.test import TestCase
+import datetime
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import uuid
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+
+from botocore.exceptions import ClientError
+
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from fleet.models import User, Customer
+
+from screensaver.models import ScreensaverMedia, ScreensaverBroadcast
+
+from terminal.models import Terminal
+
+from .models import BiosFile, Core, CoreFile, FileUpload, Game, GameFile
+from .uploads import complete_upload, put_part, start_upload
+
+
+class CatalogQueriesTest(TestCase):
+    # Catalog lists annotate counts and fetch relations with their rows, so they take
+    # the same number of queries whatever the size of the catalog
+
+    def setUp(self):
+        self.admin = User.objects.create(username="admin", is_staff=True)
+        self.customer = Customer.objects.create(company="Client")
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+        self._add_to_catalog(0)
+
+    def _add_to_catalog(self, index):
+        core = Core.objects.create(
+            name="Core {}".format(index),
+            path="",
+            description="",
+            file=CoreFile.objects.create(file="core.so"),
+            bios=BiosFile.objects.create(file="bios.bin"),
+        )
+        terminal = Terminal.objects.create(
+            name="Borne {}".format(index),
+            owner=User.objects.create(username="terminal {}".format(index)),
+            customer=self.customer,
+        )
+        media = ScreensaverMedia.objects.create(
+            title="Média {}".format(index), owner=self.admin
+        )
+        ScreensaverBroadcast.objects.create(terminal=terminal, media=media)
+
+        for game_index in range(2):
+            game = Game.objects.create(
+                name="Jeu {} {}".format(index, game_index),
+                path="",
+                description="",
+                file=GameFile.objects.create(file="jeu.rom"),
+                core=core,
+            )
+            terminal.games.add(game)
+
+    def _assert_constant_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        for index in range(1, 4):
+            self._add_to_catalog(index)
+
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get(url)
+
+        return response.json()
+
+    def test_core_list(self):
+        cores = self._assert_constant_queries("/game/core/")
+
+        self.assertEqual(len(cores), 4)
+        self.assertEqual({core["nb_games"] for core in cores}, {2})
+
+    def test_game_list(self):
+        games = self._assert_constant_queries("/games/")
+
+        self.assertEqual(len(games), 8)
+        self.assertEqual({game["nb_terminals"] for game in games}, {1})
+        self.assertEqual({game["core"]["nb_games"] for game in games}, {2})
+
+    def test_screensaver_media_list(self):
+        medias = self._assert_constant_queries("/screensaver-medias/")
+
+        self.assertEqual(len(medias), 4)
+        self.assertEqual({media["nb_terminals"] for media in medias}, {1})
+
+
+@override_settings(UPLOAD_VERIFICATION_IN_BACKGROUND=False)
+class FileUploadTest(TestCase):
+    CONTENT = b"0123456789"
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        upload_settings = override_settings(
+            DEFAULT_FILE_STORAGE="django.core.files.storage.FileSystemStorage",
+            MEDIA_ROOT=self.media_root,
+            UPLOAD_CHUNK_SIZE=4,
+        )
+        upload_settings.enable()
+        self.addCleanup(upload_settings.disable)
+        self.addCleanup(shutil.rmtree, self.media_root)
+
+        self.client = APIClient()
+        self.client.force_authenticate(
+            User.objects.create(username="admin", is_staff=True)
+        )
+
+    def _start_upload(self, sha256=None):
+        response = self.client.post(
+            "/uploads/",
+            {
+                "kind": FileUpload.ROM,
+                "name": "../jeu.rom",
+                "size": len(self.CONTENT),
+                "sha256": sha256 or hashlib.sha256(self.CONTENT).hexdigest(),
+            },
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def _put_part(self, upload, number, data, sha256=None):
+        return self.client.put(
+            "/uploads/{}/parts/{}/".format(upload["id"], number),
+            data,
+            content_type="application/octet-stream",
+            HTTP_X_CONTENT_SHA256=sha256 or hashlib.sha256(data).hexdigest(),
+        )
+
+    def test_upload(self):
+        upload = self._start_upload()
+        self.assertEqual((upload["chunk_size"], upload["nb_parts"]), (4, 3))
+
+        self.assertEqual(self._put_part(upload, 3, b"89").status_code, 200)
+        self.assertEqual(self._put_part(upload, 1, b"0123").status_code, 200)
+
+        # Incomplete upload is resumed from the parts already received
+        response = self.client.post("/uploads/{}/complete/".format(upload["id"]))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(GameFile.objects.exists())
+
+        upload = self.client.get("/uploads/{}/".format(upload["id"])).json()
+        self.assertEqual(upload["parts"], [1, 3])
+
+        # Parts are checked against their size and their SHA-256, which is required
+        self.assertEqual(self._put_part(upload, 2, b"45678").status_code, 400)
+        response = self._put_part(
+            upload, 2, b"4567", sha256=hashlib.sha256(b"4568").hexdigest()
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.put(
+            "/uploads/{}/parts/2/".format(upload["id"]),
+            b"4567",
+            content_type="application/octet-stream",
+        )
+        self.assertEqual(response.status_code, 400)
+
+        self.assertEqual(self._put_part(upload, 2, b"4567").status_code, 200)
+
+        response = self.client.post("/uploads/{}/complete/".format(upload["id"]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], FileUpload.COMPLETED)
+
+        game_file = GameFile.objects.get(pk=response.json()["file"]["id"])
+        self.assertEqual(game_file.file.name, "games/roms/jeu.rom")
+        self.assertEqual(game_file.file.read(), self.CONTENT)
+        self.assertEqual(game_file.sha256, hashlib.sha256(self.CONTENT).hexdigest())
+        self.assertEqual(game_file.size, len(self.CONTENT))
+        game_file.file.close()
+
+        self.assertFalse(
+            os.listdir(os.path.join(self.media_root, "uploads", upload["id"]))
+        )
+
+        # Completing the upload again returns the same file
+        response = self.client.post("/uploads/{}/complete/".format(upload["id"]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["file"]["id"], game_file.pk)
+        self.assertEqual(GameFile.objects.count(), 1)
+
+        # Deleting the completed upload keeps its file
+        response = self.client.delete("/uploads/{}/".format(upload["id"]))
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(FileUpload.objects.exists())
+        self.assertTrue(GameFile.objects.filter(pk=game_file.pk).exists())
+
+    def test_corrupted_upload_is_refused(self):
+        upload = self._start_upload(sha256=hashlib.sha256(b"9876543210").hexdigest())
+
+        for number, data in enumerate((b"0123", b"4567", b"89"), start=1):
+            self._put_part(upload, number, data)
+
+        response = self.client.post("/uploads/{}/complete/".format(upload["id"]))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["status"], FileUpload.UPLOADING)
+        self.assertIn(
+            hashlib.sha256(self.CONTENT).hexdigest(), response.json()["error"]
+        )
+        self.assertFalse(GameFile.objects.exists())
+        self.assertFalse(
+            os.path.exists(os.path.join(self.media_root, "games/roms/jeu.rom"))
+        )
+
+        # The upload is resumed, parts are kept and can be sent again
+        self.assertEqual(response.json()["parts"], [1, 2, 3])
+        self.assertEqual(self._put_part(upload, 2, b"4567").status_code, 200)
+
+        response = self.client.delete("/uploads/{}/".format(upload["id"]))
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(FileUpload.objects.exists())
+
+    @override_settings(UPLOAD_VERIFICATION_IN_BACKGROUND=True)
+    def test_upload_is_verified_in_background(self):
+        upload = self._start_upload()
+
+        for number, data in enumerate((b"0123", b"4567", b"89"), start=1):
+            self._put_part(upload, number, data)
+
+        with mock.patch("game.uploads.threading.Thread") as thread:
+            response = self.client.post("/uploads/{}/complete/".format(upload["id"]))
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.json()["status"], FileUpload.VERIFYING)
+            thread.return_value.start.assert_called_once()
+
+            # Parts cannot be sent nor the upload deleted while it is verified
+            self.assertEqual(self._put_part(upload, 1, b"0123").status_code, 400)
+            response = self.client.delete("/uploads/{}/".format(upload["id"]))
+            self.assertEqual(response.status_code, 400)
+
+            # Completing the upload again does not start another verification
+            response = self.client.post("/uploads/{}/complete/".format(upload["id"]))
+            self.assertEqual(response.status_code, 202)
+            thread.return_value.start.assert_called_once()
+
+            # Unless the verification did not finish
+            FileUpload.objects.filter(pk=upload["id"]).update(
+                date_verification_started=timezone.now() - datetime.timedelta(hours=2)
+            )
+            response = self.client.post("/uploads/{}/complete/".format(upload["id"]))
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(thread.return_value.start.call_count, 2)
+
+        self.assertFalse(GameFile.objects.exists())
+
+    def test_abandoned_uploads_are_deleted(self):
+        old_upload = self._start_upload()
+        self._put_part(old_upload, 1, b"0123")
+        FileUpload.objects.filter(pk=old_upload["id"]).update(
+            date_added=timezone.now() - datetime.timedelta(hours=25)
+        )
+        upload = self._start_upload()
+
+        call_command("delete_abandoned_uploads", "--hours=24", stdout=io.StringIO())
+
+        self.assertEqual(
+            list(FileUpload.objects.values_list("pk", flat=True)),
+            [uuid.UUID(upload["id"])],
+        )
+        self.assertFalse(
+            os.listdir(os.path.join(self.media_root, "uploads", old_upload["id"]))
+        )
+
+
+@override_settings(UPLOAD_CHUNK_SIZE=4, UPLOAD_VERIFICATION_IN_BACKGROUND=False)
+class S3MultipartUploadTest(TestCase):
+    CONTENT = b"0123456789"
+
+    def setUp(self):
+        self.storage = S3Boto3Storage()
+        self.s3_object = mock.MagicMock(
+            bucket_name="bucket", key="games/roms/jeu.rom", content_length=None
+        )
+        self.s3_object.initiate_multipart_upload.return_value.id = "upload-id"
+        self.multipart_upload = self.s3_object.MultipartUpload.return_value
+        self.multipart_upload.Part.return_value.upload.return_value = {"ETag": "etag"}
+        self.multipart_upload.Part.return_value.copy_from.return_value = {
+            "CopyPartResult": {"ETag": "copied-etag"}
+        }
+
+        for patch in (
+            mock.patch("game.uploads.default_storage", self.storage),
+            mock.patch("game.uploads.get_s3_object", return_value=self.s3_object),
+            mock.patch.object(self.storage, "get_available_name", lambda name: name),
+            mock.patch.object(self.storage, "delete"),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def _upload(self, stored_content):
+        self.s3_object.get.return_value = {
+            "Body": mock.Mock(iter_chunks=lambda chunk_size: iter([stored_content]))
+        }
+
+        upload = start_upload(
+            FileUpload.ROM,
+            "jeu.rom",
+            len(self.CONTENT),
+            hashlib.sha256(self.CONTENT).hexdigest(),
+        )
+
+        for number, data in enumerate((b"0123", b"4567", b"89"), start=1):
+            put_part(upload, number, data, hashlib.sha256(data).hexdigest())
+
+        return complete_upload(upload)
+
+    def test_assembled_file_is_read_back_to_check_its_checksum(self):
+        upload = self._upload(self.CONTENT)
+
+        self.assertEqual(upload.status, FileUpload.COMPLETED)
+        self.assertEqual(
+            upload.stored_file.sha256, hashlib.sha256(self.CONTENT).hexdigest()
+        )
+        self.multipart_upload.complete.assert_called_once()
+
+    def test_corrupted_file_is_replaced_by_its_parts(self):
+        upload = self._upload(b"9876543210")
+
+        self.assertEqual(upload.status, FileUpload.UPLOADING)
+        self.assertIn(hashlib.sha256(b"9876543210").hexdigest(), upload.error)
+        self.assertFalse(GameFile.objects.exists())
+
+        # Parts of the assembled file are copied by S3 to a new multipart upload, then it is deleted
+        self.assertEqual(self.s3_object.initiate_multipart_upload.call_count, 2)
+        self.assertEqual(
+            [
+                call.kwargs["CopySourceRange"]
+                for call in self.multipart_upload.Part.return_value.copy_from.call_args_list
+            ],
+            ["bytes=0-3", "bytes=4-7", "bytes=8-9"],
+        )
+        self.storage.delete.assert_called_once_with("games/roms/jeu.rom")
+        self.assertEqual(
+            list(upload.parts.values_list("etag", flat=True)), ["copied-etag"] * 3
+        )
+
+        # Parts can be sent again
+        put_part(upload, 2, b"4567", hashlib.sha256(b"4567").hexdigest())
+
+    def test_upload_already_assembled_by_s3_is_verified_again(self):
+        # For example when the verification was interrupted after S3 completed the multipart upload
+        self.multipart_upload.complete.side_effect = ClientError(
+            {"Error": {"Code": "NoSuchUpload"}}, "CompleteMultipartUpload"
+        )
+        self.s3_object.content_length = len(self.CONTENT)
+
+        upload = self._upload(self.CONTENT)
+
+        self.assertEqual(upload.status, FileUpload.COMPLETED)
+        self.assertEqual(upload.stored_file.size, len(self.CONTENT))
+
+    def test_expired_upload_is_refused(self):
+        self.multipart_upload.complete.side_effect = ClientError(
+            {"Error": {"Code": "NoSuchUpload"}}, "CompleteMultipartUpload"
+        )
+
+        upload = self._upload(self.CONTENT)
+
+        self.assertEqual(upload.status, FileUpload.UPLOADING)
+        self.assertIn("expired", upload.error)
+        self.assertFalse(GameFile.objects.exists())
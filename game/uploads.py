@@ -0,0 +1,467 @@
+"""
+Chunked, resumable uploads of game, core and bios files (see FileUpload and FileUploadViewSet)
+
+An upload is started with the size and the SHA-256 of the file, then its parts are sent in any order,
+each part being checked against its own SHA-256 and stored as soon as it is received. Parts can be sent
+again until the upload is completed.
+
+Completing the upload only marks it as being verified : the parts are assembled in the storage, the SHA-256
+of the assembled file is checked and the GameFile, CoreFile or BiosFile is created out of the request,
+in a thread (see UPLOAD_VERIFICATION_IN_BACKGROUND), while the client polls the upload for its status.
+If the assembled file is corrupted, the upload can be resumed : its parts are kept and can be sent again.
+
+On S3, parts are sent to a multipart upload, so the file is never held by the server, and the assembled
+file is read back from S3 to compute its SHA-256. With other storages (the local file system in development
+and tests), parts are stored as separate files, concatenated when the upload is verified.
+
+Uploads that are never completed nor aborted are removed by the delete_abandoned_uploads command.
+"""
+
+import base64
+import datetime
+import hashlib
+import logging
+import mimetypes
+import os
+import threading
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from rest_framework.exceptions import ValidationError
+
+from botocore.exceptions import ClientError
+
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from fleet.storage import get_s3_object
+
+from .downloads import DOWNLOAD_CHUNK_SIZE
+from .models import FileUpload, FileUploadPart
+
+logger = logging.getLogger(__name__)
+
+
+def start_upload(kind, file_name, size, sha256):
+    """
+    Create the upload of a file of the given kind (see FileUpload.KIND_CHOICES)
+    """
+
+    upload = FileUpload(
+        kind=kind,
+        size=size,
+        sha256=sha256.lower(),
+        chunk_size=settings.UPLOAD_CHUNK_SIZE,
+    )
+
+    file_field = upload.stored_file_model._meta.get_field("file")
+    upload.name = file_field.generate_filename(None, os.path.basename(file_name))
+
+    if len(upload.name) > file_field.max_length:
+        raise ValidationError({"name": "File name is too long"})
+
+    _get_backend().start(upload)
+    upload.save()
+
+    return upload
+
+
+def put_part(upload: FileUpload, number, data, sha256):
+    """
+    Store a part of an upload, numbered from 1, replacing it if it was already sent
+
+    sha256 is the SHA-256 of the part computed by the client, the part is refused if it does not match
+    """
+
+    if upload.status != FileUpload.UPLOADING:
+        raise ValidationError({"status": "Upload is {}".format(upload.status)})
+
+    if not sha256:
+        raise ValidationError({"sha256": "SHA-256 of the part is required"})
+
+    if not 1 <= number <= upload.nb_parts:
+        raise ValidationError(
+            {"number": "Part number must be between 1 and {}".format(upload.nb_parts)}
+        )
+
+    if len(data) != upload.get_part_size(number):
+        raise ValidationError(
+            {
+                "size": "Part {} must have {} bytes, {} received".format(
+                    number, upload.get_part_size(number), len(data)
+                )
+            }
+        )
+
+    digest = hashlib.sha256(data).hexdigest()
+
+    if sha256.lower() != digest:
+        raise ValidationError({"sha256": "Part {} is corrupted".format(number)})
+
+    etag = _get_backend().put_part(upload, number, data)
+
+    part, _ = FileUploadPart.objects.update_or_create(
+        upload=upload,
+        number=number,
+        defaults={"size": len(data), "sha256": digest, "etag": etag},
+    )
+
+    return part
+
+
+def complete_upload(upload: FileUpload):
+    """
+    Start the verification of an upload once all of its parts are received, in a thread or in the request
+    (see UPLOAD_VERIFICATION_IN_BACKGROUND), and return the upload with its new status
+
+    Completing an upload again while it is verified or once it is completed has no effect, so that requests
+    can be retried, but a verification that did not finish after UPLOAD_VERIFICATION_TIMEOUT is started again.
+    """
+
+    parts = list(upload.parts.order_by("number"))
+
+    if upload.status == FileUpload.UPLOADING:
+        missing_parts = set(range(1, upload.nb_parts + 1)) - {
+            part.number for part in parts
+        }
+        if missing_parts:
+            raise ValidationError(
+                {"parts": "Missing parts : {}".format(sorted(missing_parts))}
+            )
+
+    now = timezone.now()
+
+    # Updated from a queryset, so that concurrent requests start a single verification
+    started = (
+        FileUpload.objects.filter(pk=upload.pk)
+        .filter(
+            Q(status=FileUpload.UPLOADING)
+            | Q(
+                status=FileUpload.VERIFYING,
+                date_verification_started__lt=now
+                - datetime.timedelta(seconds=settings.UPLOAD_VERIFICATION_TIMEOUT),
+            )
+        )
+        .update(status=FileUpload.VERIFYING, error="", date_verification_started=now)
+    )
+
+    if started:
+        if settings.UPLOAD_VERIFICATION_IN_BACKGROUND:
+            thread = threading.Thread(
+                target=_verify_upload_in_thread, args=(upload.pk,), daemon=True
+            )
+            thread.start()
+        else:
+            _verify_upload(FileUpload.objects.get(pk=upload.pk))
+
+    upload.refresh_from_db()
+    return upload
+
+
+def abort_upload(upload: FileUpload):
+    """
+    Delete an upload with its parts, the file of a completed upload is kept
+    """
+
+    if upload.status == FileUpload.VERIFYING and upload.date_verification_started > (
+        timezone.now()
+        - datetime.timedelta(seconds=settings.UPLOAD_VERIFICATION_TIMEOUT)
+    ):
+        raise ValidationError({"status": "Upload is verifying"})
+
+    if upload.status != FileUpload.COMPLETED:
+        backend = _get_backend()
+        backend.abort(upload)
+        backend.delete_parts(upload, upload.parts.all())
+
+    upload.delete()
+
+
+def _verify_upload_in_thread(upload_pk):
+    try:
+        _verify_upload(FileUpload.objects.get(pk=upload_pk))
+    finally:
+        connections.close_all()  # Connections of this thread are not closed by Django
+
+
+def _verify_upload(upload: FileUpload):
+    """
+    Assemble the parts of an upload and check the SHA-256 of the assembled file, then create its file object
+
+    Errors are saved in the upload, which can then be resumed, instead of being raised.
+    """
+
+    parts = list(upload.parts.order_by("number"))
+    backend = _get_backend()
+
+    try:
+        name, sha256 = backend.complete(upload, parts)
+
+        if sha256 != upload.sha256:
+            # Every part matched its own SHA-256 when it was received, they are kept so that the client
+            # can send again the ones it did not expect, instead of the whole file
+            backend.reopen(upload, name, parts)
+
+            with transaction.atomic():
+                FileUploadPart.objects.bulk_update(parts, ["etag"])
+                upload.save(update_fields=["multipart_upload_id"])
+
+            backend.storage.delete(name)
+            raise ValidationError(
+                "File is corrupted, its SHA-256 is {}, parts can be sent again".format(
+                    sha256
+                )
+            )
+    except ValidationError as error:
+        _set_failed(upload, error.detail[0])
+        return
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Upload %s could not be verified", upload.pk)
+        _set_failed(
+            upload, "File could not be assembled, the upload can be completed again"
+        )
+        return
+
+    with transaction.atomic():
+        stored_file = upload.stored_file_model(
+            file=name, sha256=sha256, size=upload.size
+        )
+        stored_file.save()
+
+        upload.status = FileUpload.COMPLETED
+        upload.stored_file_id = stored_file.pk
+        upload.save(update_fields=["status", "stored_file_id"])
+        upload.parts.all().delete()
+
+    backend.delete_parts(upload, parts)
+
+
+def _set_failed(upload: FileUpload, error):
+    upload.status = FileUpload.UPLOADING
+    upload.error = error
+    upload.save(update_fields=["status", "error"])
+
+
+def _get_error_code(error: ClientError):
+    return error.response.get("Error", {}).get("Code")
+
+
+def _get_backend():
+    if isinstance(default_storage, S3Boto3Storage):
+        return _S3MultipartBackend(default_storage)
+
+    return _StorageBackend(default_storage)
+
+
+class _StorageBackend:
+    """
+    Parts stored as separate files of the storage, concatenated when the upload is completed
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def _get_part_name(self, upload, number):
+        return "uploads/{}/{}".format(upload.pk, number)
+
+    def start(self, upload):
+        pass
+
+    def put_part(self, upload, number, data):
+        part_name = self._get_part_name(upload, number)
+        self.storage.delete(part_name)  # Part sent again
+        self.storage.save(part_name, ContentFile(data))
+        return ""
+
+    def complete(self, upload, parts):
+        content = _ConcatenatedParts(
+            [self._get_part_name(upload, part.number) for part in parts], self.storage
+        )
+
+        try:
+            name = self.storage.save(upload.name, File(content, name=upload.name))
+        finally:
+            content.close()
+
+        return name, content.digest.hexdigest()
+
+    def reopen(self, upload, name, parts):
+        pass  # Parts are kept until the upload is completed
+
+    def abort(self, upload):
+        pass
+
+    def delete_parts(self, upload, parts):
+        for part in parts:
+            self.storage.delete(self._get_part_name(upload, part.number))
+
+
+class _ConcatenatedParts:
+    """
+    Read-only file concatenating files of a storage, computing the SHA-256 of what is read
+    """
+
+    def __init__(self, names, storage):
+        self.names = list(names)
+        self.storage = storage
+        self.size = sum(storage.size(name) for name in self.names)
+        self.digest = hashlib.sha256()
+        self.current = None
+
+    def read(self, size=-1):
+        data = b""
+
+        if size == 0:
+            return data
+
+        while self.names or self.current is not None:
+            if self.current is None:
+                self.current = self.storage.open(self.names.pop(0), "rb")
+
+            chunk = self.current.read(size if size < 0 else size - len(data))
+            data += chunk
+
+            if size < 0 or not chunk:
+                self.current.close()
+                self.current = None
+
+            if 0 <= size == len(data):
+                break
+
+        self.digest.update(data)
+        return data
+
+    def close(self):
+        if self.current is not None:
+            self.current.close()
+            self.current = None
+
+
+class _S3MultipartBackend:
+    """
+    Parts sent to a S3 multipart upload, assembled by S3 when the upload is completed
+
+    Each part is checked against its SHA-256 when it is received (see put_part) and by S3 against its MD5.
+    The SHA-256 of the assembled file is computed by reading it back from S3, since S3 only computes
+    checksums of multipart objects from the checksums of their parts.
+    """
+
+    def __init__(self, storage: S3Boto3Storage):
+        self.storage = storage
+
+    def _get_multipart_upload(self, upload):
+        return get_s3_object(self.storage, upload.name).MultipartUpload(
+            upload.multipart_upload_id
+        )
+
+    def _initiate_multipart_upload(self, upload):
+        # Same parameters as S3Boto3StorageFile.write
+        parameters = self.storage.object_parameters.copy()
+        if self.storage.default_acl:
+            parameters["ACL"] = self.storage.default_acl
+        parameters["ContentType"] = (
+            mimetypes.guess_type(upload.name)[0] or self.storage.default_content_type
+        )
+        if self.storage.reduced_redundancy:
+            parameters["StorageClass"] = "REDUCED_REDUNDANCY"
+        if self.storage.encryption:
+            parameters["ServerSideEncryption"] = "AES256"
+
+        upload.multipart_upload_id = (
+            get_s3_object(self.storage, upload.name)
+            .initiate_multipart_upload(**parameters)
+            .id
+        )
+
+    def _get_size(self, name):
+        try:
+            return get_s3_object(self.storage, name).content_length
+        except ClientError as error:
+            if _get_error_code(error) in ("404", "NoSuchKey"):
+                return None
+            raise
+
+    def start(self, upload):
+        upload.name = self.storage.get_available_name(upload.name)
+        self._initiate_multipart_upload(upload)
+
+    def put_part(self, upload, number, data):
+        try:
+            response = (
+                self._get_multipart_upload(upload)
+                .Part(number)
+                .upload(
+                    Body=data,
+                    ContentMD5=base64.b64encode(hashlib.md5(data).digest()).decode(),
+                )
+            )
+        except ClientError as error:
+            # Aborted, for example by a lifecycle rule of the bucket
+            if _get_error_code(error) == "NoSuchUpload":
+                raise ValidationError(
+                    {"id": "Upload expired, it must be started again"}
+                )
+            raise
+
+        return response["ETag"]
+
+    def complete(self, upload, parts):
+        try:
+            self._get_multipart_upload(upload).complete(
+                MultipartUpload={
+                    "Parts": [
+                        {"ETag": part.etag, "PartNumber": part.number} for part in parts
+                    ]
+                }
+            )
+        except ClientError as error:
+            if _get_error_code(error) != "NoSuchUpload":
+                raise
+
+            # Already completed by a verification that did not finish, the assembled file is verified again
+            if self._get_size(upload.name) != upload.size:
+                raise ValidationError("Upload expired, it must be started again")
+
+        digest = hashlib.sha256()
+        body = get_s3_object(self.storage, upload.name).get()["Body"]
+
+        try:
+            for chunk in body.iter_chunks(DOWNLOAD_CHUNK_SIZE):
+                digest.update(chunk)
+        finally:
+            body.close()
+
+        return upload.name, digest.hexdigest()
+
+    def reopen(self, upload, name, parts):
+        """
+        Start a new multipart upload with the parts of the assembled file, copied by S3,
+        since the parts of a completed multipart upload are removed (the assembled file is then deleted)
+        """
+
+        s3_object = get_s3_object(self.storage, name)
+        self._initiate_multipart_upload(upload)
+        multipart_upload = self._get_multipart_upload(upload)
+
+        for part in parts:
+            start = (part.number - 1) * upload.chunk_size
+            response = multipart_upload.Part(part.number).copy_from(
+                CopySource={"Bucket": s3_object.bucket_name, "Key": s3_object.key},
+                CopySourceRange="bytes={}-{}".format(start, start + part.size - 1),
+            )
+            part.etag = response["CopyPartResult"]["ETag"]
+
+    def abort(self, upload):
+        try:
+            self._get_multipart_upload(upload).abort()
+        except ClientError as error:
+            # Already aborted, for example by a lifecycle rule of the bucket
+            if _get_error_code(error) != "NoSuchUpload":
+                raise
+
+    def delete_parts(self, upload, parts):
+        pass  # Parts are removed by S3 when the multipart upload is completed or aborted
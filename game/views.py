@@ -12,7 +12,7 @@ from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser
-from rest_framework import viewsets
+from rest_framework import mixins, viewsets
 
 from django.shortcuts import get_object_or_404
 
@@ -21,7 +21,8 @@ from .forms import *
 from fleet.models import User
 from backend.permissions import IsAdminOrCustomerUser, NonAdminUserCanOnlyGet
 
-from .models import Core, Game
+from .models import Core, Game, FileUpload
+from .uploads import abort_upload, complete_upload, put_part, start_upload
 
 
 class _CoreFileSerializer(serializers.ModelSerializer):
@@ -109,6 +110,15 @@ class GameViewSet(viewsets.ModelViewSet):
 
         return _GameSerializer
 
+    def get_queryset(self):
+        user: User = self.request.user
+
+        if user.is_staff and self.action in ("list", "retrieve"):
+            # Relations and number of terminals serialized by _ExtendedGameSerializer are fetched with games
+            return Game.objects.with_nb_terminals().with_files()
+
+        return Game.objects.all()
+
     def list(self, request, *args, **kwargs):
         serializer = self.get_serializer(
             self.get_queryset().filter(is_archived=False).order_by("-featured", "name"),
@@ -163,10 +173,126 @@ class GameViewSet(viewsets.ModelViewSet):
         return Response(status=status.HTTP_200_OK)
 
 
+class _FileUploadSerializer(serializers.ModelSerializer):
+    sha256 = serializers.RegexField(r"^[0-9a-fA-F]{64}$")
+    size = serializers.IntegerField(min_value=1)
+    nb_parts = serializers.ReadOnlyField()
+    parts = serializers.SerializerMethodField()
+    file = serializers.SerializerMethodField()
+
+    class Meta:
+        model = FileUpload
+        fields = (
+            "id",
+            "kind",
+            "name",
+            "size",
+            "sha256",
+            "chunk_size",
+            "nb_parts",
+            "parts",
+            "status",
+            "error",
+            "file",
+        )
+        read_only_fields = ("chunk_size", "status", "error")
+
+    def get_parts(self, upload):
+        # Numbers of the parts already received
+        return list(upload.parts.order_by("number").values_list("number", flat=True))
+
+    def get_file(self, upload):
+        # File created once the upload is completed, like the upload endpoints of files sent in a single request
+        stored_file = upload.stored_file
+
+        if stored_file is None:
+            return None
+
+        serializer_class = {
+            GameFile: _GameFileSerializer,
+            CoreFile: _CoreFileSerializer,
+            BiosFile: _BiosFileSerializer,
+        }[type(stored_file)]
+
+        return serializer_class(stored_file).data
+
+    def create(self, validated_data):
+        return start_upload(
+            validated_data["kind"],
+            validated_data["name"],
+            validated_data["size"],
+            validated_data["sha256"],
+        )
+
+
+class FileUploadViewSet(
+    mixins.CreateModelMixin,
+    mixins.RetrieveModelMixin,
+    mixins.DestroyModelMixin,
+    viewsets.GenericViewSet,
+):
+    """
+    Chunked, resumable uploads of game, core and bios files (see game.uploads) :
+    - POST with kind, name, size and sha256 of the file starts an upload, and returns its id and chunk_size
+    - PUT parts/<number>/ sends a part of the file
+    - GET returns the numbers of the parts already received, to resume the upload, its status and its file
+    - POST complete/ starts the verification of the upload once all parts are received
+    - DELETE aborts the upload
+    """
+
+    serializer_class = _FileUploadSerializer
+    queryset = FileUpload.objects.all()
+    permission_classes = [IsAuthenticated, IsAdminUser]  # Only admin
+
+    def perform_destroy(self, instance):
+        abort_upload(instance)
+
+    @action(detail=True, methods=["put"], url_path=r"parts/(?P<number>[0-9]+)")
+    def part(self, request, pk, number):  # pylint: disable=unused-argument
+        """
+        Endpoint to send a part of the file, numbered from 1, as the raw body of the request
+        Every part has chunk_size bytes, but the last one.
+
+        Required headers :
+        - X-Content-SHA256 : SHA-256 of the part, checked before it is stored
+        """
+        upload: FileUpload = self.get_object()
+
+        # Read the body as a stream, so that it is not limited by DATA_UPLOAD_MAX_MEMORY_SIZE
+        data = request.stream.read(upload.chunk_size + 1) if request.stream else b""
+
+        part = put_part(
+            upload, int(number), data, request.META.get("HTTP_X_CONTENT_SHA256")
+        )
+
+        return Response(
+            {"number": part.number, "size": part.size, "sha256": part.sha256}
+        )
+
+    @action(detail=True, methods=["post"])
+    def complete(self, request, pk):  # pylint: disable=unused-argument
+        """
+        Endpoint to complete the upload, once all of its parts are received
+        The file is assembled and verified out of the request (see game.uploads), the upload is returned with
+        the status verifying, and is polled until its status is completed, with the created file.
+        If the file is corrupted, its status is uploading again with an error, and parts can be sent again.
+        """
+        upload = complete_upload(self.get_object())
+
+        if upload.status == FileUpload.COMPLETED:
+            response_status = status.HTTP_200_OK
+        elif upload.status == FileUpload.VERIFYING:
+            response_status = status.HTTP_202_ACCEPTED
+        else:  # Verified in the request
+            response_status = status.HTTP_400_BAD_REQUEST
+
+        return Response(self.get_serializer(upload).data, status=response_status)
+
+
 # Core Model
 class CoreListView(ListAPIView):
     serializer_class = _CoreSerializer
-    queryset = Core.objects.filter()
+    queryset = Core.objects.with_nb_games().select_related("file", "bios")
     permission_classes = [IsAuthenticated, IsAdminUser]  # Only admin
 
 
@@ -178,7 +304,7 @@ class CoreCreateView(CreateAPIView):
 
 class CoreRetrieveDestroyView(RetrieveDestroyAPIView):
     serializer_class = _CoreSerializer
-    queryset = Core.objects.filter()
+    queryset = Core.objects.with_nb_games().select_related("file", "bios")
     permission_classes = [IsAuthenticated, IsAdminUser]  # Only admin
 
 
@@ -1,8 +1,26 @@
+from django.apps import apps
 from django.db import models
 from django.conf import settings
 
+from backend.common import count_subquery
+
+
+class ScreensaverMediaQuerySet(models.QuerySet):
+    def with_nb_terminals(self):
+        """
+        Annotate the value of the nb_terminals property, so that it is computed in the query fetching medias
+        """
+
+        ScreensaverBroadcast = apps.get_model("screensaver", "ScreensaverBroadcast")
+        return self.annotate(
+            annotated_nb_terminals=count_subquery(
+                ScreensaverBroadcast.objects.all(), "media"
+            )
+        )
+
 
 class ScreensaverMedia(models.Model):
+    objects = ScreensaverMediaQuerySet.as_manager()
 
     PUBLIC_SCOPE = "public"
     PRIVATE_SCOPE = "private"
@@ -53,4 +71,7 @@ class ScreensaverMedia(models.Model):
 
     @property
     def nb_terminals(self):
+        if hasattr(self, "annotated_nb_terminals"):
+            return self.annotated_nb_terminals
+
         return self.screensaver_broadcasts.count()
@@ -14,32 +14,36 @@ from fleet import serializers
 from fleet.models import User
 
 from screensaver.models import ScreensaverMedia, ScreensaverBroadcast
-from screensaver.serializers import ScreenSaverMediaSerializer, ScreenSaverBroadcastSerializer
+from screensaver.serializers import (
+    ScreenSaverMediaSerializer,
+    ScreenSaverBroadcastSerializer,
+)
 
 
 class ScreenSaverMediaViewSet(viewsets.ModelViewSet):
-
     class _CustomPermission(permissions.BasePermission):
         """
         Custom permission for ScreenSaverMediaViewSet
         """
 
         def has_object_permission(self, request, view, obj: ScreensaverMedia):
-
             user: User = request.user
 
             if user.is_customer_user():
-                if request.method == 'GET':
+                if request.method == "GET":
                     # Allow user to fetch media only if they are the owner or if the media is public
-                    return obj.scope == obj.PUBLIC_SCOPE or obj.owner == user 
+                    return obj.scope == obj.PUBLIC_SCOPE or obj.owner == user
 
                 else:
                     # Allow user to put, post or delete media only if they are the owner
-                    return obj.owner == user and user.get_customer().can_edit_screensaver_broadcasts
+                    return (
+                        obj.owner == user
+                        and user.get_customer().can_edit_screensaver_broadcasts
+                    )
 
             elif user.is_staff:
                 # Allow staff member to fetch, post, put or delete media only if this media belong to a staff member or if this media is public
-                return obj.scope == obj.PUBLIC_SCOPE or obj.owner.is_staff 
+                return obj.scope == obj.PUBLIC_SCOPE or obj.owner.is_staff
 
             else:
                 raise PermissionDenied()
@@ -53,39 +57,48 @@ class ScreenSaverMediaViewSet(viewsets.ModelViewSet):
 
         if user.is_staff:
             # Allow staff member to fetch, media only if this media belong to a staff member or if this media is public
-            return ScreensaverMedia.objects.filter(Q(owner__is_staff=True) | Q(scope=ScreensaverMedia.PUBLIC_SCOPE))
+            queryset = ScreensaverMedia.objects.filter(
+                Q(owner__is_staff=True) | Q(scope=ScreensaverMedia.PUBLIC_SCOPE)
+            )
 
         elif user.is_customer_user():
             # Allow user to fetch media only if they are the owner or if the media is public
-            return ScreensaverMedia.objects.filter(
+            queryset = ScreensaverMedia.objects.filter(
                 Q(owner=user) | Q(scope=ScreensaverMedia.PUBLIC_SCOPE)
             )
 
         else:
             raise PermissionDenied()
 
+        # Owner and number of terminals serialized with medias are fetched with them
+        return queryset.with_nb_terminals().select_related("owner")
 
-class ScreenSaverBroadcastViewSet(viewsets.ModelViewSet):
 
+class ScreenSaverBroadcastViewSet(viewsets.ModelViewSet):
     class _CustomPermission(permissions.BasePermission):
         """
         Custom permission for ScreenSaverBroadcastViewSet
         """
 
         def has_object_permission(self, request, view, obj: ScreensaverMedia):
-
             user: User = request.user
 
             if user.is_customer_user():
-                if request.method == 'GET':
-                    return obj.terminal.customer == user.get_customer()
+                if request.method == "GET":
+                    return obj.terminal.customer_id == user.role.customer_id
 
                 else:
-                    return obj.terminal.customer == user.get_customer() and user.get_customer().can_edit_screensaver_broadcasts
+                    return (
+                        obj.terminal.customer_id == user.role.customer_id
+                        and user.get_customer().can_edit_screensaver_broadcasts
+                    )
 
             elif user.is_staff:
                 # Allow staff member to fetch, post, put or delete media only if this media belong to a staff member or if this media is public
-                return obj.media.scope == ScreensaverMedia.PUBLIC_SCOPE or obj.media.owner.is_staff
+                return (
+                    obj.media.scope == ScreensaverMedia.PUBLIC_SCOPE
+                    or obj.media.owner.is_staff
+                )
 
             else:
                 raise PermissionDenied()
@@ -103,13 +116,14 @@ class ScreenSaverBroadcastViewSet(viewsets.ModelViewSet):
 
         if user.is_customer_user():
             # Customer user can access every broadcast to a terminal that belong to themselves
-            return ScreensaverBroadcast.objects.filter(terminal__customer=user.get_customer())
+            return ScreensaverBroadcast.objects.filter(
+                terminal__customer_id=user.role.customer_id
+            )
 
         else:
             raise PermissionDenied()
 
-
-    @action(detail=True, methods=['post'])
+    @action(detail=True, methods=["post"])
     def activate(self, request, pk):
         broadcast = get_object_or_404(self.get_queryset(), pk=pk)
 
@@ -119,7 +133,7 @@ class ScreenSaverBroadcastViewSet(viewsets.ModelViewSet):
         serializer = ScreenSaverBroadcastSerializer(broadcast)
         return Response(serializer.data)
 
-    @action(detail=True, methods=['post'])
+    @action(detail=True, methods=["post"])
     def deactivate(self, request, pk):
         broadcast = get_object_or_404(self.get_queryset(), pk=pk)
 
@@ -127,4 +141,4 @@ class ScreenSaverBroadcastViewSet(viewsets.ModelViewSet):
         broadcast.save()
 
         serializer = ScreenSaverBroadcastSerializer(broadcast)
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
@@ -1,10 +1,21 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 
-from .models import Terminal, Donator, Session, Payment
+from .models import (
+    Terminal,
+    Donator,
+    Session,
+    Payment,
+    PaymentDailyRollup,
+    PaymentAuditEntry,
+    TerminalApiKey,
+    TerminalBandwidthUsage,
+)
 
 # Register your models here.
 admin.site.register(Donator)
 admin.site.register(Session)
+admin.site.register(PaymentDailyRollup)
+admin.site.register(TerminalBandwidthUsage)
 
 
 @admin.register(Terminal)
@@ -33,6 +44,7 @@ class TerminalAdmin(admin.ModelAdmin):
 
     actions = [
         "_request_check_for_updates",
+        "_issue_api_key",
     ]
 
     def _request_check_for_updates(self, request, queryset):
@@ -43,6 +55,20 @@ class TerminalAdmin(admin.ModelAdmin):
 
     _request_check_for_updates.short_description = "Vérifier les mises à jours"
 
+    def _issue_api_key(self, request, queryset):
+
+        for terminal in queryset:
+            _, key = TerminalApiKey.issue(terminal)
+            self.message_user(
+                request,
+                "Clé d'API de la borne {} (elle ne sera plus affichée) : {}".format(
+                    terminal.name, key
+                ),
+                messages.SUCCESS,
+            )
+
+    _issue_api_key.short_description = "Générer une clé d'API"
+
     list_filter = (
         "name",
         "owner",
@@ -137,7 +163,6 @@ class PaymentAdmin(admin.ModelAdmin):
         "date",
         "amount",
         "amount_donated",
-        "get_amount_donated_for_old_payments",
         "donation_formula",
         "status",
         "method",
@@ -200,3 +225,70 @@ class PaymentAdmin(admin.ModelAdmin):
     )
 
     readonly_fields = ("date",)
+
+
+@admin.register(PaymentAuditEntry)
+class PaymentAuditEntryAdmin(admin.ModelAdmin):
+
+    # List view
+
+    list_display = (
+        "date",
+        "kind",
+        "terminal_id",
+        "payment_id",
+    )
+
+    list_filter = ("kind",)
+
+    search_fields = ("terminal__id",)
+
+    ordering = ("-date",)
+
+    # Entries are append-only
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(TerminalApiKey)
+class TerminalApiKeyAdmin(admin.ModelAdmin):
+
+    # List view
+
+    list_display = (
+        "key_id",
+        "terminal",
+        "created",
+        "is_active",
+    )
+
+    list_filter = ("is_active",)
+
+    search_fields = ("key_id", "terminal__name")
+
+    ordering = ("-created",)
+
+    # Keys are issued from the terminals (see TerminalAdmin), they can only be deactivated here
+
+    fields = (
+        "key_id",
+        "terminal",
+        "created",
+        "is_active",
+    )
+
+    readonly_fields = (
+        "key_id",
+        "terminal",
+        "created",
+    )
+
+    def has_add_permission(self, request):
+        return False
@@ -0,0 +1,139 @@
+"""
+Audit log of payments, stored in PaymentAuditEntry
+
+Entries are kept in a bounded in-process buffer and written with a single bulk_create when the buffer is full
+or when its oldest entry is older than PAYMENT_AUDIT_FLUSH_INTERVAL seconds, out of the request.
+With PAYMENT_AUDIT_BUFFER_SIZE = 0, entries are written synchronously, in the request.
+If the bulk_create fails, entries are saved one by one, so that one invalid entry does not lose the others,
+and entries that still cannot be saved are written to the logger of this module.
+"""
+
+import atexit
+import json
+import logging
+import threading
+import traceback
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from terminal.models import PaymentAuditEntry
+
+logger = logging.getLogger(__name__)
+
+
+def _get_buffer_size():
+    return getattr(settings, "PAYMENT_AUDIT_BUFFER_SIZE", 100)
+
+
+def _get_flush_interval():
+    return getattr(settings, "PAYMENT_AUDIT_FLUSH_INTERVAL", 5)
+
+
+class PaymentAuditBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = []
+        self._timer = None
+
+    def add(self, entry: PaymentAuditEntry):
+        if _get_buffer_size() <= 0:
+            self._write([entry])
+            return
+
+        with self._lock:
+            self._entries.append(entry)
+            full = len(self._entries) >= _get_buffer_size()
+
+            if not full and self._timer is None:
+                self._timer = threading.Timer(
+                    _get_flush_interval(), self._flush_from_timer
+                )
+                self._timer.daemon = True
+                self._timer.start()
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            entries, self._entries = self._entries, []
+
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        if entries:
+            self._write(entries)
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        finally:
+            connections.close_all()  # Connections of this thread are not closed by Django
+
+    def _write(self, entries):
+        try:
+            with transaction.atomic():
+                PaymentAuditEntry.objects.bulk_create(entries)
+            return
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Payment audit entries could not be saved at once")
+
+        # Never lose entries silently, nor fail the payment because of its audit log
+        for entry in entries:
+            try:
+                with transaction.atomic():
+                    entry.save(force_insert=True)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Payment audit entry could not be saved")
+                logger.error(str(entry))
+
+
+_buffer = PaymentAuditBuffer()
+
+atexit.register(_buffer.flush)
+
+
+def log_payment(payment_data: dict):
+    """
+    Log a payment that has been saved, given its serialized data
+    """
+
+    _buffer.add(
+        PaymentAuditEntry(
+            kind=PaymentAuditEntry.PAYMENT,
+            terminal_id=payment_data.get("terminal"),
+            payment_id=payment_data.get("id"),
+            data=json.dumps(payment_data, default=str),
+        )
+    )
+
+
+def log_payment_error(terminal_id, exc_info, request_data):
+    """
+    Log an error raised while receiving a payment, with the data sent by the terminal
+    """
+
+    try:
+        terminal_id = int(terminal_id)
+    except (TypeError, ValueError):
+        terminal_id = None  # Unknown terminal
+
+    _buffer.add(
+        PaymentAuditEntry(
+            kind=PaymentAuditEntry.ERROR,
+            terminal_id=terminal_id,
+            data="".join(traceback.format_exception(*exc_info))
+            + "[REQUEST] - "
+            + str(request_data),
+        )
+    )
+
+
+def flush():
+    """
+    Write buffered entries now
+    """
+
+    _buffer.flush()
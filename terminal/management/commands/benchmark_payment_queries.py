@@ -0,0 +1,283 @@
+import datetime
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Avg
+from django.utils import timezone
+
+from fleet.models import User, Customer, Campaign, LAST_DONATIONS_COUNT
+from game.models import Game, GameFile
+from terminal.models import Terminal, Payment, PaymentDailyRollup, Session
+from terminal.stats import (
+    get_dashboard_stats,
+    get_accepted_payments_stats,
+    get_payments_totals,
+    get_payments_totals_from_payments,
+)
+
+BENCHMARK_PREFIX = "benchmark-"
+
+
+class Command(BaseCommand):
+    help = (
+        "Print query plans and timings of the payment, rollup and session queries run by the views of SETH. "
+        "With --compare, plans are printed without then with the indexes of Payment, PaymentDailyRollup and Session. "
+        "DO NOT USE --populate ON PRODUCTION : it inserts synthetic rows in the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--populate",
+            type=int,
+            default=0,
+            help="Number of synthetic payments to insert before benchmarking (as many sessions are inserted)",
+        )
+        parser.add_argument(
+            "--terminals",
+            type=int,
+            default=200,
+            help="Number of synthetic terminals used with --populate",
+        )
+        parser.add_argument(
+            "--compare",
+            action="store_true",
+            help="Drop indexes of Payment, PaymentDailyRollup and Session, benchmark, then create them again and benchmark",
+        )
+        parser.add_argument(
+            "--analyze",
+            action="store_true",
+            help="Run EXPLAIN ANALYZE instead of EXPLAIN (PostgreSQL only)",
+        )
+
+    def handle(self, *args, **options):
+        if options["populate"]:
+            self._populate(options["populate"], options["terminals"])
+
+        if options["compare"]:
+            self._drop_indexes()
+            try:
+                self.stdout.write(self.style.MIGRATE_HEADING("Without indexes"))
+                self._benchmark(options["analyze"])
+            finally:
+                self._create_indexes()
+
+            self.stdout.write(self.style.MIGRATE_HEADING("With indexes"))
+
+        self._benchmark(options["analyze"])
+
+    def _indexes(self):
+        for model in (Payment, PaymentDailyRollup, Session):
+            for index in model._meta.indexes:
+                yield model, index
+
+    def _drop_indexes(self):
+        with connection.schema_editor() as schema_editor:
+            for model, index in self._indexes():
+                schema_editor.remove_index(model, index)
+
+    def _create_indexes(self):
+        with connection.schema_editor() as schema_editor:
+            for model, index in self._indexes():
+                schema_editor.add_index(model, index)
+
+    def _get_queries(self):
+        """
+        Return (label, queryset, run) of the queries run by the dashboard, the statistics and the payments listing,
+        where queryset is the main query explained and run is the function called by the views
+        """
+
+        terminal = Terminal.objects.order_by("?").first()
+        campaign = Campaign.objects.order_by("?").first()
+        customer = terminal.customer if terminal else None
+        now = timezone.now()
+        last_month = now - datetime.timedelta(days=31)
+
+        last_month_rollups = PaymentDailyRollup.objects.filter(
+            day__gte=last_month.date()
+        )
+        last_month_payments = Payment.objects.filter(date__gte=last_month)
+        terminal_rollups = PaymentDailyRollup.objects.filter(terminal=terminal)
+        campaign_rollups = PaymentDailyRollup.objects.filter(campaign=campaign)
+        terminal_last_donations = Payment.objects.filter(
+            terminal=terminal, status="Accepted"
+        ).order_by("-date", "-id")[:LAST_DONATIONS_COUNT]
+        campaign_last_donations = Payment.objects.filter(
+            campaign=campaign, status="Accepted"
+        ).order_by("-date", "-id")[:LAST_DONATIONS_COUNT]
+        terminal_sessions = Session.objects.filter(terminal=terminal)
+        terminals = Terminal.objects.filter(customer=customer).with_stats()
+        campaigns = Campaign.objects.with_stats()
+
+        return [
+            (
+                "Dashboard of a customer",
+                PaymentDailyRollup.objects.filter(
+                    terminal__customer=customer, day__gte=last_month.date()
+                ),
+                lambda: get_dashboard_stats(customer),
+            ),
+            (
+                "Listing of the last 30 days",
+                last_month_payments.order_by("-date", "-id")[:10],
+                lambda: list(last_month_payments.order_by("-date", "-id")[:10]),
+            ),
+            (
+                "Listing of a payment terminal",
+                last_month_payments.filter(
+                    payment_terminal=terminal.payment_terminal if terminal else None
+                ).order_by("-date", "-id")[:10],
+                None,
+            ),
+            (
+                "Listing of a donation formula",
+                last_month_payments.filter(donation_formula="Partage").order_by(
+                    "-date", "-id"
+                )[:10],
+                None,
+            ),
+            (
+                "Totals of the last 30 days, by whole days",
+                last_month_rollups,
+                lambda: get_payments_totals(last_month_rollups),
+            ),
+            (
+                "Totals of the last 30 days, not by whole days",
+                last_month_payments,
+                lambda: get_payments_totals_from_payments(last_month_payments),
+            ),
+            (
+                "Statistics of a terminal",
+                terminal_rollups,
+                lambda: get_accepted_payments_stats(terminal_rollups),
+            ),
+            ("Last donations of a terminal", terminal_last_donations, None),
+            (
+                "Sessions of a terminal",
+                terminal_sessions,
+                lambda: terminal_sessions.aggregate(
+                    avg_ts=Avg("timesession_global"), avg_game_ts=Avg("timesession")
+                ),
+            ),
+            (
+                "Statistics of a campaign",
+                campaign_rollups,
+                lambda: (
+                    get_accepted_payments_stats(campaign_rollups),
+                    get_accepted_payments_stats(
+                        campaign_rollups.filter(day=timezone.localdate())
+                    ),
+                ),
+            ),
+            ("Last donations of a campaign", campaign_last_donations, None),
+            ("Terminals of a customer with statistics", terminals, None),
+            ("Campaigns with statistics", campaigns, None),
+        ]
+
+    def _benchmark(self, analyze):
+        for label, queryset, run in self._get_queries():
+            self.stdout.write(self.style.SQL_KEYWORD(label))
+            self.stdout.write(
+                queryset.explain(analyze=True) if analyze else queryset.explain()
+            )
+
+            start = time.perf_counter()
+            if run is None:
+                list(queryset)
+            else:
+                run()
+            elapsed = time.perf_counter() - start
+
+            self.stdout.write("-> {:.1f} ms\n".format(elapsed * 1000))
+
+    def _populate(self, nb_payments, nb_terminals):
+        """
+        Insert synthetic customers, terminals, campaigns, games, payments and sessions, and roll up the payments
+        """
+
+        random.seed(0)
+
+        customer = Customer.objects.create(company=BENCHMARK_PREFIX + "customer")
+        campaigns = [
+            Campaign.objects.create(
+                name=BENCHMARK_PREFIX + str(i),
+                description="",
+                goal_amount=0,
+                link="",
+            )
+            for i in range(20)
+        ]
+        games = [
+            Game.objects.create(
+                name=BENCHMARK_PREFIX + str(i),
+                path="",
+                description="",
+                file=GameFile.objects.create(file=BENCHMARK_PREFIX + str(i)),
+            )
+            for i in range(20)
+        ]
+        terminals = [
+            Terminal.objects.create(
+                name=BENCHMARK_PREFIX + str(i),
+                owner=User.objects.create(username=BENCHMARK_PREFIX + str(i)),
+                customer=customer,
+                payment_terminal=BENCHMARK_PREFIX + str(i),
+                donation_formula=random.choice(["Classique", "Partage"]),
+            )
+            for i in range(nb_terminals)
+        ]
+
+        now = timezone.now()
+        batch_size = 10000
+
+        for offset in range(0, nb_payments, batch_size):
+            payments = []
+            sessions = []
+
+            for _ in range(min(batch_size, nb_payments - offset)):
+                terminal = random.choice(terminals)
+                campaign = random.choice(campaigns)
+                game = random.choice(games)
+                date = now - datetime.timedelta(seconds=random.randint(0, 730 * 86400))
+                amount = float(random.randint(1, 50))
+
+                payments.append(
+                    Payment(
+                        terminal=terminal,
+                        campaign=campaign,
+                        game=game,
+                        date=date,
+                        method="CB",
+                        status=random.choice(
+                            ["Accepted", "Accepted", "Accepted", "Refused", "Skiped"]
+                        ),
+                        amount=amount,
+                        amount_donated=amount,
+                        currency="EUR",
+                        payment_terminal=terminal.payment_terminal,
+                        donation_formula=terminal.donation_formula,
+                    )
+                )
+                sessions.append(
+                    Session(
+                        terminal=terminal,
+                        campaign=campaign,
+                        game=game,
+                        start_time=date,
+                        end_time=date + datetime.timedelta(minutes=5),
+                        position_asso=0,
+                        timesession=datetime.timedelta(minutes=5),
+                    )
+                )
+
+            Payment.objects.bulk_create(payments)
+            Session.objects.bulk_create(sessions)
+
+            self.stdout.write(
+                "Inserted {} payments and sessions".format(offset + len(payments))
+            )
+
+        # Payments inserted in bulk do not send the signals maintaining rollups
+        PaymentDailyRollup.rebuild()
+        self.stdout.write("Rolled up payments")
@@ -0,0 +1,38 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from terminal.models import PaymentAuditEntry
+
+
+class Command(BaseCommand):
+    help = "Print the payment audit log of a terminal for a month"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--terminal",
+            type=int,
+            help="Terminal id, omit it to print entries of unknown terminals",
+        )
+        parser.add_argument(
+            "--month",
+            required=True,
+            help="Month to print (format YYYY-MM)",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            month = datetime.datetime.strptime(options["month"], "%Y-%m")
+        except ValueError:
+            raise CommandError("--month must be formatted as YYYY-MM")
+
+        start = timezone.make_aware(month)
+        end = timezone.make_aware((month + datetime.timedelta(days=32)).replace(day=1))
+
+        entries = PaymentAuditEntry.objects.filter(
+            terminal_id=options["terminal"], date__gte=start, date__lt=end
+        ).order_by("date", "id")
+
+        for entry in entries.iterator():
+            self.stdout.write(str(entry))
@@ -0,0 +1,51 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from terminal.models import Payment, PaymentDailyRollup
+
+
+class Command(BaseCommand):
+    help = "Rebuild daily payment rollups from the Payment table, month by month"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--since",
+            help="First day to rebuild (format YYYY-MM-DD), defaults to the day of the first payment",
+        )
+        parser.add_argument(
+            "--terminal", type=int, help="Only rebuild rollups of this terminal id"
+        )
+
+    def handle(self, *args, **options):
+        if options["since"]:
+            try:
+                day = datetime.datetime.strptime(options["since"], "%Y-%m-%d").date()
+            except ValueError:
+                raise CommandError("--since must be formatted as YYYY-MM-DD")
+
+        else:
+            first_payment = Payment.objects.order_by("date").first()
+            if first_payment is None:
+                self.stdout.write("No payment to roll up")
+                return
+            day = first_payment.date.date()
+
+        today = datetime.date.today()
+
+        while day <= today:
+            # Rebuild one month at a time to keep transactions short
+            next_month = (day.replace(day=1) + datetime.timedelta(days=32)).replace(
+                day=1
+            )
+
+            PaymentDailyRollup.rebuild(
+                day_from=day, day_to=next_month, terminal_id=options["terminal"]
+            )
+            self.stdout.write(
+                "Rolled up payments from {} to {}".format(day, next_month)
+            )
+
+            day = next_month
+
+        self.stdout.write(self.style.SUCCESS("Payment rollups rebuilt"))
@@ -0,0 +1,111 @@
+# Generated by Django 3.0.3 on 2026-10-18 08:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("fleet", "0019_auto_20230606_1516"),
+        ("game", "0016_auto_20230606_1618"),
+        ("terminal", "0025_terminal_restart"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PaymentDailyRollup",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField(verbose_name="Jour (UTC)")),
+                (
+                    "status",
+                    models.CharField(max_length=255, verbose_name="Status du paiement"),
+                ),
+                (
+                    "donation_formula",
+                    models.CharField(
+                        choices=[
+                            ("Classique", "Classique"),
+                            ("Gratuit", "Gratuit"),
+                            ("Mécénat", "Mécénat"),
+                            ("Partage", "Partage"),
+                        ],
+                        max_length=250,
+                        null=True,
+                        verbose_name="Formule de don",
+                    ),
+                ),
+                (
+                    "payment_terminal",
+                    models.CharField(max_length=250, null=True, verbose_name="TPE"),
+                ),
+                (
+                    "nb_payments",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Nombre de paiements"
+                    ),
+                ),
+                (
+                    "total_amount",
+                    models.FloatField(default=0, verbose_name="Montant total"),
+                ),
+                (
+                    "total_amount_donated",
+                    models.FloatField(
+                        default=0, verbose_name="Montant total reversé pour la campagne"
+                    ),
+                ),
+                (
+                    "campaign",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="payment_daily_rollups",
+                        to="fleet.Campaign",
+                        verbose_name="Campagne",
+                    ),
+                ),
+                (
+                    "game",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="payment_daily_rollups",
+                        to="game.Game",
+                        verbose_name="Jeu",
+                    ),
+                ),
+                (
+                    "terminal",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="payment_daily_rollups",
+                        to="terminal.Terminal",
+                        verbose_name="Borne",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Cumul journalier des paiements",
+                "verbose_name_plural": "Cumuls journaliers des paiements",
+                "unique_together": {
+                    (
+                        "day",
+                        "terminal",
+                        "campaign",
+                        "game",
+                        "status",
+                        "donation_formula",
+                        "payment_terminal",
+                    )
+                },
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+from django.db import migrations
+from django.db.models import (
+    Case,
+    ExpressionWrapper,
+    F,
+    FloatField,
+    OuterRef,
+    Subquery,
+    When,
+)
+
+
+def fill_payments_amount_donated(apps, schema_editor):
+    """
+    Assign to old payments the donation formula of their terminal and their amount donated,
+    computed the same way as in Payment.save
+    """
+
+    Payment = apps.get_model("terminal", "Payment")
+    Terminal = apps.get_model("terminal", "Terminal")
+
+    terminal = Terminal.objects.filter(pk=OuterRef("terminal_id"))
+
+    Payment.objects.filter(donation_formula=None).update(
+        donation_formula=Subquery(terminal.values("donation_formula")[:1])
+    )
+
+    Payment.objects.filter(amount_donated=None).update(
+        amount_donated=Case(
+            When(
+                donation_formula="Partage",
+                then=ExpressionWrapper(
+                    F("amount")
+                    * Subquery(terminal.values("donation_share")[:1])
+                    / 100.0,
+                    output_field=FloatField(),
+                ),
+            ),
+            default=F("amount"),
+            output_field=FloatField(),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("terminal", "0026_payment_daily_rollup"),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_payments_amount_donated, migrations.RunPython.noop),
+    ]
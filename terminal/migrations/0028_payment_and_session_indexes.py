@@ -0,0 +1,74 @@
+# Generated by Django 3.0.3 on 2026-10-18 08:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("terminal", "0027_fill_payments_amount_donated"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(fields=["date", "id"], name="payment_date_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                fields=["terminal", "status", "date"],
+                name="payment_terminal_status_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                fields=["campaign", "status", "date"],
+                name="payment_campaign_status_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                fields=["status", "date"], name="payment_status_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                fields=["payment_terminal", "date"], name="payment_tpe_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                fields=["donation_formula", "date"], name="payment_formula_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(status="Accepted"),
+                fields=["terminal", "date"],
+                name="payment_accepted_term_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(status="Accepted"),
+                fields=["campaign", "date"],
+                name="payment_accepted_camp_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="session",
+            index=models.Index(
+                fields=["terminal", "start_time"], name="session_terminal_start_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="session",
+            index=models.Index(fields=["start_time"], name="session_start_time_idx"),
+        ),
+    ]
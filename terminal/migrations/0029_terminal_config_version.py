@@ -0,0 +1,18 @@
+# Generated by Django 3.0.3 on 2026-10-18 08:19
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("terminal", "0028_payment_and_session_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="terminal",
+            name="config_version",
+            field=models.UUIDField(default=uuid.uuid4, editable=False),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 3.0.3 on 2026-10-18 08:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("terminal", "0029_terminal_config_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PaymentAuditEntry",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "date",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, verbose_name="Date (UTC)"
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("PAYMENT", "Paiement"), ("ERROR", "Erreur")],
+                        max_length=7,
+                        verbose_name="Type",
+                    ),
+                ),
+                ("data", models.TextField(verbose_name="Données")),
+                (
+                    "payment",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to="terminal.Payment",
+                        verbose_name="Paiement",
+                    ),
+                ),
+                (
+                    "terminal",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to="terminal.Terminal",
+                        verbose_name="Borne",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Journal des paiements",
+                "verbose_name_plural": "Journal des paiements",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="paymentauditentry",
+            index=models.Index(
+                fields=["terminal", "date"], name="payment_audit_terminal_idx"
+            ),
+        ),
+    ]
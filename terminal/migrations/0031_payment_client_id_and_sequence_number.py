@@ -0,0 +1,41 @@
+# Generated by Django 3.0.3 on 2026-10-18 08:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("terminal", "0030_payment_audit_entry"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="client_id",
+            field=models.CharField(
+                blank=True,
+                max_length=64,
+                null=True,
+                verbose_name="Identifiant attribué par la borne",
+            ),
+        ),
+        migrations.AddField(
+            model_name="payment",
+            name="sequence_number",
+            field=models.PositiveIntegerField(
+                blank=True, null=True, verbose_name="Numéro de séquence de la borne"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                fields=["terminal", "sequence_number"], name="payment_terminal_seq_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="payment",
+            constraint=models.UniqueConstraint(
+                fields=("terminal", "client_id"), name="payment_terminal_client_id_uniq"
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.0.3 on 2026-10-18 08:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("terminal", "0031_payment_client_id_and_sequence_number"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="session",
+            name="client_id",
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name="session",
+            constraint=models.UniqueConstraint(
+                fields=("terminal", "client_id"), name="session_terminal_client_id_uniq"
+            ),
+        ),
+    ]
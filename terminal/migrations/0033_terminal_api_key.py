@@ -0,0 +1,50 @@
+# Generated by Django 3.0.3 on 2026-10-18 08:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("terminal", "0032_session_client_id"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TerminalApiKey",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "key_id",
+                    models.CharField(editable=False, max_length=16, unique=True),
+                ),
+                ("digest", models.CharField(editable=False, max_length=64)),
+                (
+                    "created",
+                    models.DateTimeField(auto_now_add=True, verbose_name="Création"),
+                ),
+                ("is_active", models.BooleanField(default=True, verbose_name="Active")),
+                (
+                    "terminal",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="api_keys",
+                        to="terminal.Terminal",
+                        verbose_name="Borne",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Clé d'API de borne",
+                "verbose_name_plural": "Clés d'API de bornes",
+            },
+        ),
+    ]
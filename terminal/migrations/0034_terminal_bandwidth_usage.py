@@ -0,0 +1,52 @@
+# Generated by Django 3.0.3 on 2026-10-18 08:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("terminal", "0033_terminal_api_key"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TerminalBandwidthUsage",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField(verbose_name="Jour")),
+                (
+                    "bytes_served",
+                    models.BigIntegerField(default=0, verbose_name="Octets envoyés"),
+                ),
+                (
+                    "nb_downloads",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Nombre de téléchargements"
+                    ),
+                ),
+                (
+                    "terminal",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="bandwidth_usages",
+                        to="terminal.Terminal",
+                        verbose_name="Borne",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Consommation de bande passante",
+                "verbose_name_plural": "Consommations de bande passante",
+                "unique_together": {("day", "terminal")},
+            },
+        ),
+    ]
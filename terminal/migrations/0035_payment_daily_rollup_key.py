@@ -0,0 +1,73 @@
+import hashlib
+import json
+
+from django.db import migrations, models
+
+
+def fill_rollups_key(apps, schema_editor):
+    """
+    Assign their key to rollup rows, computed the same way as in PaymentDailyRollup.get_key,
+    merging rows created twice for the same key by concurrent payments
+    """
+
+    PaymentDailyRollup = apps.get_model("terminal", "PaymentDailyRollup")
+
+    rollups_by_key = {}
+
+    for rollup in PaymentDailyRollup.objects.order_by("pk").iterator():
+        values = [
+            rollup.day.isoformat(),
+            rollup.terminal_id,
+            rollup.campaign_id,
+            rollup.game_id,
+            rollup.status,
+            rollup.donation_formula,
+            rollup.payment_terminal,
+        ]
+        key = hashlib.sha1(json.dumps(values).encode()).hexdigest()
+
+        first = rollups_by_key.get(key)
+
+        if first is None:
+            rollup.key = key
+            rollup.save(update_fields=["key"])
+            rollups_by_key[key] = rollup
+            continue
+
+        first.nb_payments += rollup.nb_payments
+        first.total_amount += rollup.total_amount
+        first.total_amount_donated += rollup.total_amount_donated
+        first.save(
+            update_fields=["nb_payments", "total_amount", "total_amount_donated"]
+        )
+        rollup.delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("terminal", "0034_terminal_bandwidth_usage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="paymentdailyrollup",
+            name="key",
+            field=models.CharField(editable=False, max_length=40, null=True),
+        ),
+        migrations.RunPython(fill_rollups_key, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="paymentdailyrollup",
+            name="key",
+            field=models.CharField(editable=False, max_length=40, unique=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name="paymentdailyrollup",
+            unique_together=set(),
+        ),
+        migrations.AddIndex(
+            model_name="paymentdailyrollup",
+            index=models.Index(
+                fields=["day", "terminal"], name="rollup_day_terminal_idx"
+            ),
+        ),
+    ]
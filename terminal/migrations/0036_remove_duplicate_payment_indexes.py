@@ -0,0 +1,20 @@
+# Generated by Django 3.0.3 on 2026-10-18 08:58
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("terminal", "0035_payment_daily_rollup_key"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="payment",
+            name="payment_accepted_term_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="payment",
+            name="payment_accepted_camp_idx",
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.0.3 on 2026-10-18 09:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("terminal", "0036_remove_duplicate_payment_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="payment",
+            name="date",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, verbose_name="Date et heure (UTC)"
+            ),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.0.3 on 2026-10-18 09:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("terminal", "0037_payment_date_default"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TerminalTokenDenial",
+            fields=[
+                (
+                    "terminal",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="+",
+                        serialize=False,
+                        to="terminal.Terminal",
+                        verbose_name="Borne",
+                    ),
+                ),
+                ("expires", models.DateTimeField(verbose_name="Expiration")),
+            ],
+            options={
+                "verbose_name": "Jetons refusés d'une borne",
+                "verbose_name_plural": "Jetons refusés des bornes",
+            },
+        ),
+    ]
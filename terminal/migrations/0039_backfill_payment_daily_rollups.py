@@ -0,0 +1,91 @@
+import hashlib
+import json
+
+from django.db import migrations
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce, TruncDate
+
+from terminal.models.payment import amount_donated_expression
+
+
+def backfill_rollups(apps, schema_editor):
+    """
+    Roll up every payments, the same way as PaymentDailyRollup.rebuild does, so that statistics read from rollups
+    include payments received before rollups existed
+    """
+
+    Payment = apps.get_model("terminal", "Payment")
+    PaymentDailyRollup = apps.get_model("terminal", "PaymentDailyRollup")
+    Terminal = apps.get_model("terminal", "Terminal")
+
+    # Payments created meanwhile wait for the backfill (see PaymentDailyRollup.lock_terminals)
+    list(Terminal.objects.select_for_update().order_by("pk").values_list("pk"))
+
+    rows = (
+        Payment.objects.annotate(
+            rollup_day=TruncDate("date"),
+            rollup_donation_formula=Coalesce(
+                "donation_formula", "terminal__donation_formula"
+            ),
+            rollup_payment_terminal=Coalesce(
+                "payment_terminal", "terminal__payment_terminal"
+            ),
+        )
+        .values(
+            "rollup_day",
+            "terminal_id",
+            "campaign_id",
+            "game_id",
+            "status",
+            "rollup_donation_formula",
+            "rollup_payment_terminal",
+        )
+        .annotate(
+            rollup_nb_payments=Count("id"),
+            rollup_total_amount=Sum("amount"),
+            rollup_total_amount_donated=Sum(amount_donated_expression()),
+        )
+        .order_by()
+    )
+
+    def get_rollup(row):
+        values = [
+            row["rollup_day"].isoformat(),
+            row["terminal_id"],
+            row["campaign_id"],
+            row["game_id"],
+            row["status"],
+            row["rollup_donation_formula"],
+            row["rollup_payment_terminal"],
+        ]
+
+        return PaymentDailyRollup(
+            key=hashlib.sha1(json.dumps(values).encode()).hexdigest(),
+            day=row["rollup_day"],
+            terminal_id=row["terminal_id"],
+            campaign_id=row["campaign_id"],
+            game_id=row["game_id"],
+            status=row["status"],
+            donation_formula=row["rollup_donation_formula"],
+            payment_terminal=row["rollup_payment_terminal"],
+            nb_payments=row["rollup_nb_payments"],
+            total_amount=row["rollup_total_amount"] or 0,
+            total_amount_donated=row["rollup_total_amount_donated"] or 0,
+        )
+
+    # Rows incremented by payments received since rollups exist are recomputed too
+    PaymentDailyRollup.objects.all().delete()
+    # SQLite can not insert more than 500 rows at once
+    PaymentDailyRollup.objects.bulk_create(
+        (get_rollup(row) for row in rows.iterator()), batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("terminal", "0038_terminal_token_denial"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
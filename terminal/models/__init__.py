@@ -2,3 +2,10 @@ from .terminal import Terminal
 from .payment import Payment
 from .session import Session
 from .donator import Donator
+from .payment_daily_rollup import PaymentDailyRollup
+from .payment_audit_entry import PaymentAuditEntry
+from .terminal_api_key import TerminalApiKey
+from .terminal_bandwidth_usage import TerminalBandwidthUsage
+from .terminal_token_denial import TerminalTokenDenial
+
+from . import config_version  # Register receivers
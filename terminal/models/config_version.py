@@ -0,0 +1,108 @@
+"""
+Renew the configuration version of terminals each time an object of their configuration changes,
+so that terminals download their configuration again (see MyTerminalViewSet.list)
+"""
+
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .terminal import Terminal
+
+
+def _renew(*filters, **kwargs):
+    Terminal.objects.filter(*filters, **kwargs).renew_config_version()
+
+
+@receiver(post_save, sender="fleet.Customer")
+@receiver(pre_delete, sender="fleet.Customer")
+def customer_changed(sender, instance, **kwargs):
+    _renew(customer=instance.pk)
+
+
+@receiver(post_save, sender="fleet.Campaign")
+@receiver(pre_delete, sender="fleet.Campaign")
+def campaign_changed(sender, instance, **kwargs):
+    _renew(campaigns=instance.pk)
+
+
+@receiver(post_save, sender="fleet.DonationStep")
+@receiver(pre_delete, sender="fleet.DonationStep")
+def donation_step_changed(sender, instance, **kwargs):
+    if instance.campaign_id is not None:
+        _renew(campaigns=instance.campaign_id)
+
+
+@receiver(pre_save, sender="game.Game")
+def game_will_change(sender, instance, **kwargs):
+    # Number of games of the old core changes too
+    instance._old_core_id = (
+        sender.objects.filter(pk=instance.pk).values_list("core", flat=True).first()
+        if instance.pk
+        else None
+    )
+
+
+@receiver(post_save, sender="game.Game")
+@receiver(pre_delete, sender="game.Game")
+def game_changed(sender, instance, **kwargs):
+    core_ids = {instance.core_id, getattr(instance, "_old_core_id", None)} - {None}
+
+    # Games of the terminals serialize the number of games of their core
+    _renew(Q(games=instance.pk) | Q(games__core__in=core_ids))
+
+
+@receiver(post_save, sender="game.Core")
+@receiver(pre_delete, sender="game.Core")
+def core_changed(sender, instance, **kwargs):
+    _renew(games__core=instance.pk)
+
+
+@receiver(post_save, sender="game.GameFile")
+@receiver(pre_delete, sender="game.GameFile")
+def game_file_changed(sender, instance, **kwargs):
+    _renew(games__file=instance.pk)
+
+
+@receiver(post_save, sender="game.CoreFile")
+@receiver(pre_delete, sender="game.CoreFile")
+def core_file_changed(sender, instance, **kwargs):
+    _renew(games__core__file=instance.pk)
+
+
+@receiver(post_save, sender="game.BiosFile")
+@receiver(pre_delete, sender="game.BiosFile")
+def bios_file_changed(sender, instance, **kwargs):
+    _renew(games__core__bios=instance.pk)
+
+
+@receiver(post_save, sender="screensaver.ScreensaverBroadcast")
+@receiver(pre_delete, sender="screensaver.ScreensaverBroadcast")
+def screensaver_broadcast_changed(sender, instance, **kwargs):
+    _renew(pk=instance.terminal_id)
+
+
+@receiver(post_save, sender="screensaver.ScreensaverMedia")
+@receiver(pre_delete, sender="screensaver.ScreensaverMedia")
+def screensaver_media_changed(sender, instance, **kwargs):
+    _renew(screensaver_broadcasts__media=instance.pk)
+
+
+@receiver(m2m_changed, sender=Terminal.campaigns.through)
+@receiver(m2m_changed, sender=Terminal.games.through)
+def terminal_relations_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        # Campaigns or games of a terminal changed
+        if action in ("post_add", "post_remove", "post_clear"):
+            _renew(pk=instance.pk)
+
+    elif action in ("post_add", "post_remove"):
+        # Terminals of a campaign or a game changed
+        _renew(pk__in=pk_set)
+
+    elif action == "pre_clear":
+        # Terminals of a campaign or a game are removed, they are not known anymore after the clear
+        if sender is Terminal.campaigns.through:
+            _renew(campaigns=instance.pk)
+        else:
+            _renew(games=instance.pk)
@@ -1,9 +1,12 @@
 from django.db import models
+from django.db.models import Case, ExpressionWrapper, F, FloatField, Q, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 from game.models import Game
 from fleet.models import Campaign
 
-from backend.common import DONATION_FORMULAS
+from backend.common import DONATION_FORMULAS, DONATION_FORMULA_SHARE
 
 from .donator import Donator
 
@@ -40,8 +43,9 @@ class Payment(models.Model):
         verbose_name="Jeu",
     )
 
+    # Set when the payment is received, or when it was made for payments sent later (see PaymentViewSet.batch)
     date = models.DateTimeField(
-        auto_now=True, verbose_name="Date et heure (UTC)"
+        default=timezone.now, verbose_name="Date et heure (UTC)"
     )  # Datetime is in UTC time
 
     method = models.CharField(
@@ -71,10 +75,54 @@ class Payment(models.Model):
         verbose_name="Formule de don",
     )  # TODO add choices and set non nullable
 
+    # Sent by terminals with payments replayed in batch (see PaymentViewSet.batch)
+
+    client_id = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        verbose_name="Identifiant attribué par la borne",
+    )
+
+    sequence_number = models.PositiveIntegerField(
+        null=True, blank=True, verbose_name="Numéro de séquence de la borne"
+    )
+
     class Meta:
         verbose_name = "Paiement"
         verbose_name_plural = "Paiements"
         ordering = ["-date"]
+        indexes = [
+            # Date ranges and listing ordered by date then id (see PaymentFilteredViewSet)
+            models.Index(fields=["date", "id"], name="payment_date_id_idx"),
+            # Filters of PaymentFilteredViewSet combined with a date range, and accepted payments
+            # of a terminal or a campaign used by statistics
+            models.Index(
+                fields=["terminal", "status", "date"],
+                name="payment_terminal_status_idx",
+            ),
+            models.Index(
+                fields=["campaign", "status", "date"],
+                name="payment_campaign_status_idx",
+            ),
+            models.Index(fields=["status", "date"], name="payment_status_date_idx"),
+            models.Index(
+                fields=["payment_terminal", "date"], name="payment_tpe_date_idx"
+            ),
+            models.Index(
+                fields=["donation_formula", "date"], name="payment_formula_date_idx"
+            ),
+            # Gaps in the sequence numbers of a terminal (see PaymentViewSet.sequence)
+            models.Index(
+                fields=["terminal", "sequence_number"], name="payment_terminal_seq_idx"
+            ),
+        ]
+        constraints = [
+            # Payments replayed by a terminal are created only once
+            models.UniqueConstraint(
+                fields=["terminal", "client_id"], name="payment_terminal_client_id_uniq"
+            ),
+        ]
 
     def __str__(self):
         return "Paiement de {} {} le {}".format(self.amount, self.currency, self.date)
@@ -82,36 +130,54 @@ class Payment(models.Model):
     def save(self, *args, **kwargs):
         if not self.pk:
             # Payment is being created
+            self.apply_terminal_settings(self.terminal)
 
-            if not self.payment_terminal:
-                self.payment_terminal = self.terminal.payment_terminal
+        super(Payment, self).save(*args, **kwargs)
 
-            if not self.donation_formula:
-                self.donation_formula = self.terminal.donation_formula
+    def apply_terminal_settings(self, terminal):
+        """
+        Fill the payment terminal, the donation formula and the amount donated of a new payment
+        from the settings of its terminal, if they are not set
+        """
 
-            if not self.amount_donated:
-                if self.donation_formula == "Partage":
-                    self.amount_donated = (
-                        self.amount * float(self.terminal.donation_share) / 100
-                    )
-                else:
-                    self.amount_donated = self.amount
+        if not self.payment_terminal:
+            self.payment_terminal = terminal.payment_terminal
 
-        super(Payment, self).save(*args, **kwargs)
+        if not self.donation_formula:
+            self.donation_formula = terminal.donation_formula
+
+        if not self.amount_donated:
+            if self.donation_formula == DONATION_FORMULA_SHARE:
+                self.amount_donated = self.amount * float(terminal.donation_share) / 100
+            else:
+                self.amount_donated = self.amount
 
-    def get_amount_donated_for_old_payments(self):
-        # TODO assign to each paiment its amount donated and donation formula then remove this shit
-        if self.amount_donated:
-            return self.amount_donated
 
-        donation_formula = (
-            self.donation_formula
-            if self.donation_formula
-            else self.terminal.donation_formula
-        )
+def amount_donated_expression():
+    """
+    Return a database expression of the amount donated of a payment, computed the same way as in Payment.save
 
-        if donation_formula == "Partage":
-            return self.amount * float(self.terminal.donation_share) / 100
+    Payments created before amount_donated and donation_formula were stored may have none of them,
+    in that case the donation formula and the donation share of their terminal are used.
+    """
 
-        else:
-            return self.amount
+    shared_amount = ExpressionWrapper(
+        F("amount") * F("terminal__donation_share") / 100.0,
+        output_field=FloatField(),
+    )
+
+    return Coalesce(
+        "amount_donated",
+        Case(
+            When(
+                Q(donation_formula=DONATION_FORMULA_SHARE)
+                | Q(
+                    donation_formula=None,
+                    terminal__donation_formula=DONATION_FORMULA_SHARE,
+                ),
+                then=shared_amount,
+            ),
+            default=F("amount"),
+            output_field=FloatField(),
+        ),
+    )
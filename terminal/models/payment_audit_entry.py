@@ -0,0 +1,56 @@
+from django.db import models
+from django.utils import timezone
+
+
+class PaymentAuditEntry(models.Model):
+    """
+    Append-only audit log of payments received from terminals, and of errors while receiving them.
+
+    Entries are written through the buffer of terminal.audit, never updated nor deleted.
+    """
+
+    PAYMENT = "PAYMENT"
+    ERROR = "ERROR"
+
+    KIND_CHOICES = (
+        (PAYMENT, "Paiement"),
+        (ERROR, "Erreur"),
+    )
+
+    date = models.DateTimeField(default=timezone.now, verbose_name="Date (UTC)")
+
+    kind = models.CharField(max_length=7, choices=KIND_CHOICES, verbose_name="Type")
+
+    # No database constraint, so that entries are kept as is even if the terminal or the payment is deleted,
+    # and errors can be logged with the terminal id sent by the terminal even if it does not exist
+    terminal = models.ForeignKey(
+        "terminal.Terminal",
+        null=True,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="+",
+        verbose_name="Borne",
+    )
+
+    payment = models.ForeignKey(
+        "terminal.Payment",
+        null=True,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="+",
+        verbose_name="Paiement",
+    )
+
+    data = models.TextField(verbose_name="Données")
+
+    class Meta:
+        verbose_name = "Journal des paiements"
+        verbose_name_plural = "Journal des paiements"
+        indexes = [
+            models.Index(
+                fields=["terminal", "date"], name="payment_audit_terminal_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return "{} - [{}] - {}".format(self.date, self.kind, self.data)
@@ -0,0 +1,326 @@
+import datetime
+import hashlib
+import json
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from game.models import Game
+from fleet.models import Campaign
+
+from backend.common import DONATION_FORMULAS, start_of_day
+
+from .payment import Payment, amount_donated_expression
+from .terminal import Terminal
+
+
+# Rows inserted per query by rebuilds, SQLite can not insert more than 500 rows at once (SQLITE_MAX_COMPOUND_SELECT)
+REBUILD_BATCH_SIZE = 500
+
+
+class PaymentDailyRollup(models.Model):
+    """
+    Daily totals of payments, used by statistics instead of scanning the whole Payment table.
+
+    There is one row per day, terminal, campaign, game, status, donation formula and payment terminal.
+    Rows are incremented each time a payment is created (see add_payment), rebuilt for the day of a payment
+    each time it is changed or deleted (see the receivers below), and can be rebuilt from the Payment table
+    at any time (see rebuild and the rebuild_payment_rollups command).
+
+    Payments created in bulk (batches of terminals) do not send signals, their days are rebuilt by their views.
+
+    Payments must be created in a transaction with their rollup increment (as PaymentViewSet does) :
+    rebuilds lock the terminals they roll up (see lock_terminals) and wait for these transactions.
+    """
+
+    # Hash of the columns identifying the row (see get_key), unique even if some of them are NULL,
+    # which a unique constraint on the columns themselves is not
+    key = models.CharField(max_length=40, unique=True, editable=False)
+
+    day = models.DateField(verbose_name="Jour (UTC)")
+
+    terminal = models.ForeignKey(
+        "terminal.Terminal",
+        on_delete=models.CASCADE,
+        related_name="payment_daily_rollups",
+        verbose_name="Borne",
+    )
+
+    campaign = models.ForeignKey(
+        Campaign,
+        on_delete=models.CASCADE,
+        related_name="payment_daily_rollups",
+        verbose_name="Campagne",
+    )
+
+    game = models.ForeignKey(
+        Game,
+        on_delete=models.CASCADE,
+        null=True,
+        related_name="payment_daily_rollups",
+        verbose_name="Jeu",
+    )
+
+    status = models.CharField(max_length=255, verbose_name="Status du paiement")
+
+    donation_formula = models.CharField(
+        max_length=250,
+        null=True,
+        choices=DONATION_FORMULAS,
+        verbose_name="Formule de don",
+    )
+
+    payment_terminal = models.CharField(max_length=250, null=True, verbose_name="TPE")
+
+    nb_payments = models.PositiveIntegerField(
+        default=0, verbose_name="Nombre de paiements"
+    )
+
+    total_amount = models.FloatField(default=0, verbose_name="Montant total")
+
+    total_amount_donated = models.FloatField(
+        default=0, verbose_name="Montant total reversé pour la campagne"
+    )
+
+    class Meta:
+        verbose_name = "Cumul journalier des paiements"
+        verbose_name_plural = "Cumuls journaliers des paiements"
+        indexes = [
+            models.Index(fields=["day", "terminal"], name="rollup_day_terminal_idx"),
+        ]
+
+    def __str__(self):
+        return "Cumul du {} : {} paiements".format(self.day, self.nb_payments)
+
+    def save(self, *args, **kwargs):
+        self.key = self.get_key(
+            self.day,
+            self.terminal_id,
+            self.campaign_id,
+            self.game_id,
+            self.status,
+            self.donation_formula,
+            self.payment_terminal,
+        )
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def get_key(
+        day,
+        terminal_id,
+        campaign_id,
+        game_id,
+        status,
+        donation_formula,
+        payment_terminal,
+    ):
+        """
+        Return the key of the row of the given day, terminal, campaign, game, status, donation formula
+        and payment terminal
+        """
+
+        if isinstance(day, datetime.datetime):
+            day = day.date()
+
+        values = [
+            day.isoformat(),
+            terminal_id,
+            campaign_id,
+            game_id,
+            status,
+            donation_formula,
+            payment_terminal,
+        ]
+        return hashlib.sha1(json.dumps(values).encode()).hexdigest()
+
+    @classmethod
+    def add_payment(cls, payment: Payment):
+        """
+        Increment the rollup row of a payment that has just been created
+        """
+
+        rollup = cls(
+            day=timezone.localtime(payment.date).date(),
+            terminal_id=payment.terminal_id,
+            campaign_id=payment.campaign_id,
+            game_id=payment.game_id,
+            status=payment.status,
+            donation_formula=payment.donation_formula,
+            payment_terminal=payment.payment_terminal,
+            nb_payments=1,
+            total_amount=payment.amount,
+            total_amount_donated=payment.amount_donated or 0,
+        )
+        increments = dict(
+            nb_payments=F("nb_payments") + 1,
+            total_amount=F("total_amount") + payment.amount,
+            total_amount_donated=F("total_amount_donated")
+            + (payment.amount_donated or 0),
+        )
+        key = cls.get_key(
+            rollup.day,
+            rollup.terminal_id,
+            rollup.campaign_id,
+            rollup.game_id,
+            rollup.status,
+            rollup.donation_formula,
+            rollup.payment_terminal,
+        )
+
+        # The row usually exists already, so it is updated first, in a single query
+        if cls.objects.filter(key=key).update(**increments):
+            return
+
+        try:
+            with transaction.atomic():
+                rollup.save(force_insert=True)
+        except IntegrityError:
+            # The row was created meanwhile by the first payment of the day of a concurrent request
+            cls.objects.filter(key=key).update(**increments)
+
+    @staticmethod
+    def lock_terminals(terminal_id=None):
+        """
+        Lock one terminal or every terminals until the end of the current transaction
+
+        Inserting a payment locks its terminal in share mode until the end of its transaction (foreign key check),
+        so this waits for the payments being created and blocks new ones. Without it, a payment created during
+        a rebuild could be both counted by the rebuild and added to the rebuilt row, or be missed.
+        Locking is a no-op on SQLite, which serializes writes anyway.
+        """
+
+        terminals = Terminal.objects.select_for_update().order_by("pk")
+
+        if terminal_id is not None:
+            terminals = terminals.filter(pk=terminal_id)
+
+        list(terminals.values_list("pk", flat=True))
+
+    @classmethod
+    def rebuild(cls, day_from=None, day_to=None, terminal_id=None):
+        """
+        Recompute rollup rows from the Payment table, between day_from (included) and day_to (excluded),
+        for one terminal or for every terminals.
+
+        Old payments without donation formula, payment terminal or amount donated are rolled up
+        with the values of their terminal.
+
+        Payments of the rebuilt terminals are blocked until the rebuild is done (see lock_terminals),
+        rebuilding every terminals blocks every payments.
+        """
+
+        rollups = cls.objects.all()
+        payments = Payment.objects.all()
+
+        if day_from is not None:
+            rollups = rollups.filter(day__gte=day_from)
+            payments = payments.filter(date__gte=start_of_day(day_from))
+
+        if day_to is not None:
+            rollups = rollups.filter(day__lt=day_to)
+            payments = payments.filter(date__lt=start_of_day(day_to))
+
+        if terminal_id is not None:
+            rollups = rollups.filter(terminal_id=terminal_id)
+            payments = payments.filter(terminal_id=terminal_id)
+
+        rows = (
+            payments.annotate(
+                rollup_day=TruncDate("date"),
+                rollup_donation_formula=Coalesce(
+                    "donation_formula", "terminal__donation_formula"
+                ),
+                rollup_payment_terminal=Coalesce(
+                    "payment_terminal", "terminal__payment_terminal"
+                ),
+            )
+            .values(
+                "rollup_day",
+                "terminal_id",
+                "campaign_id",
+                "game_id",
+                "status",
+                "rollup_donation_formula",
+                "rollup_payment_terminal",
+            )
+            .annotate(
+                rollup_nb_payments=Count("id"),
+                rollup_total_amount=Sum("amount"),
+                rollup_total_amount_donated=Sum(amount_donated_expression()),
+            )
+            .order_by()
+        )
+
+        with transaction.atomic():
+            cls.lock_terminals(terminal_id)
+            rollups.delete()
+            cls.objects.bulk_create(
+                (
+                    cls(
+                        key=cls.get_key(
+                            row["rollup_day"],
+                            row["terminal_id"],
+                            row["campaign_id"],
+                            row["game_id"],
+                            row["status"],
+                            row["rollup_donation_formula"],
+                            row["rollup_payment_terminal"],
+                        ),
+                        day=row["rollup_day"],
+                        terminal_id=row["terminal_id"],
+                        campaign_id=row["campaign_id"],
+                        game_id=row["game_id"],
+                        status=row["status"],
+                        donation_formula=row["rollup_donation_formula"],
+                        payment_terminal=row["rollup_payment_terminal"],
+                        nb_payments=row["rollup_nb_payments"],
+                        total_amount=row["rollup_total_amount"] or 0,
+                        total_amount_donated=row["rollup_total_amount_donated"] or 0,
+                    )
+                    for row in rows.iterator()
+                ),
+                batch_size=REBUILD_BATCH_SIZE,
+            )
+
+
+def _rebuild_day(day, terminal_id):
+    PaymentDailyRollup.rebuild(
+        day_from=day, day_to=day + datetime.timedelta(days=1), terminal_id=terminal_id
+    )
+
+
+@receiver(pre_save, sender=Payment)
+def payment_will_change(sender, instance, raw, **kwargs):
+    # Rollups of the old day and terminal of a changed payment must be rebuilt too
+    instance._old_rollup = (
+        sender.objects.filter(pk=instance.pk).values("date", "terminal_id").first()
+        if instance.pk and not raw
+        else None
+    )
+
+
+@receiver(post_save, sender=Payment)
+def payment_changed(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+
+    if created:
+        PaymentDailyRollup.add_payment(instance)
+        return
+
+    old_rollup = getattr(instance, "_old_rollup", None)
+    if old_rollup is not None:
+        _rebuild_day(
+            timezone.localtime(old_rollup["date"]).date(), old_rollup["terminal_id"]
+        )
+
+    _rebuild_day(timezone.localtime(instance.date).date(), instance.terminal_id)
+
+
+@receiver(post_delete, sender=Payment)
+def payment_deleted(sender, instance, **kwargs):
+    _rebuild_day(timezone.localtime(instance.date).date(), instance.terminal_id)
@@ -8,7 +8,11 @@ from .donator import Donator
 
 class Session(models.Model):
     donator = models.ForeignKey(
-        Donator, on_delete=models.PROTECT, related_name="sessions", null=True, blank=True,
+        Donator,
+        on_delete=models.PROTECT,
+        related_name="sessions",
+        null=True,
+        blank=True,
     )
     campaign = models.ForeignKey(
         Campaign, on_delete=models.PROTECT, related_name="sessions"
@@ -27,5 +31,35 @@ class Session(models.Model):
     timesession = models.DurationField(blank=True, null=True)
     timesession_global = models.DurationField(blank=True, null=True)
 
+    # Sent by terminals with sessions uploaded in batch (see SessionViewSet.batch)
+    client_id = models.CharField(max_length=64, null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # Sessions uploaded again by a terminal are updated instead of being created twice
+            models.UniqueConstraint(
+                fields=["terminal", "client_id"], name="session_terminal_client_id_uniq"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["terminal", "start_time"], name="session_terminal_start_idx"
+            ),
+            models.Index(fields=["start_time"], name="session_start_time_idx"),
+        ]
+
     def __str__(self):
         return "Session {} : {} global".format(self.pk, self.timesession_global)
+
+    def compute_durations(self):
+        """
+        Compute timesession and timesession_global from start and end times, or set them to None
+        if any of these times is missing
+        """
+
+        if self.start_time and self.end_time and self.start_global and self.end_global:
+            self.timesession = self.end_time - self.start_time
+            self.timesession_global = self.end_global - self.start_global
+        else:
+            self.timesession = None
+            self.timesession_global = None
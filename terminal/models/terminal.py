@@ -1,17 +1,90 @@
+import time
+import uuid
+
 from django.db import models
-from django.db.models import Avg, Sum
+from django.db.models import Avg, OuterRef, Subquery, Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.conf import settings
+from django.core.cache import cache
 from django.core.validators import MaxValueValidator, MinValueValidator
 
 from game.models import Game
 from fleet.models import Campaign, Customer
-from backend.common import DONATION_FORMULAS
+from backend.common import DONATION_FORMULAS, format_duration, is_cache_shared
 
 from .payment import Payment
 from .session import Session
 
 
+# Half the lifetime of signed urls of files stored on S3
+CONFIG_ETAG_PERIOD = getattr(settings, "AWS_QUERYSTRING_EXPIRE", 3600) // 2
+
+
+# Donation settings of terminals are cached for this number of seconds, if the cache is shared
+# (see Terminal.get_donation_settings)
+DONATION_SETTINGS_CACHE_TIMEOUT = 60
+
+DONATION_SETTINGS_FIELDS = (
+    "id",
+    "payment_terminal",
+    "donation_formula",
+    "donation_share",
+)
+
+
+def _aggregate_by_terminal(queryset, aggregate, output_field):
+    """
+    Subquery computing an aggregate of the payments or sessions of the terminal of the outer query
+    """
+
+    return Subquery(
+        queryset.filter(terminal=OuterRef("pk"))
+        .order_by()
+        .values("terminal")
+        .annotate(value=aggregate)
+        .values("value"),
+        output_field=output_field,
+    )
+
+
+class TerminalQuerySet(models.QuerySet):
+    def renew_config_version(self):
+        """
+        Mark the configuration of these terminals as changed, without saving them
+        """
+
+        return self.update(config_version=uuid.uuid4())
+
+    def with_stats(self):
+        """
+        Annotate the values of the total_donations, avg_donation, avg_timesession and avg_gametimesession
+        properties, so that they are computed in the query fetching terminals instead of one query per terminal
+        """
+
+        accepted_payments = Payment.objects.filter(status="Accepted")
+
+        return self.annotate(
+            annotated_total_donations=_aggregate_by_terminal(
+                accepted_payments, Sum("amount"), models.FloatField()
+            ),
+            annotated_avg_donation=_aggregate_by_terminal(
+                accepted_payments, Avg("amount"), models.FloatField()
+            ),
+            annotated_avg_timesession=_aggregate_by_terminal(
+                Session.objects.all(),
+                Avg("timesession_global"),
+                models.DurationField(),
+            ),
+            annotated_avg_gametimesession=_aggregate_by_terminal(
+                Session.objects.all(), Avg("timesession"), models.DurationField()
+            ),
+        )
+
+
 class Terminal(models.Model):
+    objects = TerminalQuerySet.as_manager()
+
     name = models.CharField(max_length=255)
 
     owner = models.OneToOneField(
@@ -67,6 +140,38 @@ class Terminal(models.Model):
         ],
     )  # How much per cent of the donation go to the owner of the terminal (only if donation_formula == 'Partage')
 
+    # Configuration version
+
+    # Changes each time the configuration downloaded by the terminal may have changed, used as ETag of this configuration
+    config_version = models.UUIDField(default=uuid.uuid4, editable=False)
+
+    # Fields reporting the state of the terminal, that are not part of its configuration
+    STATE_FIELDS = {"is_on", "is_playing", "version", "check_for_updates", "restart"}
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+
+        if update_fields is None or not set(update_fields) <= self.STATE_FIELDS:
+            self.config_version = uuid.uuid4()
+
+            if update_fields is not None:
+                kwargs["update_fields"] = set(update_fields) | {"config_version"}
+
+        super().save(*args, **kwargs)
+
+    @property
+    def config_etag(self):
+        """
+        ETag of the configuration downloaded by the terminal (see MyTerminalViewSet.list)
+
+        The configuration contains signed urls of files, so the ETag also changes every CONFIG_ETAG_PERIOD seconds,
+        before these urls expire. Periods are shifted from one terminal to another, so that terminals
+        do not all download their configuration at the same time.
+        """
+
+        period = (int(time.time()) + self.pk * 61) // CONFIG_ETAG_PERIOD
+        return '"{}-{}-{}"'.format(self.pk, self.config_version, period)
+
     @property
     def visible_screensaver_broadcasts(self):
         return self.screensaver_broadcasts.filter(visible=True)
@@ -77,6 +182,9 @@ class Terminal(models.Model):
 
     @property
     def total_donations(self):
+        if hasattr(self, "annotated_total_donations"):
+            return self.annotated_total_donations
+
         return Payment.objects.filter(terminal=self.pk, status="Accepted").aggregate(
             Sum("amount")
         )["amount__sum"]
@@ -89,41 +197,79 @@ class Terminal(models.Model):
 
     @property
     def avg_donation(self):
+        if hasattr(self, "annotated_avg_donation"):
+            return self.annotated_avg_donation
+
         return Payment.objects.filter(terminal=self.pk, status="Accepted").aggregate(
             Avg("amount")
         )["amount__avg"]
 
     @property
     def avg_timesession(self):
-        avg_ts = Session.objects.filter(terminal=self.pk).aggregate(
-            Avg("timesession_global")
-        )["timesession_global__avg"]
-        ts_string = ""
-        if avg_ts:
-            avg_ts = avg_ts.seconds
-            hours, remainder = divmod(avg_ts, 3600)
-            minutes, seconds = divmod(remainder, 60)
-            ts_string = "{:02}:{:02}:{:02}".format(
-                int(hours), int(minutes), int(seconds)
-            )
-        return ts_string
+        if hasattr(self, "annotated_avg_timesession"):
+            return format_duration(self.annotated_avg_timesession)
+
+        return format_duration(
+            Session.objects.filter(terminal=self.pk).aggregate(
+                Avg("timesession_global")
+            )["timesession_global__avg"]
+        )
 
     @property
     def avg_gametimesession(self):
-        avg_game_ts = Session.objects.filter(terminal=self.pk).aggregate(
-            Avg("timesession")
-        )["timesession__avg"]
-        ts_game_string = ""
-        if avg_game_ts:
-            avg_game_ts = avg_game_ts.seconds
-            hours, remainder = divmod(avg_game_ts, 3600)
-            minutes, seconds = divmod(remainder, 60)
-            ts_game_string = "{:02}:{:02}:{:02}".format(
-                int(hours), int(minutes), int(seconds)
-            )
-        return ts_game_string
+        if hasattr(self, "annotated_avg_gametimesession"):
+            return format_duration(self.annotated_avg_gametimesession)
+
+        return format_duration(
+            Session.objects.filter(terminal=self.pk).aggregate(Avg("timesession"))[
+                "timesession__avg"
+            ]
+        )
 
     def __str__(self):
         return "Terminal {} : {}".format(
             self.pk, "Active" if self.is_active else "False"
         )
+
+    @classmethod
+    def get_donation_settings(cls, owner_id):
+        """
+        Return the terminal of a user with only the fields used to create its payments
+        (see Payment.apply_terminal_settings), or None if the user is not a terminal user
+
+        These fields are cached only if the cache is shared between processes, and the cache is cleared
+        each time the terminal is saved. A cache local to each process would keep the settings of a terminal
+        saved by another process.
+        """
+
+        if is_cache_shared():
+            cache_key = _get_donation_settings_cache_key(owner_id)
+            donation_settings = cache.get(cache_key)
+
+            if donation_settings is None:
+                donation_settings = cls._get_donation_settings(owner_id)
+                cache.set(cache_key, donation_settings, DONATION_SETTINGS_CACHE_TIMEOUT)
+
+        else:
+            donation_settings = cls._get_donation_settings(owner_id)
+
+        if not donation_settings:
+            return None
+
+        return cls(owner_id=owner_id, **donation_settings)
+
+    @classmethod
+    def _get_donation_settings(cls, owner_id):
+        return (
+            cls.objects.filter(owner=owner_id).values(*DONATION_SETTINGS_FIELDS).first()
+        ) or {}  # Empty for users that are not terminal users, so that they are cached too
+
+
+def _get_donation_settings_cache_key(owner_id):
+    return "terminal_donation_settings:{}".format(owner_id)
+
+
+@receiver(post_save, sender=Terminal)
+@receiver(post_delete, sender=Terminal)
+def clear_donation_settings_cache(sender, instance, **kwargs):
+    cache.delete(_get_donation_settings_cache_key(instance.owner_id))
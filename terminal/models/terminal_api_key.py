@@ -0,0 +1,114 @@
+import hashlib
+import hmac
+import secrets
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from backend.common import is_cache_shared
+
+
+# API keys are cached for this number of seconds, if the cache is shared (see TerminalApiKey.get_cached)
+API_KEY_CACHE_TIMEOUT = 300
+
+
+class TerminalApiKey(models.Model):
+    """
+    API key authenticating a terminal (see backend.authentication.TerminalApiKeyAuthentication).
+
+    The key sent by the terminal is "<key_id>.<secret>". Only the HMAC of the secret is stored,
+    so that it can be checked with a single HMAC instead of hashing a password on each request.
+    """
+
+    terminal = models.ForeignKey(
+        "terminal.Terminal",
+        on_delete=models.CASCADE,
+        related_name="api_keys",
+        verbose_name="Borne",
+    )
+
+    key_id = models.CharField(max_length=16, unique=True, editable=False)
+    digest = models.CharField(max_length=64, editable=False)
+
+    created = models.DateTimeField(auto_now_add=True, verbose_name="Création")
+    is_active = models.BooleanField(default=True, verbose_name="Active")
+
+    class Meta:
+        verbose_name = "Clé d'API de borne"
+        verbose_name_plural = "Clés d'API de bornes"
+
+    def __str__(self):
+        return "Clé {} de la borne {}".format(self.key_id, self.terminal_id)
+
+    @staticmethod
+    def compute_digest(secret):
+        return hmac.new(
+            settings.SECRET_KEY.encode(), secret.encode(), hashlib.sha256
+        ).hexdigest()
+
+    @classmethod
+    def issue(cls, terminal):
+        """
+        Create a new API key for a terminal, and return it with the key to send to the terminal,
+        which cannot be retrieved afterwards
+        """
+
+        secret = secrets.token_urlsafe(32)
+        api_key = cls.objects.create(
+            terminal=terminal,
+            key_id=secrets.token_hex(8),
+            digest=cls.compute_digest(secret),
+        )
+
+        return api_key, "{}.{}".format(api_key.key_id, secret)
+
+    @classmethod
+    def get_cached(cls, key_id):
+        """
+        Return the digest of an active API key with the ids of its terminal, its user and its customer,
+        or an empty dict if there is no such key
+
+        These values are cached only if the cache is shared between processes, and the cache is cleared
+        each time the key is saved. A cache local to each process would keep accepting a key revoked
+        by another process.
+        """
+
+        if not is_cache_shared():
+            return cls._get_values(key_id)
+
+        cache_key = _get_api_key_cache_key(key_id)
+        api_key = cache.get(cache_key)
+
+        if api_key is None:
+            api_key = cls._get_values(key_id)
+            cache.set(cache_key, api_key, API_KEY_CACHE_TIMEOUT)
+
+        return api_key
+
+    @classmethod
+    def _get_values(cls, key_id):
+        return (
+            cls.objects.filter(
+                key_id=key_id, is_active=True, terminal__owner__is_active=True
+            )
+            .values(
+                "digest",
+                "terminal_id",
+                user_id=models.F("terminal__owner_id"),
+                customer_id=models.F("terminal__customer_id"),
+            )
+            .first()
+        ) or {}  # Empty for unknown keys, so that they are cached too
+
+
+def _get_api_key_cache_key(key_id):
+    return "terminal_api_key:{}".format(key_id)
+
+
+@receiver(post_save, sender=TerminalApiKey)
+@receiver(post_delete, sender=TerminalApiKey)
+def clear_api_key_cache(sender, instance, **kwargs):
+    cache.delete(_get_api_key_cache_key(instance.key_id))
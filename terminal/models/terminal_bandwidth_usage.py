@@ -0,0 +1,52 @@
+from django.db import models, transaction
+from django.db.models import F
+from django.utils import timezone
+
+
+class TerminalBandwidthUsage(models.Model):
+    """
+    Daily number of bytes of game, core and bios files served to a terminal
+    by MyTerminalViewSet.download (files downloaded from storage urls are not counted)
+    """
+
+    day = models.DateField(verbose_name="Jour")
+
+    terminal = models.ForeignKey(
+        "terminal.Terminal",
+        on_delete=models.CASCADE,
+        related_name="bandwidth_usages",
+        verbose_name="Borne",
+    )
+
+    bytes_served = models.BigIntegerField(default=0, verbose_name="Octets envoyés")
+    nb_downloads = models.PositiveIntegerField(
+        default=0, verbose_name="Nombre de téléchargements"
+    )
+
+    class Meta:
+        verbose_name = "Consommation de bande passante"
+        verbose_name_plural = "Consommations de bande passante"
+        unique_together = ("day", "terminal")
+
+    def __str__(self):
+        return "Consommation du {} : {} octets".format(self.day, self.bytes_served)
+
+    @classmethod
+    def add_download(cls, terminal_id, bytes_served):
+        """
+        Increment the row of today with a download, once it is finished or interrupted
+        """
+
+        lookup = dict(day=timezone.localdate(), terminal_id=terminal_id)
+        increments = dict(
+            bytes_served=F("bytes_served") + bytes_served,
+            nb_downloads=F("nb_downloads") + 1,
+        )
+
+        # The row usually exists already, so it is updated first, in a single query
+        if cls.objects.filter(**lookup).update(**increments):
+            return
+
+        with transaction.atomic():
+            usage, _ = cls.objects.get_or_create(**lookup)
+            cls.objects.filter(pk=usage.pk).update(**increments)
@@ -0,0 +1,29 @@
+from django.db import models
+
+
+class TerminalTokenDenial(models.Model):
+    """
+    Terminal deactivated while access tokens issued before its deactivation are still valid
+    (see backend.authentication.deny_terminal_tokens)
+
+    The deny list is stored in the database so that it is shared by every process, whatever the cache is.
+    """
+
+    terminal = models.OneToOneField(
+        "terminal.Terminal",
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="+",
+        verbose_name="Borne",
+    )
+
+    expires = models.DateTimeField(verbose_name="Expiration")
+
+    class Meta:
+        verbose_name = "Jetons refusés d'une borne"
+        verbose_name_plural = "Jetons refusés des bornes"
+
+    def __str__(self):
+        return "Jetons de la borne {} refusés jusqu'au {}".format(
+            self.terminal_id, self.expires
+        )
@@ -1,3 +1,7 @@
+import datetime
+
+from django.utils import timezone
+
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
@@ -12,9 +16,15 @@ from fleet.serializers import (
 
 from game.models import Game
 
+from backend.common import DONATION_FORMULAS
+
 from .models import Terminal, Donator, Session, Payment
 
 
+# Payments sent in batch may be dated this far in the future, because of the clock of the terminal
+PAYMENT_DATE_MAX_CLOCK_SKEW = datetime.timedelta(minutes=5)
+
+
 class _GameSerializer(serializers.ModelSerializer):
     class Meta:
         model = Game
@@ -107,7 +117,6 @@ class FullTerminalSerializer(serializers.ModelSerializer):
         read_only=True,
     )
     total_donations = serializers.ReadOnlyField()
-    payments = PaymentForTerminalSerializer(many=True, read_only=True)
     avg_donation = serializers.ReadOnlyField()
     avg_timesession = serializers.ReadOnlyField()
     avg_gametimesession = serializers.ReadOnlyField()
@@ -280,48 +289,107 @@ class PaymentFullSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
+class PaymentStatsSerializer(serializers.ModelSerializer):
+    """
+    Flat serializer of the payments listed with statistics of a terminal or a campaign
+    Payments must be fetched with select_related("campaign", "terminal", "game").
+    """
+
+    campaign_name = serializers.CharField(source="campaign.name", read_only=True)
+    terminal_name = serializers.CharField(source="terminal.name", read_only=True)
+    game_name = serializers.CharField(source="game.name", read_only=True, default=None)
+
+    class Meta:
+        model = Payment
+        fields = (
+            "id",
+            "date",
+            "method",
+            "status",
+            "amount",
+            "amount_donated",
+            "currency",
+            "payment_terminal",
+            "donation_formula",
+            "campaign",
+            "campaign_name",
+            "terminal",
+            "terminal_name",
+            "game",
+            "game_name",
+        )
+
+
+class PaymentBatchItemSerializer(serializers.Serializer):
+    """
+    Validate one payment sent in a batch by a terminal, without any query (see PaymentViewSet.batch).
+    Related objects are given by id and checked for the whole batch at once.
+    """
+
+    client_id = serializers.CharField(max_length=64)
+    # Bounds of Payment.sequence_number on every database
+    sequence_number = serializers.IntegerField(min_value=0, max_value=2**31 - 1)
+    # Date of the payment on the terminal, when it was made while offline
+    date = serializers.DateTimeField(required=False)
+    campaign = serializers.IntegerField()
+    game = serializers.IntegerField(required=False, allow_null=True)
+    donator = serializers.IntegerField(required=False, allow_null=True)
+    method = serializers.CharField(max_length=255)
+    status = serializers.CharField(max_length=255)
+    amount = serializers.FloatField()
+    currency = serializers.CharField(max_length=255)
+    payment_terminal = serializers.CharField(
+        max_length=250, required=False, allow_null=True
+    )
+    donation_formula = serializers.ChoiceField(
+        choices=DONATION_FORMULAS, required=False, allow_null=True
+    )
+
+    def validate_date(self, value):
+        now = timezone.now()
+
+        if value > now + PAYMENT_DATE_MAX_CLOCK_SKEW:
+            raise ValidationError("Date can not be in the future")
+
+        # Dates slightly ahead because of the clock of the terminal are set to now
+        return min(value, now)
+
+
 # Serializer pour le model Session
-# On surcharge la méthode "Create" pour calculer les timesessions
+# Les timesessions sont calculées à partir des heures de début et de fin (voir Session.compute_durations)
 class SessionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Session
         fields = "__all__"
+        read_only_fields = ("client_id",)  # Only sent with sessions uploaded in batch
 
     def create(self, validated_data):
-        if (
-            validated_data["end_time"]
-            and validated_data["start_time"]
-            and validated_data["end_global"]
-            and validated_data["start_global"]
-        ):
-            validated_data["timesession"] = (
-                validated_data["end_time"] - validated_data["start_time"]
-            )
-            validated_data["timesession_global"] = (
-                validated_data["end_global"] - validated_data["start_global"]
-            )
-        else:
-            validated_data["timesession"] = None
-            validated_data["timesession_global"] = None
-        session = Session.objects.create(**validated_data)
+        session = Session(**validated_data)
+        session.compute_durations()
         session.save()
         return session
 
     def update(self, instance, validated_data):
-        if (
-            validated_data["end_time"]
-            and validated_data["start_time"]
-            and validated_data["end_global"]
-            and validated_data["start_global"]
-        ):
-            validated_data["timesession"] = (
-                validated_data["end_time"] - validated_data["start_time"]
-            )
-            validated_data["timesession_global"] = (
-                validated_data["end_global"] - validated_data["start_global"]
-            )
-        else:
-            validated_data["timesession"] = None
-            validated_data["timesession_global"] = None
-        instance = super().update(instance, validated_data)
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+
+        instance.compute_durations()
+        instance.save()
         return instance
+
+
+class SessionBatchItemSerializer(serializers.Serializer):
+    """
+    Validate one session sent in a batch by a terminal, without any query (see SessionViewSet.batch).
+    Related objects are given by id and checked for the whole batch at once.
+    """
+
+    client_id = serializers.CharField(max_length=64, required=False, allow_null=True)
+    campaign = serializers.IntegerField()
+    game = serializers.IntegerField(required=False, allow_null=True)
+    donator = serializers.IntegerField(required=False, allow_null=True)
+    start_time = serializers.DateTimeField(required=False, allow_null=True)
+    end_time = serializers.DateTimeField(required=False, allow_null=True)
+    start_global = serializers.DateTimeField(required=False, allow_null=True)
+    end_global = serializers.DateTimeField(required=False, allow_null=True)
+    position_asso = serializers.IntegerField()
@@ -0,0 +1,157 @@
+import datetime
+
+from django.db.models import Avg, Count, Q, Sum
+from django.utils import timezone
+
+from terminal.models import Terminal, Session, PaymentDailyRollup
+from terminal.models.payment import amount_donated_expression
+
+
+def get_month_ranges(now=None):
+    """
+    Return the start of last month, the start of this month and the start of next month
+
+    Year boundaries are handled : last month of January is December of the previous year
+    """
+
+    now = now or timezone.now()
+
+    start_this_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    start_last_month = (start_this_month - datetime.timedelta(days=1)).replace(day=1)
+    start_next_month = (start_this_month + datetime.timedelta(days=32)).replace(day=1)
+
+    return start_last_month, start_this_month, start_next_month
+
+
+def get_dashboard_stats(customer=None):
+    """
+    Compute the month over month statistics displayed on the dashboard of SETH
+
+    Statistics are computed for the terminals of the given customer, or for every terminals if customer is None.
+    Payment rollups and sessions are each aggregated in a single query with conditional aggregation.
+    """
+
+    start_last_month, start_this_month, start_next_month = get_month_ranges()
+
+    rollups = PaymentDailyRollup.objects.filter(
+        day__gte=start_last_month.date(), day__lt=start_next_month.date()
+    )
+    sessions = Session.objects.all()
+    terminals = Terminal.objects.all()
+
+    if customer is not None:
+        rollups = rollups.filter(terminal__customer=customer)
+        sessions = sessions.filter(terminal__customer=customer)
+        terminals = terminals.filter(customer=customer)
+
+    # Calculate total amount collected and donated this month and last month
+
+    this_month = Q(day__gte=start_this_month.date())
+    last_month = Q(day__lt=start_this_month.date())
+
+    payments_stats = rollups.aggregate(
+        collected=Sum("total_amount", filter=this_month),
+        collected_last=Sum("total_amount", filter=last_month),
+        donated=Sum("total_amount_donated", filter=this_month),
+        donated_last=Sum("total_amount_donated", filter=last_month),
+    )
+
+    # Count sessions this month and last month, and sum every game sessions
+
+    sessions_stats = sessions.aggregate(
+        nb_donators=Count(
+            "id",
+            filter=Q(start_time__gte=start_this_month, start_time__lt=start_next_month),
+        ),
+        nb_donators_last=Count(
+            "id",
+            filter=Q(start_time__gte=start_last_month, start_time__lt=start_this_month),
+        ),
+        total_gamesession=Sum("timesession"),
+    )
+
+    return {
+        "collected": payments_stats["collected"] or 0,
+        "collected_last": payments_stats["collected_last"] or 0,
+        "donated": payments_stats["donated"] or 0,
+        "donated_last": payments_stats["donated_last"] or 0,
+        "nb_donators": sessions_stats["nb_donators"],
+        "nb_terminals": terminals.count(),
+        "total_gamesession": sessions_stats["total_gamesession"],
+        "nb_donators_last": sessions_stats["nb_donators_last"],
+    }
+
+
+def get_accepted_payments_stats(rollups):
+    """
+    Return the number, the total amount and the average amount of accepted payments of some payment rollups
+
+    Total and average are None if there is no accepted payment.
+    """
+
+    stats = rollups.filter(status="Accepted").aggregate(
+        nb_payments=Sum("nb_payments"), total_amount=Sum("total_amount")
+    )
+
+    nb_payments = stats["nb_payments"] or 0
+
+    return {
+        "nb_payments": nb_payments,
+        "total_amount": stats["total_amount"],
+        "avg_amount": stats["total_amount"] / nb_payments if nb_payments else None,
+    }
+
+
+def get_payments_totals(rollups):
+    """
+    Return the totals displayed with the filtered payments listing of SETH, computed from some payment rollups
+    """
+
+    not_skiped = ~Q(status="Skiped")
+
+    totals = rollups.aggregate(
+        total_amount_excluding_skiped=Sum("total_amount", filter=not_skiped),
+        nb_payments_excluding_skiped=Sum("nb_payments", filter=not_skiped),
+        amount_donated=Sum("total_amount_donated"),
+        nb_payments=Sum("nb_payments"),
+    )
+
+    total_amount_excluding_skiped = totals["total_amount_excluding_skiped"] or 0
+    nb_payments_excluding_skiped = totals["nb_payments_excluding_skiped"] or 0
+
+    return {
+        "total_amount_excluding_skiped": total_amount_excluding_skiped,
+        "average_amount_excluding_skiped": round(
+            total_amount_excluding_skiped / nb_payments_excluding_skiped, 2
+        )
+        if nb_payments_excluding_skiped
+        else 0,
+        "amount_donated": totals["amount_donated"] or 0,
+        "nb_payments": totals["nb_payments"] or 0,
+    }
+
+
+def get_payments_totals_from_payments(payments):
+    """
+    Same as get_payments_totals, but computed from a queryset of payments in a single query
+    """
+
+    not_skiped = ~Q(status="Skiped")
+
+    totals = payments.aggregate(
+        total_amount_excluding_skiped=Sum("amount", filter=not_skiped),
+        average_amount_excluding_skiped=Avg("amount", filter=not_skiped),
+        amount_donated=Sum(amount_donated_expression()),
+        nb_payments=Count("id"),
+    )
+
+    return {
+        "total_amount_excluding_skiped": totals["total_amount_excluding_skiped"] or 0,
+        "average_amount_excluding_skiped": round(
+            totals["average_amount_excluding_skiped"], 2
+        )
+        if totals["average_amount_excluding_skiped"] is not None
+        else 0,
+        "amount_donated": totals["amount_donated"] or 0,
+        "nb_payments": totals["nb_payments"],
+    }
@@ -1,3 +1,1438 @@
-from django.test import TestCase
+import datetime
+import hashlib
+import importlib
+import shutil
+import tempfile
+from contextlib import contextmanager
+from unittest import mock
+from unittest import skipUnless
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.signals import request_started
+from django.db import DatabaseError, connections
+from django.db.models import QuerySet
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from rest_framework.authentication import BasicAuthentication
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from fleet.models import User, Customer, Campaign
+from game.models import BiosFile, Core, CoreFile, Game, GameFile
+
+from backend.authentication import (
+    TERMINAL_AUTHENTICATION_CLASSES,
+    allow_terminal_tokens,
+    deny_terminal_tokens,
+    set_role_claims,
+)
+from backend.database import READ_REPLICA, get_read_replica_alias
+
+from terminal import audit
+from terminal.models import (
+    Terminal,
+    Payment,
+    PaymentAuditEntry,
+    PaymentDailyRollup,
+    Session,
+    TerminalApiKey,
+    TerminalBandwidthUsage,
+)
+from terminal.stats import get_dashboard_stats, get_month_ranges
+
+
+def shared_cache(cache_dir):
+    """
+    Use a cache shared between processes, which caches more than the cache local to the process of tests
+    (see backend.common.is_cache_shared)
+    """
+
+    return override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                "LOCATION": cache_dir,
+            }
+        }
+    )
+
+
+@contextmanager
+def without_basic_authentication():
+    """
+    Disable basic authentication, as BASIC_AUTHENTICATION = False does when settings are loaded
+    """
+
+    # Views share this list
+    terminal_authentication_classes = TERMINAL_AUTHENTICATION_CLASSES[:]
+    TERMINAL_AUTHENTICATION_CLASSES[:] = [
+        authentication_class
+        for authentication_class in terminal_authentication_classes
+        if authentication_class is not BasicAuthentication
+    ]
+
+    rest_framework = {
+        **settings.REST_FRAMEWORK,
+        "DEFAULT_AUTHENTICATION_CLASSES": [
+            authentication_class
+            for authentication_class in settings.REST_FRAMEWORK[
+                "DEFAULT_AUTHENTICATION_CLASSES"
+            ]
+            if authentication_class
+            != "rest_framework.authentication.BasicAuthentication"
+        ],
+    }
+
+    try:
+        with override_settings(REST_FRAMEWORK=rest_framework):
+            yield
+    finally:
+        TERMINAL_AUTHENTICATION_CLASSES[:] = terminal_authentication_classes
+
+
+@override_settings(PAYMENT_AUDIT_BUFFER_SIZE=0)
+class PaymentCreationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+        self.customer = Customer.objects.create(company="Client")
+        self.user = User.objects.create(username="terminal")
+        self.terminal = Terminal.objects.create(
+            name="Borne",
+            owner=self.user,
+            customer=self.customer,
+            payment_terminal="TPE",
+            donation_formula="Partage",
+            donation_share=20,
+        )
+        self.campaign = Campaign.objects.create(
+            name="Campagne", description="", goal_amount=100, link=""
+        )
+        self.game = Game.objects.create(
+            name="Jeu",
+            path="",
+            description="",
+            file=GameFile.objects.create(file="jeu.rom"),
+        )
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _create_payment(self):
+        return self.client.post(
+            "/payment/",
+            {
+                "terminal": self.terminal.pk,
+                "campaign": self.campaign.pk,
+                "game": self.game.pk,
+                "method": "CB",
+                "status": "Accepted",
+                "amount": 10,
+                "currency": "EUR",
+            },
+        )
+
+    def test_number_of_queries(self):
+        with tempfile.TemporaryDirectory() as cache_dir, shared_cache(cache_dir):
+            self._create_payment()  # Fill the cache of donation settings and create the rollup of today
+
+            # Campaign and game validation, payment insert, rollup update and audit entry insert,
+            # plus the savepoints of the payment and of the audit entry (BEGIN and COMMIT outside of tests)
+            with self.assertNumQueries(9):
+                response = self._create_payment()
+
+        self.assertEqual(response.status_code, 201)
+
+        payment = Payment.objects.get(pk=response.data["id"])
+        self.assertEqual(payment.terminal, self.terminal)
+        self.assertEqual(payment.payment_terminal, "TPE")
+        self.assertEqual(payment.amount_donated, 2)
+
+    def test_donation_settings_cache_is_cleared_when_terminal_is_saved(self):
+        with tempfile.TemporaryDirectory() as cache_dir, shared_cache(cache_dir):
+            self._create_payment()
+
+            self.terminal.donation_share = 50
+            self.terminal.save()
+
+            response = self._create_payment()
+
+        self.assertEqual(Payment.objects.get(pk=response.data["id"]).amount_donated, 5)
+
+    def test_donation_settings_are_not_cached_by_each_process(self):
+        self._create_payment()
+
+        # Saved by another process, which cleared only its own cache
+        Terminal.objects.filter(pk=self.terminal.pk).update(donation_share=50)
+
+        response = self._create_payment()
+        self.assertEqual(Payment.objects.get(pk=response.data["id"]).amount_donated, 5)
+
+    def test_rollup_is_created_once_per_key(self):
+        payment = Payment.objects.create(
+            terminal=self.terminal,
+            campaign=self.campaign,
+            method="CB",
+            status="Accepted",
+            amount=10,
+            currency="EUR",
+        )
+
+        update = QuerySet.update
+
+        def update_after_concurrent_creation(queryset, **kwargs):
+            # The row did not exist yet when it was updated, and was created meanwhile by a concurrent request
+            if update_after_concurrent_creation.first_call:
+                update_after_concurrent_creation.first_call = False
+                return 0
+            return update(queryset, **kwargs)
+
+        update_after_concurrent_creation.first_call = True
+
+        with mock.patch.object(
+            QuerySet,
+            "update",
+            autospec=True,
+            side_effect=update_after_concurrent_creation,
+        ):
+            PaymentDailyRollup.add_payment(payment)
+
+        rollup = PaymentDailyRollup.objects.get()
+        self.assertEqual(rollup.game, None)
+        self.assertEqual(rollup.nb_payments, 2)
+        self.assertEqual(rollup.total_amount, 20)
+
+    def test_rollups_follow_changes_of_payments(self):
+        payment = Payment.objects.get(pk=self._create_payment().data["id"])
+
+        payment.amount = 30
+        payment.save()
+
+        rollup = PaymentDailyRollup.objects.get()
+        self.assertEqual(rollup.nb_payments, 1)
+        self.assertEqual(rollup.total_amount, 30)
+
+        payment.status = "Refused"
+        payment.save()
+
+        self.assertEqual(
+            list(PaymentDailyRollup.objects.values_list("status", "nb_payments")),
+            [("Refused", 1)],
+        )
+
+        payment.delete()
+
+        self.assertFalse(PaymentDailyRollup.objects.exists())
+
+    def test_rollups_are_backfilled_by_migration(self):
+        backfill = importlib.import_module(
+            "terminal.migrations.0039_backfill_payment_daily_rollups"
+        )
+
+        # Payments received before rollups existed, or created without signals
+        Payment.objects.bulk_create(
+            Payment(
+                terminal=self.terminal,
+                campaign=self.campaign,
+                method="CB",
+                status="Accepted",
+                amount=amount,
+                amount_donated=amount / 5,
+                currency="EUR",
+            )
+            for amount in (10, 20)
+        )
+        self._create_payment()
+
+        backfill.backfill_rollups(apps, None)
+
+        rollups = PaymentDailyRollup.objects.order_by("game")
+        self.assertEqual(
+            list(rollups.values_list("nb_payments", "total_amount")),
+            [(2, 30), (1, 10)],
+        )
+        self.assertEqual(
+            rollups[0].key,
+            PaymentDailyRollup.get_key(
+                timezone.localdate(),
+                self.terminal.pk,
+                self.campaign.pk,
+                None,
+                "Accepted",
+                "Partage",
+                "TPE",
+            ),
+        )
+
+    def test_error_is_logged_when_body_is_not_an_object(self):
+        response = self.client.post("/payment/", [], format="json")
+        self.assertEqual(response.status_code, 400)
+
+        entry = PaymentAuditEntry.objects.get()
+        self.assertEqual(entry.kind, PaymentAuditEntry.ERROR)
+        self.assertEqual(entry.terminal, None)
+
+    def test_audit_entries_are_saved_one_by_one_if_bulk_create_fails(self):
+        entries = [
+            PaymentAuditEntry(kind=PaymentAuditEntry.PAYMENT, data="1"),
+            PaymentAuditEntry(kind=PaymentAuditEntry.PAYMENT, data="2"),
+        ]
+
+        with mock.patch.object(
+            PaymentAuditEntry.objects, "bulk_create", side_effect=DatabaseError
+        ), self.assertLogs("terminal.audit"):
+            audit.PaymentAuditBuffer()._write(entries)
+
+        self.assertEqual(PaymentAuditEntry.objects.count(), 2)
+
+    def test_payment_for_another_terminal_is_refused(self):
+        response = self.client.post(
+            "/payment/",
+            {
+                "terminal": self.terminal.pk + 1,
+                "campaign": self.campaign.pk,
+                "method": "CB",
+                "status": "Accepted",
+                "amount": 10,
+                "currency": "EUR",
+            },
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Payment.objects.exists())
+        self.assertEqual(PaymentAuditEntry.objects.get().kind, PaymentAuditEntry.ERROR)
+
+
+@override_settings(PAYMENT_AUDIT_BUFFER_SIZE=0)
+class PaymentBatchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="terminal")
+        self.terminal = Terminal.objects.create(
+            name="Borne",
+            owner=self.user,
+            customer=Customer.objects.create(company="Client"),
+            donation_formula="Classique",
+        )
+        self.campaign = Campaign.objects.create(
+            name="Campagne", description="", goal_amount=100, link=""
+        )
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _send_payments(self, *payments):
+        return self.client.post(
+            "/payment/batch/",
+            {
+                "payments": [
+                    dict(
+                        {
+                            "campaign": self.campaign.pk,
+                            "method": "CB",
+                            "status": "Accepted",
+                            "amount": 10,
+                            "currency": "EUR",
+                        },
+                        **payment
+                    )
+                    for payment in payments
+                ]
+            },
+            format="json",
+        )
+
+    def test_payments_sent_again_are_created_once(self):
+        response = self._send_payments(
+            {"client_id": "a", "sequence_number": 0},
+            {"client_id": "b", "sequence_number": 1},
+        )
+        self.assertEqual(
+            [result["result"] for result in response.data["results"]],
+            ["created", "created"],
+        )
+        id_b = response.data["results"][1]["id"]
+
+        response = self._send_payments(
+            {"client_id": "b", "sequence_number": 1},
+            {"client_id": "c", "sequence_number": 2},
+            {"client_id": "c", "sequence_number": 2},
+        )
+
+        self.assertEqual(
+            [result["result"] for result in response.data["results"]],
+            ["duplicate", "created", "duplicate"],
+        )
+        self.assertEqual(response.data["results"][0]["id"], id_b)
+        self.assertEqual(response.data["last_sequence_number"], 2)
+        self.assertEqual(Payment.objects.count(), 3)
+        self.assertEqual(PaymentDailyRollup.objects.get().nb_payments, 3)
+
+    def test_missing_sequence_numbers(self):
+        self._send_payments(
+            *(
+                {"client_id": str(number), "sequence_number": number}
+                for number in (0, 1, 3, 6)
+            )
+        )
+
+        response = self.client.get("/payment/sequence/", {"since": 1})
+
+        self.assertEqual(response.data["last_sequence_number"], 6)
+        self.assertEqual(response.data["missing_sequence_numbers"], [2, 4, 5])
+
+    def test_date_of_payment(self):
+        yesterday = timezone.now() - datetime.timedelta(days=1)
+
+        response = self._send_payments(
+            {"client_id": "a", "sequence_number": 0, "date": yesterday.isoformat()},
+            {"client_id": "b", "sequence_number": 1},
+            {
+                "client_id": "c",
+                "sequence_number": 2,
+                "date": (timezone.now() + datetime.timedelta(days=1)).isoformat(),
+            },
+            {"client_id": "d", "sequence_number": 2**31},
+        )
+
+        results = response.data["results"]
+        self.assertEqual(Payment.objects.get(pk=results[0]["id"]).date, yesterday)
+        self.assertEqual(
+            Payment.objects.get(pk=results[1]["id"]).date.date(), timezone.now().date()
+        )
+        self.assertEqual(list(results[2]["errors"]), ["date"])
+        self.assertEqual(list(results[3]["errors"]), ["sequence_number"])
+        self.assertEqual(
+            PaymentDailyRollup.objects.get(
+                day=timezone.localdate(yesterday)
+            ).nb_payments,
+            1,
+        )
+
+
+class SessionBatchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="terminal")
+        self.terminal = Terminal.objects.create(
+            name="Borne",
+            owner=self.user,
+            customer=Customer.objects.create(company="Client"),
+        )
+        self.campaign = Campaign.objects.create(
+            name="Campagne", description="", goal_amount=100, link=""
+        )
+        self.start = timezone.now() - datetime.timedelta(hours=1)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _send_sessions(self, *sessions):
+        return self.client.post(
+            "/session/batch/",
+            {
+                "sessions": [
+                    dict(
+                        {
+                            "campaign": self.campaign.pk,
+                            "position_asso": 0,
+                            "start_time": self.start.isoformat(),
+                            "start_global": self.start.isoformat(),
+                        },
+                        **session
+                    )
+                    for session in sessions
+                ]
+            },
+            format="json",
+        )
+
+    def test_sessions_sent_again_are_updated(self):
+        end = self.start + datetime.timedelta(minutes=5)
+
+        response = self._send_sessions({"client_id": "a"}, {"client_id": None})
+        self.assertEqual(
+            [result["result"] for result in response.data["results"]],
+            ["created", "created"],
+        )
+
+        # Without end time, durations can not be computed
+        session = Session.objects.get(client_id="a")
+        self.assertEqual(session.timesession, None)
+        self.assertEqual(session.timesession_global, None)
+
+        response = self._send_sessions(
+            {
+                "client_id": "a",
+                "end_time": end.isoformat(),
+                "end_global": (end + datetime.timedelta(minutes=1)).isoformat(),
+            }
+        )
+        self.assertEqual(response.data["results"][0]["result"], "updated")
+
+        session.refresh_from_db()
+        self.assertEqual(session.timesession, datetime.timedelta(minutes=5))
+        self.assertEqual(session.timesession_global, datetime.timedelta(minutes=6))
+        self.assertEqual(Session.objects.count(), 2)
+
+    def test_client_id_is_read_only(self):
+        self._send_sessions({"client_id": "a"})
+
+        response = self.client.post(
+            "/session/",
+            {
+                "terminal": self.terminal.pk,
+                "campaign": self.campaign.pk,
+                "position_asso": 0,
+                "client_id": "a",
+            },
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["client_id"], None)
+
+
+class TerminalAuthenticationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+        self.user = User.objects.create(username="terminal")
+        self.terminal = Terminal.objects.create(
+            name="Borne",
+            owner=self.user,
+            customer=Customer.objects.create(company="Client"),
+        )
+
+        token = AccessToken.for_user(self.user)
+        set_role_claims(token, self.user)
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer {}".format(token))
+
+    def _get_sequence(self):
+        return self.client.get("/payment/sequence/").status_code
+
+    def test_tokens_of_deactivated_terminal_are_refused(self):
+        self.assertEqual(self._get_sequence(), 200)
+
+        deny_terminal_tokens(self.terminal.pk)
+        self.assertEqual(self._get_sequence(), 401)
+
+        allow_terminal_tokens(self.terminal.pk)
+        self.assertEqual(self._get_sequence(), 200)
+
+    def test_deny_list_is_kept_when_shared_cache_is_cleared(self):
+        with tempfile.TemporaryDirectory() as cache_dir, shared_cache(cache_dir):
+            deny_terminal_tokens(self.terminal.pk)
+            self.assertEqual(self._get_sequence(), 401)
+
+            caches["default"].clear()  # Evicted
+            self.assertEqual(self._get_sequence(), 401)
+
+            allow_terminal_tokens(self.terminal.pk)
+            self.assertEqual(self._get_sequence(), 200)
+
+
+class TerminalApiKeyTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+        self.admin = User.objects.create(username="admin", is_staff=True)
+        self.terminal = Terminal.objects.create(
+            name="Borne",
+            owner=User.objects.create(username="terminal", is_active=True),
+            customer=Customer.objects.create(company="Client"),
+            is_active=True,
+        )
+        self.api_key, self.key = TerminalApiKey.issue(self.terminal)
+
+        self.client = APIClient()
+
+    def _get_sequence(self, key):
+        return self.client.get(
+            "/payment/sequence/", HTTP_AUTHORIZATION="Api-Key {}".format(key)
+        ).status_code
+
+    def test_valid_key(self):
+        with tempfile.TemporaryDirectory() as cache_dir, shared_cache(cache_dir):
+            self.assertEqual(self._get_sequence(self.key), 200)
+
+            # The key and the deny list are cached, only the terminal and its sequence numbers are queried
+            with self.assertNumQueries(3):
+                self.assertEqual(self._get_sequence(self.key), 200)
+
+    def test_wrong_secret(self):
+        self.assertEqual(self._get_sequence(self.api_key.key_id + ".secret"), 401)
+        self.assertEqual(self._get_sequence(self.api_key.key_id), 401)
+
+    def test_unknown_key_is_cached(self):
+        with tempfile.TemporaryDirectory() as cache_dir, shared_cache(cache_dir):
+            self.assertEqual(self._get_sequence("0123456789abcdef.secret"), 401)
+
+            with self.assertNumQueries(0):
+                self.assertEqual(self._get_sequence("0123456789abcdef.secret"), 401)
+
+    def test_deactivated_key(self):
+        with tempfile.TemporaryDirectory() as cache_dir, shared_cache(cache_dir):
+            self.assertEqual(self._get_sequence(self.key), 200)
+
+            # The cache of the key is cleared when it is saved
+            self.api_key.is_active = False
+            self.api_key.save()
+
+            self.assertEqual(self._get_sequence(self.key), 401)
+
+    def test_key_deactivated_by_another_process(self):
+        self.assertEqual(self._get_sequence(self.key), 200)
+
+        # Saved by another process, which cleared only its own cache
+        TerminalApiKey.objects.filter(pk=self.api_key.pk).update(is_active=False)
+
+        self.assertEqual(self._get_sequence(self.key), 401)
+
+    def test_deactivated_terminal(self):
+        with tempfile.TemporaryDirectory() as cache_dir, shared_cache(cache_dir):
+            self.assertEqual(self._get_sequence(self.key), 200)
+
+            self.client.force_authenticate(self.admin)
+            self.client.post("/terminals/{}/deactivate/".format(self.terminal.pk))
+            self.client.force_authenticate(None)
+
+            # The key is still cached, the terminal is refused by the deny list
+            self.assertEqual(self._get_sequence(self.key), 401)
+
+    def test_endpoints_called_by_terminals(self):
+        self.client.credentials(HTTP_AUTHORIZATION="Api-Key {}".format(self.key))
+
+        with without_basic_authentication():
+            response = self.client.post(
+                "/donator/", {"email": "donateur@example.com"}, format="json"
+            )
+            self.assertEqual(response.status_code, 201)
+
+            for url in (
+                "/my-terminal/",
+                "/donator/email/donateur@example.com/",
+                "/payment/sequence/",
+                "/terminal/mine/",
+                "/terminal/mine/on/",
+                "/terminal/mine/off/",
+                "/terminal/mine/play/",
+                "/terminal/mine/gameover/",
+            ):
+                self.assertEqual(self.client.get(url).status_code, 200, url)
+
+    def test_revoke_previous(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.post(
+            "/terminals/{}/api_key/".format(self.terminal.pk),
+            {"revoke_previous": True},
+            format="json",
+        )
+        self.client.force_authenticate(None)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self._get_sequence(self.key), 401)
+        self.assertEqual(self._get_sequence(response.data["api_key"]), 200)
+
+
+@override_settings(PAYMENT_AUDIT_BUFFER_SIZE=0)
+class DashboardStatsTest(TestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(company="Client")
+        self.terminal = Terminal.objects.create(
+            name="Borne",
+            owner=User.objects.create(username="terminal"),
+            customer=self.customer,
+            donation_formula="Partage",
+            donation_share=50,
+        )
+        self.other_terminal = Terminal.objects.create(
+            name="Autre borne",
+            owner=User.objects.create(username="other"),
+            customer=Customer.objects.create(company="Autre client"),
+            donation_formula="Partage",
+            donation_share=50,
+        )
+        self.campaign = Campaign.objects.create(
+            name="Campagne", description="", goal_amount=100, link=""
+        )
+
+        _, self.start_this_month, _ = get_month_ranges()
+
+    def _create_payment(self, terminal, date, amount):
+        Payment.objects.create(
+            terminal=terminal,
+            campaign=self.campaign,
+            date=date,
+            method="CB",
+            status="Accepted",
+            amount=amount,
+            amount_donated=amount / 2,
+            currency="EUR",
+        )
+
+    def _create_session(self, terminal, start_time):
+        Session.objects.create(
+            terminal=terminal,
+            campaign=self.campaign,
+            start_time=start_time,
+            position_asso=0,
+            timesession=datetime.timedelta(minutes=1),
+        )
+
+    def test_month_ranges_of_january(self):
+        now = timezone.make_aware(datetime.datetime(2020, 1, 15, 12))
+
+        self.assertEqual(
+            [start.date() for start in get_month_ranges(now)],
+            [
+                datetime.date(2019, 12, 1),
+                datetime.date(2020, 1, 1),
+                datetime.date(2020, 2, 1),
+            ],
+        )
+
+    def test_stats(self):
+        last_month = self.start_this_month - datetime.timedelta(days=1)
+        two_months_ago = last_month.replace(day=1) - datetime.timedelta(days=1)
+
+        for terminal in (self.terminal, self.other_terminal):
+            self._create_payment(terminal, self.start_this_month, 10)
+            self._create_payment(terminal, last_month, 20)
+            self._create_payment(terminal, two_months_ago, 40)  # Not counted
+            self._create_session(terminal, self.start_this_month)
+            self._create_session(terminal, last_month)
+
+        with self.assertNumQueries(3):
+            stats = get_dashboard_stats(self.customer)
+
+        self.assertEqual(
+            stats,
+            {
+                "collected": 10,
+                "collected_last": 20,
+                "donated": 5,
+                "donated_last": 10,
+                "nb_donators": 1,
+                "nb_terminals": 1,
+                "total_gamesession": datetime.timedelta(minutes=2),
+                "nb_donators_last": 1,
+            },
+        )
+
+        stats = get_dashboard_stats()
+        self.assertEqual(stats["collected"], 20)
+        self.assertEqual(stats["donated_last"], 20)
+        self.assertEqual(stats["nb_donators"], 2)
+        self.assertEqual(stats["nb_terminals"], 2)
+
+    def test_stats_without_payments(self):
+        stats = get_dashboard_stats(self.customer)
+
+        self.assertEqual(stats["collected"], 0)
+        self.assertEqual(stats["donated_last"], 0)
+        self.assertEqual(stats["nb_donators"], 0)
+        self.assertEqual(stats["total_gamesession"], None)
+
+
+class TerminalListingTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username="admin", is_staff=True)
+        self.customer = Customer.objects.create(company="Client")
+        self.campaign = Campaign.objects.create(
+            name="Campagne", description="", goal_amount=100, link=""
+        )
+        self.game = Game.objects.create(
+            name="Jeu",
+            path="",
+            description="",
+            file=GameFile.objects.create(file="jeu.rom"),
+        )
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def _create_terminal(self, name):
+        terminal = Terminal.objects.create(
+            name=name,
+            owner=User.objects.create(username=name),
+            customer=self.customer,
+            donation_formula="Classique",
+        )
+        terminal.campaigns.add(self.campaign)
+        terminal.games.add(self.game)
+
+        for amount in (10, 20):
+            Payment.objects.create(
+                terminal=terminal,
+                campaign=self.campaign,
+                method="CB",
+                status="Accepted",
+                amount=amount,
+                currency="EUR",
+            )
+
+        return terminal
+
+    def _count_queries(self, url):
+        with CaptureQueriesContext(connections["default"]) as queries:
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_listing(self):
+        self._create_terminal("borne-1")
+        response, nb_queries = self._count_queries("/terminals/")
+
+        self.assertEqual(response.data[0]["total_donations"], 30)
+        self.assertEqual(response.data[0]["campaigns"], [{"name": "Campagne"}])
+
+        self._create_terminal("borne-2")
+        self._create_terminal("borne-3")
+        response, nb_queries_of_more_terminals = self._count_queries("/terminals/")
+
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(nb_queries_of_more_terminals, nb_queries)
+
+    def test_detail(self):
+        terminal = self._create_terminal("borne")
+        url = "/terminals/{}/".format(terminal.pk)
+        response, nb_queries = self._count_queries(url)
+
+        self.assertNotIn("payments", response.data)
+
+        # Payments are not serialized with the terminal
+        Payment.objects.create(
+            terminal=terminal,
+            campaign=self.campaign,
+            method="CB",
+            status="Accepted",
+            amount=30,
+            currency="EUR",
+        )
+        response, nb_queries_of_more_payments = self._count_queries(url)
+
+        self.assertEqual(nb_queries_of_more_payments, nb_queries)
+
+    def test_stats_are_annotated(self):
+        terminal = self._create_terminal("borne")
+        Payment.objects.create(
+            terminal=terminal,
+            campaign=self.campaign,
+            method="CB",
+            status="Refused",
+            amount=100,
+            currency="EUR",
+        )
+
+        start = timezone.now()
+        for minutes in (1, 2):
+            Session.objects.create(
+                terminal=terminal,
+                campaign=self.campaign,
+                start_time=start,
+                start_global=start,
+                position_asso=0,
+                timesession=datetime.timedelta(minutes=minutes),
+                timesession_global=datetime.timedelta(days=1, minutes=minutes),
+            )
+
+        annotated = Terminal.objects.with_stats().get(pk=terminal.pk)
+
+        with self.assertNumQueries(0):
+            stats = (
+                annotated.total_donations,
+                annotated.avg_donation,
+                annotated.avg_timesession,
+                annotated.avg_gametimesession,
+            )
+
+        self.assertEqual(stats, (30, 15, "24:01:30", "00:01:30"))
+        self.assertEqual(
+            stats,
+            (
+                terminal.total_donations,
+                terminal.avg_donation,
+                terminal.avg_timesession,
+                terminal.avg_gametimesession,
+            ),
+        )
+
+    def test_payments_of_terminal(self):
+        terminal = self._create_terminal("borne")
+
+        response = self.client.get(
+            "/terminals/{}/payments/".format(terminal.pk), {"limit": 1, "page": 2}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 2)
+        self.assertEqual(response.data["nb_pages"], 2)
+        self.assertEqual(
+            [payment["amount"] for payment in response.data["payments"]], [10]
+        )
+
+
+class TerminalConfigTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+        self.user = User.objects.create(username="terminal")
+        self.terminal = Terminal.objects.create(
+            name="Borne",
+            owner=self.user,
+            customer=Customer.objects.create(company="Client"),
+            donation_formula="Classique",
+        )
+
+        # The ETag also changes with time, periods must not change during tests
+        time_patcher = mock.patch(
+            "terminal.models.terminal.time.time", return_value=1700000000
+        )
+        time_patcher.start()
+        self.addCleanup(time_patcher.stop)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _heartbeat(self, **data):
+        response = self.client.post("/my-terminal/heartbeat/", data, format="json")
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_heartbeat(self):
+        Terminal.objects.filter(pk=self.terminal.pk).update(
+            check_for_updates=True, restart=True
+        )
+        config_version = self.terminal.config_version
+
+        response = self._heartbeat(version="2.0", is_playing=True)
+
+        self.assertEqual(response.data["commands"], ["sudo reboot"])
+        self.assertTrue(response.data["check_for_updates"])
+        self.assertEqual(response.data["config_etag"], self.terminal.config_etag)
+
+        self.terminal.refresh_from_db()
+        self.assertEqual(
+            [getattr(self.terminal, field) for field in sorted(Terminal.STATE_FIELDS)],
+            [False, True, True, False, "2.0"],
+        )
+        self.assertEqual(self.terminal.config_version, config_version)
+
+        # Nothing is written when nothing changed
+        with CaptureQueriesContext(connections["default"]) as queries:
+            response = self._heartbeat(version="2.0", is_playing=True)
+
+        self.assertEqual(response.data["commands"], [])
+        self.assertFalse(response.data["check_for_updates"])
+        self.assertFalse(
+            [query for query in queries if query["sql"].startswith("UPDATE")]
+        )
+
+    def _get_config(self, etag=None):
+        headers = {"HTTP_IF_NONE_MATCH": etag} if etag else {}
+        return self.client.get("/my-terminal/", **headers)
+
+    def test_config_etag(self):
+        response = self._get_config()
+        etag = response["ETag"]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["terminal"]["name"], "Borne")
+        self.assertEqual(self._get_config(etag).status_code, 304)
+
+        # Configuration is changed
+        self.terminal.name = "Nouvelle borne"
+        self.terminal.save()
+
+        response = self._get_config(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.data["terminal"]["name"], "Nouvelle borne")
+
+        etag = response["ETag"]
+
+        # So are campaigns of the terminal
+        self.terminal.campaigns.add(
+            Campaign.objects.create(
+                name="Campagne", description="", goal_amount=100, link=""
+            )
+        )
+
+        response = self._get_config(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_config_etag_does_not_change_with_state(self):
+        etag = self._get_config()["ETag"]
+
+        self._heartbeat(version="2.0", is_playing=True)
+
+        for url in ("/my-terminal/turn_on/", "/my-terminal/stop_playing/"):
+            self.assertEqual(self.client.post(url).status_code, 200)
+
+        # Legacy state endpoints
+        for url in ("/terminal/mine/on/", "/terminal/mine/play/"):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+        self.assertEqual(self._get_config(etag).status_code, 304)
+
+        # State fields are read from the database, the configuration is served from the cache
+        response = self._get_config()
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.data["terminal"]["is_playing"], True)
+        self.assertEqual(response.data["terminal"]["version"], "2.0")
+
+
+class StatsPayloadTest(TransactionTestCase):
+    # Payments of the statistics are serialized flat, so the payload does not depend on the number of payments,
+    # campaigns or games of the terminal
+    MAX_PAYLOAD_SIZE = 3000
+
+    # Statistics are read from the read replica when there is one (see REPLICA_DATABASE_URL),
+    # which only sees committed rows
+    databases = "__all__"
+
+    def setUp(self):
+        self.admin = User.objects.create(username="admin", is_staff=True)
+        self.terminal = Terminal.objects.create(
+            name="Borne",
+            owner=User.objects.create(username="terminal"),
+            customer=Customer.objects.create(company="Client"),
+            donation_formula="Classique",
+        )
+        self.campaign = Campaign.objects.create(
+            name="Campagne", description="", goal_amount=100, link=""
+        )
+        self.terminal.campaigns.add(self.campaign)
+        self.game = Game.objects.create(
+            name="Jeu",
+            path="",
+            description="",
+            file=GameFile.objects.create(file="jeu.rom"),
+        )
+        self.terminal.games.add(self.game)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def _create_payments(self, nb_payments):
+        Payment.objects.bulk_create(
+            Payment(
+                terminal=self.terminal,
+                campaign=self.campaign,
+                game=self.game,
+                method="CB",
+                status="Accepted",
+                amount=10,
+                currency="EUR",
+            )
+            for _ in range(nb_payments)
+        )
+
+    def _assert_payload_is_bounded(self, url):
+        self._create_payments(5)
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.json(), dict)
+        self.assertLess(len(response.content), self.MAX_PAYLOAD_SIZE)
+
+        # Only totals grow with the number of payments
+        self._create_payments(100)
+        self.assertLess(len(self.client.get(url).content), self.MAX_PAYLOAD_SIZE)
+
+    def test_stats_by_terminal_payload_is_bounded(self):
+        self._assert_payload_is_bounded("/terminal/{}/stats/".format(self.terminal.pk))
+
+    def test_stats_by_campaign_payload_is_bounded(self):
+        self._assert_payload_is_bounded("/campaign/{}/stats/".format(self.campaign.pk))
+
+
+@override_settings(PAYMENT_AUDIT_BUFFER_SIZE=0)
+class PaymentFilteredTest(TransactionTestCase):
+    # Filtered payments are read from the read replica when there is one (see REPLICA_DATABASE_URL),
+    # which only sees committed rows
+    databases = "__all__"
+
+    def setUp(self):
+        self.admin = User.objects.create(username="admin", is_staff=True)
+        self.terminal = Terminal.objects.create(
+            name="Borne",
+            owner=User.objects.create(username="terminal"),
+            customer=Customer.objects.create(company="Client"),
+            payment_terminal="TPE",
+            donation_formula="Partage",
+            donation_share=20,
+        )
+        self.campaign = Campaign.objects.create(
+            name="Campagne", description="", goal_amount=100, link=""
+        )
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def _create_payments(self, nb_payments, **kwargs):
+        for _ in range(nb_payments):
+            Payment.objects.create(
+                terminal=self.terminal,
+                campaign=self.campaign,
+                method="CB",
+                status="Accepted",
+                amount=10,
+                currency="EUR",
+                **kwargs
+            )
+
+    def _export(self):
+        with CaptureQueriesContext(connections[get_read_replica_alias()]) as queries:
+            response = self.client.get("/payment/filtered/to_csv/")
+            lines = b"".join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual(response.status_code, 200)
+        return lines, len(queries)
+
+    def test_csv_export(self):
+        self._create_payments(2)
+        lines, nb_queries = self._export()
+
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith("Id,Date,Transaction,"))
+        self.assertIn(",Campagne,Borne,Client,TPE,10.0,,Partage", lines[1])
+
+        # Related objects are fetched with payments
+        self._create_payments(10)
+        lines, nb_queries_of_more_payments = self._export()
+
+        self.assertEqual(len(lines), 13)
+        self.assertEqual(nb_queries_of_more_payments, nb_queries)
+
+    def test_totals(self):
+        self._create_payments(2)
+
+        # Old payment without donation formula nor amount donated, rolled up with the settings of its terminal
+        Payment.objects.bulk_create(
+            [
+                Payment(
+                    terminal=self.terminal,
+                    campaign=self.campaign,
+                    method="CB",
+                    status="Accepted",
+                    amount=10,
+                    currency="EUR",
+                )
+            ]
+        )
+        PaymentDailyRollup.rebuild()
+
+        yesterday = timezone.localdate() - datetime.timedelta(days=1)
+
+        for params in (
+            {"date": "Today"},  # Read from rollups
+            {"start_date": yesterday.strftime("%d-%m-%YT00:00:01")},  # Not whole days
+        ):
+            response = self.client.get("/payment/filtered/", params)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data["total_number_of_payments"], 3)
+            self.assertEqual(
+                response.data["payments_total_amount_excluding_skiped"], 30
+            )
+            self.assertEqual(
+                response.data["payments_average_amount_excluding_skiped"], 10
+            )
+            self.assertEqual(response.data["amount_donated"], 6)
+            self.assertEqual(response.data["amount_for_owner"], 24)
+
+    def test_cursor_pagination(self):
+        # Payments of the same date are ordered by id
+        self._create_payments(3, date=timezone.now())
+        self._create_payments(4)
+        payment_ids = list(
+            Payment.objects.order_by("-date", "-id").values_list("id", flat=True)
+        )
+
+        pages = []
+        params = {"pagination": "cursor", "limit": 3}
+
+        while True:
+            response = self.client.get("/payment/filtered/", params)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn("total_number_of_payments", response.data)
+
+            pages.append([payment["id"] for payment in response.data["payments"]])
+
+            if response.data["next_cursor"] is None:
+                break
+
+            params["cursor"] = response.data["next_cursor"]
+
+        self.assertEqual(pages, [payment_ids[:3], payment_ids[3:6], payment_ids[6:]])
+
+        params["cursor"] = response.data["previous_cursor"]
+        params["with_totals"] = "true"
+        response = self.client.get("/payment/filtered/", params)
+
+        self.assertEqual(
+            [payment["id"] for payment in response.data["payments"]], payment_ids[3:6]
+        )
+        self.assertEqual(response.data["total_number_of_payments"], 7)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(
+            "/payment/filtered/", {"pagination": "cursor", "cursor": "invalid"}
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+
+class ManifestTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        storage_settings = override_settings(
+            DEFAULT_FILE_STORAGE="django.core.files.storage.FileSystemStorage",
+            MEDIA_ROOT=self.media_root,
+        )
+        storage_settings.enable()
+        self.addCleanup(storage_settings.disable)
+        self.addCleanup(shutil.rmtree, self.media_root)
+
+        self.user = User.objects.create(username="terminal")
+        self.terminal = Terminal.objects.create(
+            name="Borne",
+            owner=self.user,
+            customer=Customer.objects.create(company="Client"),
+        )
+        core = Core.objects.create(
+            name="Core",
+            path="cores/core.so",
+            description="",
+            file=CoreFile.objects.create(file=ContentFile(b"core", name="core.so")),
+            bios_path="bios/bios.bin",
+            bios=BiosFile.objects.create(file=ContentFile(b"bios", name="bios.bin")),
+        )
+        self.game_file = GameFile.objects.create(
+            file=ContentFile(b"rom", name="jeu.rom")
+        )
+        self.terminal.games.add(
+            Game.objects.create(
+                name="Jeu",
+                path="roms/jeu.rom",
+                description="",
+                file=self.game_file,
+                core=core,
+            )
+        )
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_checksum_is_computed_on_upload(self):
+        self.assertEqual(self.game_file.sha256, hashlib.sha256(b"rom").hexdigest())
+        self.assertEqual(self.game_file.size, 3)
+
+        self.game_file.file = ContentFile(b"new rom", name="jeu.rom")
+        self.game_file.save()
+        self.game_file.refresh_from_db()
+
+        self.assertEqual(self.game_file.sha256, hashlib.sha256(b"new rom").hexdigest())
+        self.assertEqual(self.game_file.size, 7)
+
+    def test_manifest(self):
+        response = self.client.get("/my-terminal/manifest/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [
+                (entry["type"], entry["path"], entry["sha256"], entry["size"])
+                for entry in response.json()["files"]
+            ],
+            [
+                ("bios", "bios/bios.bin", hashlib.sha256(b"bios").hexdigest(), 4),
+                ("core", "cores/core.so", hashlib.sha256(b"core").hexdigest(), 4),
+                ("rom", "roms/jeu.rom", hashlib.sha256(b"rom").hexdigest(), 3),
+            ],
+        )
+
+        etag = response["ETag"]
+        response = self.client.get("/my-terminal/manifest/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.game_file.file = ContentFile(b"new rom", name="jeu.rom")
+        self.game_file.save()
+
+        response = self.client.get("/my-terminal/manifest/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def _download(self, **headers):
+        response = self.client.get(
+            "/my-terminal/download/rom/{}/".format(self.game_file.pk), **headers
+        )
+        content = b"".join(getattr(response, "streaming_content", []))
+        return response, content
+
+    def test_download(self):
+        download_url = self.client.get("/my-terminal/manifest/").json()["files"][2][
+            "download_url"
+        ]
+        self.assertTrue(
+            download_url.endswith(
+                "/my-terminal/download/rom/{}/".format(self.game_file.pk)
+            )
+        )
+
+        response, content = self._download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, b"rom")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+
+        # Resumed download
+        response, content = self._download(
+            HTTP_RANGE="bytes=1-", HTTP_IF_RANGE=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 1-2/3")
+        self.assertEqual(content, b"om")
+
+        # The file changed since the download started, it is sent again
+        response, content = self._download(HTTP_RANGE="bytes=1-", HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, b"rom")
+
+        response, content = self._download(HTTP_RANGE="bytes=3-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */3")
+
+        usage = TerminalBandwidthUsage.objects.get(terminal=self.terminal)
+        self.assertEqual((usage.bytes_served, usage.nb_downloads), (8, 3))
+
+    def test_download_of_file_of_another_terminal(self):
+        game_file = GameFile.objects.create(file=ContentFile(b"rom", name="autre.rom"))
+
+        response = self.client.get("/my-terminal/download/rom/{}/".format(game_file.pk))
+        self.assertEqual(response.status_code, 404)
+
+
+@skipUnless(
+    READ_REPLICA in settings.DATABASES,
+    "Set REPLICA_DATABASE_URL (for example sqlite:///replica.sqlite3) to test the read replica",
+)
+@override_settings(PAYMENT_AUDIT_BUFFER_SIZE=0)
+class ReadReplicaTest(TransactionTestCase):
+    databases = {"default", READ_REPLICA}
+
+    def setUp(self):
+        cache.clear()
+
+        self.admin = User.objects.create(username="admin", is_staff=True)
+        self.user = User.objects.create(username="terminal")
+        self.terminal = Terminal.objects.create(
+            name="Borne",
+            owner=self.user,
+            customer=Customer.objects.create(company="Client"),
+            donation_formula="Classique",
+        )
+        self.campaign = Campaign.objects.create(
+            name="Campagne", description="", goal_amount=100, link=""
+        )
+
+        self.client = APIClient()
+
+    def _capture_queries(self, alias):
+        return CaptureQueriesContext(connections[alias])
+
+    def test_statistics_are_read_from_replica(self):
+        self.client.force_authenticate(self.admin)
+
+        with self._capture_queries("default") as primary_queries:
+            with self._capture_queries(READ_REPLICA) as replica_queries:
+                response = self.client.get("/dashboard/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(replica_queries.captured_queries)
+        self.assertFalse(primary_queries.captured_queries)
+
+    def test_streamed_export_is_read_from_replica(self):
+        self.client.force_authenticate(self.admin)
+
+        with self._capture_queries("default") as primary_queries:
+            with self._capture_queries(READ_REPLICA) as replica_queries:
+                response = self.client.get("/payment/filtered/to_csv/")
+                b"".join(response.streaming_content)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(replica_queries.captured_queries)
+        self.assertFalse(primary_queries.captured_queries)
+
+    def test_payments_are_written_to_primary(self):
+        self.client.force_authenticate(self.user)
+
+        with self._capture_queries(READ_REPLICA) as replica_queries:
+            response = self.client.post(
+                "/payment/",
+                {
+                    "terminal": self.terminal.pk,
+                    "campaign": self.campaign.pk,
+                    "method": "CB",
+                    "status": "Accepted",
+                    "amount": 10,
+                    "currency": "EUR",
+                },
+            )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(replica_queries.captured_queries)
+
+
+class DatabaseHealthCheckTest(TransactionTestCase):
+    def _start_request(self):
+        request_started.send(sender=self.__class__)
+
+    def test_usable_connection_is_kept(self):
+        connection = connections["default"]
+        connection.ensure_connection()
+
+        with mock.patch.object(
+            connection, "is_usable", return_value=True
+        ) as is_usable, mock.patch.object(connection, "close") as close:
+            self._start_request()
+
+        self.assertEqual(is_usable.call_count, 1)
+        self.assertFalse(close.called)
+
+    def test_unusable_connection_is_closed(self):
+        connection = connections["default"]
+        connection.ensure_connection()
+
+        with mock.patch.object(
+            connection, "is_usable", return_value=False
+        ), mock.patch.object(connection, "close") as close:
+            self._start_request()
+
+        self.assertEqual(close.call_count, 1)
+
+    def test_closed_connection_is_not_checked(self):
+        connection = connections["default"]
+
+        with mock.patch.object(connection, "connection", None), mock.patch.object(
+            connection, "is_usable"
+        ) as is_usable:
+            self._start_request()
+
+        self.assertFalse(is_usable.called)
+
+    @override_settings(DATABASE_HEALTH_CHECKS=False)
+    def test_health_checks_can_be_disabled(self):
+        connection = connections["default"]
+        connection.ensure_connection()
+
+        with mock.patch.object(connection, "is_usable") as is_usable:
+            self._start_request()
+
+        self.assertFalse(is_usable.called)
@@ -1,30 +1,43 @@
+import base64
 import datetime
 import json
 import csv
-import os
 import sys
 
 from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
+from django.db import IntegrityError, transaction
 from django.db.models import Avg, Sum, Q
-from django.http import HttpResponse
-from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.core.paginator import Paginator
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status, viewsets
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, ValidationError
 
 from game.models import Game, Core, BiosFile, CoreFile
 
-from fleet.models import Customer, User, Campaign
+from fleet.models import Customer, User, Campaign, LAST_DONATIONS_COUNT
 from fleet.serializers import CustomerSerializer, CampaignSerializer
 
-from backend.permissions import IsAdminOrCustomerUser
+from backend.common import format_duration
+from backend.authentication import TERMINAL_AUTHENTICATION_CLASSES
+from backend.database import ReadReplicaMixin, get_read_replica_alias
+from backend.permissions import IsAdminOrCustomerUser, TerminalIsAuthenticated
 
-from terminal.models import Terminal, Donator, Session, Payment
+from terminal.models import Terminal, Donator, Session, Payment, PaymentDailyRollup
+from terminal import audit
 from terminal.serializers import *
+from terminal.stats import (
+    get_dashboard_stats,
+    get_accepted_payments_stats,
+    get_payments_totals,
+    get_payments_totals_from_payments,
+)
 
 
 class _GameSerializer(serializers.ModelSerializer):
@@ -33,7 +46,7 @@ class _GameSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class DashboardStats(APIView):
+class DashboardStats(ReadReplicaMixin, APIView):
     """
     This view is used from SETH front admin or customer
     """
@@ -52,146 +65,49 @@ class DashboardStats(APIView):
         )
 
         if user.is_customer_user():
-            terminals = Terminal.objects.filter(
-                is_on=True, customer=user.get_customer()
-            )
-
-            terminals = TerminalSemiSerializer(
-                terminals, many=True, context={"request": request}
-            )
-
-            # Calculate total amount collected and donated this month
-
-            payments_this_month = Payment.objects.filter(
-                terminal__customer=user.get_customer(),
-                date__month=datetime.datetime.now().month,
-                date__year=datetime.datetime.now().year,
-            )
-            collected_this_month = 0
-            donated_this_month = 0
-
-            for payment in payments_this_month.all():
-                collected_this_month += payment.amount
-                donated_this_month += payment.amount_donated
-
-            # Calculate total amount collected and donated last month
-
-            payments_last_month = Payment.objects.filter(
-                terminal__customer=user.get_customer(),
-                date__month=datetime.datetime.now().month - 1,
-                date__year=datetime.datetime.now().year,
-            )
-            collected_last_month = 0
-            donated_last_month = 0
-
-            for payment in payments_last_month.all():
-                collected_last_month += payment.amount
-                donated_last_month += payment.amount_donated
-
-            nb_donators = Session.objects.filter(
-                terminal__customer=user.get_customer(),
-                start_time__month=datetime.datetime.now().month,
-                start_time__year=datetime.datetime.now().year,
-            ).count()
-
-            nb_donators_last = Session.objects.filter(
-                terminal__customer=user.get_customer(),
-                start_time__month=datetime.datetime.now().month - 1,
-                start_time__year=datetime.datetime.now().year,
-            ).count()
-
-            nb_terminals = Terminal.objects.filter(customer=user.get_customer()).count()
-
-            total_gamesession = Session.objects.filter(
-                terminal__customer=user.get_customer()
-            ).aggregate(Sum("timesession"))["timesession__sum"]
-
-            return Response(
-                {
-                    "terminals": terminals.data,
-                    "campaigns": campaigns_serlializer.data,
-                    "collected": collected_this_month,
-                    "collected_last": collected_last_month,
-                    "donated": donated_this_month,
-                    "donated_last": donated_last_month,
-                    "nb_donators": nb_donators,
-                    "nb_terminals": nb_terminals,
-                    "total_gamesession": total_gamesession,
-                    "nb_donators_last": nb_donators_last,
-                },
-                status=status.HTTP_200_OK,
-            )
+            customer = user.get_customer()
+            terminals = Terminal.objects.filter(is_on=True, customer=customer)
 
         elif user.is_staff:
+            customer = None  # Admin can see stats of every terminals
             terminals = Terminal.objects.filter(is_on=True)
 
-            terminals = TerminalSemiSerializer(
-                terminals, many=True, context={"request": request}
-            )
-
-            # Calculate total amount collected and donated this month
-
-            payments_this_month = Payment.objects.filter(
-                date__month=datetime.datetime.now().month,
-                date__year=datetime.datetime.now().year,
-            )
-            collected_this_month = 0
-            donated_this_month = 0
-
-            for payment in payments_this_month.all():
-                collected_this_month += payment.amount
-                donated_this_month += payment.amount_donated
-
-            # Calculate total amount collected and donated last month
-
-            payments_last_month = Payment.objects.filter(
-                date__month=datetime.datetime.now().month - 1,
-                date__year=datetime.datetime.now().year,
-            )
-            collected_last_month = 0
-            donated_last_month = 0
-
-            for payment in payments_last_month.all():
-                collected_last_month += payment.amount
-                donated_last_month += payment.amount_donated
-
-            nb_donators = Session.objects.filter(
-                start_time__month=datetime.datetime.now().month,
-                start_time__year=datetime.datetime.now().year,
-            ).count()
+        else:
+            raise PermissionDenied()
 
-            nb_donators_last = Session.objects.filter(
-                start_time__month=datetime.datetime.now().month - 1,
-                start_time__year=datetime.datetime.now().year,
-            ).count()
+        terminals = TerminalSemiSerializer(
+            _for_semi_serializer(terminals), many=True, context={"request": request}
+        )
 
-            nb_terminals = Terminal.objects.all().count()
+        return Response(
+            {
+                "terminals": terminals.data,
+                "campaigns": campaigns_serlializer.data,
+                **get_dashboard_stats(customer),
+            },
+            status=status.HTTP_200_OK,
+        )
 
-            total_gamesession = Session.objects.all().aggregate(Sum("timesession"))[
-                "timesession__sum"
-            ]
 
-            return Response(
-                {
-                    "terminals": terminals.data,
-                    "campaigns": campaigns_serlializer.data,
-                    "collected": collected_this_month,
-                    "collected_last": collected_last_month,
-                    "donated": donated_this_month,
-                    "donated_last": donated_last_month,
-                    "nb_donators": nb_donators,
-                    "nb_terminals": nb_terminals,
-                    "total_gamesession": total_gamesession,
-                    "nb_donators_last": nb_donators_last,
-                },
-                status=status.HTTP_200_OK,
-            )
+def _for_semi_serializer(terminals):
+    """
+    Annotate statistics and fetch relations of terminals serialized with TerminalSemiSerializer,
+    so that serializing them takes a constant number of queries
+    """
 
-        else:
-            raise PermissionDenied()
+    return (
+        terminals.with_stats()
+        .select_related("owner__customer", "customer")
+        .prefetch_related(
+            "owner__groups",
+            "owner__user_permissions",
+            "campaigns__donationSteps",
+            "games",
+        )
+    )
 
 
-class FilterSelectItems(APIView):
+class FilterSelectItems(ReadReplicaMixin, APIView):
     """
     This view is used from SETH front admin or customer
     """
@@ -215,9 +131,11 @@ class FilterSelectItems(APIView):
         )
 
         if user.is_customer_user():
-            terminals = Terminal.objects.filter(customer=user.get_customer())
+            terminals = Terminal.objects.filter(customer_id=user.role.customer_id)
             terminals = TerminalSemiSerializer(
-                terminals, many=True, context={"request": request}
+                _for_semi_serializer(terminals),
+                many=True,
+                context={"request": request},
             )
             return Response(
                 {
@@ -231,7 +149,9 @@ class FilterSelectItems(APIView):
         elif user.is_staff:
             terminals = Terminal.objects.all()
             terminals = TerminalSemiSerializer(
-                terminals, many=True, context={"request": request}
+                _for_semi_serializer(terminals),
+                many=True,
+                context={"request": request},
             )
             customers = Customer.objects.filter().order_by("company")
             customers = CustomerSerializer(
@@ -251,7 +171,7 @@ class FilterSelectItems(APIView):
             raise PermissionDenied()
 
 
-class PaymentFilteredViewSet(viewsets.ViewSet):
+class PaymentFilteredViewSet(ReadReplicaMixin, viewsets.ViewSet):
     """
     This view is used from SETH front admin or customer
     """
@@ -336,113 +256,104 @@ class PaymentFilteredViewSet(viewsets.ViewSet):
                 "donation_formula",
             )
 
-    def _get_filtred_payments(self, request):
+    def _get_scoped_queryset(self, request, model):
         """
-        Return a queryset of Payment objects
-
-        Possible query params :
-        - campaign
-        - terminal
-        - customer
-        - status
-        - game
-        - date
-        - date_start
-        - date_end
-        - tpe
-        - formula
+        Return all objects of model (Payment or PaymentDailyRollup) that logged user is allowed to see
+        (all objects if logged user is admin, only customer objects if logged user is customer)
         """
 
-        # Fetch params
-
-        campaign_id = self.request.query_params.get("campaign")
-        terminal_id = self.request.query_params.get("terminal")
-        customer_id = self.request.query_params.get("customer")
-        donation_formula = self.request.query_params.get("formula")
-        payment_status = self.request.query_params.get("payment_status")
-        game_id = self.request.query_params.get("game")
-        date = self.request.query_params.get("date")
-        date_start = self.request.query_params.get("start_date")
-        date_end = self.request.query_params.get("end_date")
-        payment_terminal = self.request.query_params.get("tpe")
-
-        # Query payments (all payments if logged user is admin, only customer payments if logged user is customer)
-
         user: User = request.user
 
-        payments = Payment.objects.none()
-
         if user.is_staff:
-            payments = Payment.objects.all()
+            return model.objects.all()
 
         elif user.is_customer_user():
-            payments = Payment.objects.filter(terminal__customer=user.get_customer())
+            return model.objects.filter(terminal__customer_id=user.role.customer_id)
 
         else:
             raise PermissionDenied()
 
+    def _get_filters(self, request):
+        """
+        Return filters that apply the same way on Payment and PaymentDailyRollup querysets
+
+        Possible query params :
+        - campaign
+        - terminal
+        - customer
+        - payment_status
+        - game
+        """
+
+        filters = {}
+
         # Filter by terminals
 
+        terminal_id = self.request.query_params.get("terminal")
         if terminal_id:
-            payments = payments.filter(terminal_id=terminal_id)
+            filters["terminal_id"] = terminal_id
 
         # Filter by customer
 
+        customer_id = self.request.query_params.get("customer")
         if customer_id:
-            payments = payments.filter(terminal__customer_id=customer_id)
+            filters["terminal__customer_id"] = customer_id
 
         # Filter by campaign
 
+        campaign_id = self.request.query_params.get("campaign")
         if campaign_id:
-            payments = payments.filter(campaign_id=campaign_id)
+            filters["campaign_id"] = campaign_id
 
         # Filter by game
 
+        game_id = self.request.query_params.get("game")
         if game_id:
-            payments = payments.filter(game_id=game_id)
+            filters["game_id"] = game_id
 
         # Filter by payment_status
 
+        payment_status = self.request.query_params.get("payment_status")
         if payment_status:
-            payments = payments.filter(status=payment_status)
+            filters["status"] = payment_status
 
-        # Filter by donation_formula
+        return filters
 
-        if donation_formula:
-            payments = payments.filter(
-                Q(donation_formula=donation_formula)
-                | Q(donation_formula=None, terminal__donation_formula=donation_formula)
-            )  # TODO remove and reactivate following line
-            # payments = payments.filter(donation_formula=donation_formula)
+    def _get_date_bounds(self, request):
+        """
+        Return a list of (lookup, datetime) bounds, where lookup is "gte" or "lt"
 
-        # Filter by payment_terminal
+        Possible query params :
+        - date
+        - start_date
+        - end_date
+        """
 
-        if payment_terminal:
-            payments = payments.filter(
-                Q(payment_terminal=payment_terminal)
-                | Q(payment_terminal=None, terminal__payment_terminal=payment_terminal)
-            )  # TODO remove and reactivate following line
-            # payments = payments.filter(payment_terminal=payment_terminal)
+        date = self.request.query_params.get("date")
+        date_start = self.request.query_params.get("start_date")
+        date_end = self.request.query_params.get("end_date")
+
+        bounds = []
 
-        # Filter by date_start
+        # Bounds from date_start
 
         if date_start:
             formatted_date = date_start.replace("T", " ")
             converted_date_start = datetime.datetime.strptime(
                 formatted_date, "%d-%m-%Y %H:%M:%S"
             )
-            payments = payments.filter(date__gte=converted_date_start)
+            bounds.append(("gte", converted_date_start))
 
-        # Filter by date_end
+        # Bounds from date_end
 
         if date_end:
             formatted_date = date_end.replace("T", " ")
             converted_date_end = datetime.datetime.strptime(
                 formatted_date, "%d-%m-%Y %H:%M:%S"
             )
-            payments = payments.filter(date__lt=converted_date_end)
+            bounds.append(("lt", converted_date_end))
 
-        # Filter by date (period)
+        # Bounds from date (period)
 
         today = datetime.date.today()
 
@@ -451,7 +362,7 @@ class PaymentFilteredViewSet(viewsets.ViewSet):
             today_start = datetime.datetime.combine(today, datetime.time())
             tomorrow_start = datetime.datetime.combine(tomorrow, datetime.time())
 
-            payments = payments.filter(date__gte=today_start, date__lt=tomorrow_start)
+            bounds += [("gte", today_start), ("lt", tomorrow_start)]
 
         elif date == "Yesterday":
             today_start = datetime.datetime.combine(today, datetime.time())
@@ -459,7 +370,7 @@ class PaymentFilteredViewSet(viewsets.ViewSet):
             yesterday = today + datetime.timedelta(-1)
             yesterday_start = datetime.datetime.combine(yesterday, datetime.time())
 
-            payments = payments.filter(date__gte=yesterday_start, date__lt=today_start)
+            bounds += [("gte", yesterday_start), ("lt", today_start)]
 
         elif date == "7days":
             tomorrow = today + datetime.timedelta(1)
@@ -470,9 +381,7 @@ class PaymentFilteredViewSet(viewsets.ViewSet):
                 seven_days_ago, datetime.time()
             )
 
-            payments = payments.filter(
-                date__gte=seven_days_ago_start, date__lt=tomorrow_start
-            )
+            bounds += [("gte", seven_days_ago_start), ("lt", tomorrow_start)]
 
         elif date == "CurrentWeek":
             tomorrow = today + datetime.timedelta(1)
@@ -483,9 +392,7 @@ class PaymentFilteredViewSet(viewsets.ViewSet):
                 monday_of_this_week, datetime.time()
             )
 
-            payments = payments.filter(
-                date__gte=monday_of_this_week_start, date__lt=tomorrow_start
-            )
+            bounds += [("gte", monday_of_this_week_start), ("lt", tomorrow_start)]
 
         elif date == "LastWeek":
             some_day_last_week = today - datetime.timedelta(days=7)
@@ -501,9 +408,10 @@ class PaymentFilteredViewSet(viewsets.ViewSet):
                 monday_of_this_week, datetime.time()
             )
 
-            payments = payments.filter(
-                date__gte=monday_of_last_week_start, date__lt=monday_of_this_week_start
-            )
+            bounds += [
+                ("gte", monday_of_last_week_start),
+                ("lt", monday_of_this_week_start),
+            ]
 
         elif date == "CurrentMonth":
             start_month = datetime.datetime(today.year, today.month, 1)
@@ -512,18 +420,18 @@ class PaymentFilteredViewSet(viewsets.ViewSet):
                 date_on_next_month.year, date_on_next_month.month, 1
             )
 
-            payments = payments.filter(date__gte=start_month, date__lt=start_next_month)
+            bounds += [("gte", start_month), ("lt", start_next_month)]
 
         elif date == "LastMonth":
             first = today.replace(day=1)  # first date of current month
             end_previous_month = first - datetime.timedelta(days=1)
-            start_previous_month = end_previous_month.replace(day=1)
+            start_previous_month = datetime.datetime.combine(
+                end_previous_month.replace(day=1), datetime.time()
+            )
 
             start_this_month = datetime.datetime(today.year, today.month, 1)
 
-            payments = payments.filter(
-                date__gte=start_previous_month, date__lt=start_this_month
-            )
+            bounds += [("gte", start_previous_month), ("lt", start_this_month)]
 
         elif date == "ThisYear":
             first_day_of_this_year = today.replace(day=1, month=1)
@@ -537,10 +445,10 @@ class PaymentFilteredViewSet(viewsets.ViewSet):
                 first_day_of_next_year, datetime.time()
             )
 
-            payments = payments.filter(
-                date__gte=first_day_of_this_year_begining,
-                date__lt=first_day_of_next_year_begining,
-            )
+            bounds += [
+                ("gte", first_day_of_this_year_begining),
+                ("lt", first_day_of_next_year_begining),
+            ]
 
         elif date == "LastYear":
             first_day_of_next_year = today.replace(day=1, month=1, year=today.year - 1)
@@ -553,51 +461,128 @@ class PaymentFilteredViewSet(viewsets.ViewSet):
                 first_day_of_this_year, datetime.time()
             )
 
+            bounds += [
+                ("gte", first_day_of_next_year_begining),
+                ("lt", first_day_of_this_year_begining),
+            ]
+
+        return bounds
+
+    def _get_filtred_payments(self, request):
+        """
+        Return a queryset of Payment objects
+
+        Possible query params : see _get_filters and _get_date_bounds, plus
+        - tpe
+        - formula
+        """
+
+        payments = self._get_scoped_queryset(request, Payment).filter(
+            **self._get_filters(request)
+        )
+
+        # Filter by donation_formula
+
+        donation_formula = self.request.query_params.get("formula")
+        if donation_formula:
+            payments = payments.filter(donation_formula=donation_formula)
+
+        # Filter by payment_terminal
+
+        payment_terminal = self.request.query_params.get("tpe")
+        if payment_terminal:
             payments = payments.filter(
-                date__gte=first_day_of_next_year_begining,
-                date__lt=first_day_of_this_year_begining,
-            )
+                Q(payment_terminal=payment_terminal)
+                | Q(payment_terminal=None, terminal__payment_terminal=payment_terminal)
+            )  # TODO remove and reactivate following line
+            # payments = payments.filter(payment_terminal=payment_terminal)
+
+        # Filter by date
+
+        for lookup, bound in self._get_date_bounds(request):
+            payments = payments.filter(**{"date__" + lookup: bound})
 
         return payments.order_by("-date")
 
-    def list(self, request):
-        payments = self._get_filtred_payments(request)
+    def _get_filtred_rollups(self, request):
+        """
+        Return a queryset of PaymentDailyRollup objects matching the same params as _get_filtred_payments,
+        or None if payments can not be filtered by whole days (start_date or end_date is not at midnight)
+        """
+
+        rollups = self._get_scoped_queryset(request, PaymentDailyRollup).filter(
+            **self._get_filters(request)
+        )
+
+        # Rollups are built with the donation formula and the payment terminal of the terminal for old payments
+
+        donation_formula = self.request.query_params.get("formula")
+        if donation_formula:
+            rollups = rollups.filter(donation_formula=donation_formula)
+
+        payment_terminal = self.request.query_params.get("tpe")
+        if payment_terminal:
+            rollups = rollups.filter(payment_terminal=payment_terminal)
 
-        # Extract non skiped payments and count
+        for lookup, bound in self._get_date_bounds(request):
+            if bound.time() != datetime.time():
+                return None
 
-        not_skiped_payments = payments.exclude(status="Skiped")
+            rollups = rollups.filter(**{"day__" + lookup: bound.date()})
 
-        payments_total_amount_excluding_skiped = not_skiped_payments.aggregate(
-            Sum("amount")
-        )["amount__sum"]
+        return rollups
 
-        payments_average_amount_excluding_skiped = not_skiped_payments.aggregate(
-            Avg("amount")
-        )["amount__avg"]
+    def _get_totals(self, request, payments):
+        """
+        Return totals of filtered payments, read from rollups when possible
+        """
 
-        if payments_total_amount_excluding_skiped is None:
-            payments_total_amount_excluding_skiped = 0
+        rollups = self._get_filtred_rollups(request)
 
-        if payments_average_amount_excluding_skiped is None:
-            payments_average_amount_excluding_skiped = 0
+        if rollups is not None:
+            totals = get_payments_totals(rollups)
         else:
-            payments_average_amount_excluding_skiped = round(
-                payments_average_amount_excluding_skiped, 2
-            )
+            totals = get_payments_totals_from_payments(payments)
 
-        total_amount_donated = 0
-        for payment in payments.all():
-            total_amount_donated = (
-                total_amount_donated + payment.get_amount_donated_for_old_payments()
-            )
+        return {
+            "payments_total_amount_excluding_skiped": totals[
+                "total_amount_excluding_skiped"
+            ],
+            "payments_average_amount_excluding_skiped": totals[
+                "average_amount_excluding_skiped"
+            ],
+            "amount_donated": totals["amount_donated"],
+            "amount_for_owner": totals["total_amount_excluding_skiped"]
+            - totals["amount_donated"],
+            "total_number_of_payments": totals["nb_payments"],
+        }
 
-        total_amount_for_owner = (
-            payments_total_amount_excluding_skiped - total_amount_donated
+    def _get_payment_serializer_class(self, request):
+        user: User = request.user
+
+        if user.is_staff or (
+            user.is_customer_user() and user.get_customer().can_see_donators
+        ):
+            return self._PaymentWithDonatorSerializer
+        else:
+            return self._PaymentWithoutDonatorSerializer
+
+    def list(self, request):
+        """
+        Possible query params : see _get_filtred_payments, plus
+        - pagination : "cursor" to paginate with cursors instead of page numbers (see _list_with_cursor)
+        - page
+        - limit
+        """
+
+        payments = self._get_filtred_payments(request).select_related(
+            "donator", "campaign", "game", "terminal__customer"
         )
 
-        # Count total payments
+        if self.request.query_params.get("pagination") == "cursor":
+            return self._list_with_cursor(request, payments)
 
-        total_payment_count = payments.count()
+        totals = self._get_totals(request, payments)
 
         # Paginate
 
@@ -609,39 +594,141 @@ class PaymentFilteredViewSet(viewsets.ViewSet):
 
         # Serialize filtred payments
 
-        serializer_class = None
-        user: User = request.user
-
-        if user.is_staff or (
-            user.is_customer_user() and user.get_customer().can_see_donators
-        ):
-            serializer_class = self._PaymentWithDonatorSerializer
-        else:
-            serializer_class = self._PaymentWithoutDonatorSerializer
-
+        serializer_class = self._get_payment_serializer_class(request)
         serializer = serializer_class(payments, many=True)
 
         return Response(
             {
                 "payments": serializer.data,
-                "payments_total_amount_excluding_skiped": payments_total_amount_excluding_skiped,
-                "payments_average_amount_excluding_skiped": payments_average_amount_excluding_skiped,
-                "amount_donated": total_amount_donated,
-                "amount_for_owner": total_amount_for_owner,
-                "total_number_of_payments": total_payment_count,
+                **totals,
             },
             status=status.HTTP_200_OK,
         )
 
+    def _list_with_cursor(self, request, payments):
+        """
+        Return a page of payments ordered by date then id, starting after the position encoded in the cursor.
+        Fetching a page does not depend on how deep the page is, as no count nor offset is needed.
+
+        Possible query params :
+        - cursor : next_cursor or previous_cursor of a previous response, first page if not set
+        - limit
+        - with_totals : "true" to also compute totals and count of filtered payments
+        """
+
+        try:
+            limit = int(self.request.query_params.get("limit", 10))
+        except ValueError:
+            raise ValidationError({"limit": "limit must be an integer"})
+
+        if limit < 1:
+            raise ValidationError({"limit": "limit must be positive"})
+
+        cursor = self.request.query_params.get("cursor")
+        position = self._decode_cursor(cursor) if cursor else None
+        backwards = position is not None and position["backwards"]
+
+        page_payments = payments.order_by("-date", "-id")
+
+        if position is not None:
+            if backwards:
+                page_payments = page_payments.filter(
+                    Q(date__gt=position["date"])
+                    | Q(date=position["date"], id__gt=position["id"])
+                ).order_by("date", "id")
+            else:
+                page_payments = page_payments.filter(
+                    Q(date__lt=position["date"])
+                    | Q(date=position["date"], id__lt=position["id"])
+                )
+
+        # Fetch one more payment to know if there is a following page
+
+        page = list(page_payments[: limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+
+        if backwards:
+            page.reverse()
+            has_next = True  # This page was reached from the following one
+            has_previous = has_more
+        else:
+            has_next = has_more
+            has_previous = position is not None
+
+        next_cursor = None
+        previous_cursor = None
+
+        if page and has_next:
+            next_cursor = self._encode_cursor(page[-1], backwards=False)
+
+        if page and has_previous:
+            previous_cursor = self._encode_cursor(page[0], backwards=True)
+
+        serializer_class = self._get_payment_serializer_class(request)
+        serializer = serializer_class(page, many=True)
+
+        data = {
+            "payments": serializer.data,
+            "next_cursor": next_cursor,
+            "previous_cursor": previous_cursor,
+        }
+
+        if self.request.query_params.get("with_totals") == "true":
+            data.update(self._get_totals(request, payments))
+
+        return Response(data, status=status.HTTP_200_OK)
+
+    def _encode_cursor(self, payment, backwards):
+        position = {
+            "date": payment.date.isoformat(),
+            "id": payment.id,
+            "backwards": backwards,
+        }
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    def _decode_cursor(self, cursor):
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            date = parse_datetime(position["date"])
+
+            if date is None:
+                raise ValueError()
+
+            return {
+                "date": date,
+                "id": int(position["id"]),
+                "backwards": bool(position["backwards"]),
+            }
+
+        except (ValueError, TypeError, KeyError):
+            raise ValidationError({"cursor": "Invalid cursor"})
+
+    class _Echo:
+        """
+        Pseudo buffer for the csv writer, that returns written lines instead of storing them
+        """
+
+        def write(self, value):
+            return value
+
+    CSV_CHUNK_SIZE = 2000  # Number of payments fetched from database at once
+
     @action(detail=False, methods=["get"])
     def to_csv(self, request):
-        payments = self._get_filtred_payments(request)
+        """
+        Stream filtered payments as CSV, without loading every payments in memory
+        """
 
-        response = HttpResponse(content_type="text/csv")
-        response["Content-Disposition"] = 'attachment; filename="export.csv"'
+        # Payments are fetched while the response is streamed, after the view has returned
+        payments = (
+            self._get_filtred_payments(request)
+            .select_related("donator", "campaign", "game", "terminal__customer")
+            .using(get_read_replica_alias())
+        )
 
         writer = csv.DictWriter(
-            response,
+            self._Echo(),
             fieldnames=[
                 "Id",
                 "Date",
@@ -658,10 +745,18 @@ class PaymentFilteredViewSet(viewsets.ViewSet):
                 "Formule de dons",
             ],
         )
-        writer.writeheader()
 
-        for payment in payments.all():
-            writer.writerow(
+        response = StreamingHttpResponse(
+            self._csv_lines(writer, payments), content_type="text/csv"
+        )
+        response["Content-Disposition"] = 'attachment; filename="export.csv"'
+        return response
+
+    def _csv_lines(self, writer, payments):
+        yield writer.writeheader()
+
+        for payment in payments.iterator(chunk_size=self.CSV_CHUNK_SIZE):
+            yield writer.writerow(
                 {
                     "Id": payment.id,
                     "Date": payment.date.strftime("%m/%d/%Y, %H:%M:%S"),
@@ -698,7 +793,6 @@ class PaymentFilteredViewSet(viewsets.ViewSet):
                     else "",
                 }
             )
-        return response
 
 
 class _DonatorSerializer(serializers.ModelSerializer):
@@ -712,10 +806,13 @@ class DonatorViewSet(viewsets.ModelViewSet):
     serializer_class = _DonatorSerializer
     queryset = Donator.objects.all()
     permission_classes = [IsAuthenticated]
+    # Donators are created by terminals
+    authentication_classes = TERMINAL_AUTHENTICATION_CLASSES
 
 
 class DonatorByEmail(APIView):
     permission_classes = [IsAuthenticated]
+    authentication_classes = TERMINAL_AUTHENTICATION_CLASSES
 
     def get(self, request, email, format=None):
         try:
@@ -726,26 +823,196 @@ class DonatorByEmail(APIView):
             return Response(status=status.HTTP_404_NOT_FOUND)
 
 
+# Maximum number of payments or sessions sent at once by a terminal (see PaymentViewSet.batch and SessionViewSet.batch)
+BATCH_MAX_SIZE = 500
+
+# Fields of sessions updated by SessionViewSet.batch
+SESSION_BATCH_FIELDS = [
+    "campaign",
+    "game",
+    "donator",
+    "start_time",
+    "end_time",
+    "start_global",
+    "end_global",
+    "position_asso",
+    "timesession",
+    "timesession_global",
+]
+
+
+def _check_batch_relations(valid_items, results):
+    """
+    Check that campaigns, games and donators of a batch of payments or sessions exist, with one query for each of them.
+    Items with a missing related object are removed from valid_items and their result is set.
+    """
+
+    for field, model in (("campaign", Campaign), ("game", Game), ("donator", Donator)):
+        ids = {data[field] for data in valid_items.values() if data.get(field)}
+        existing_ids = set(
+            model.objects.filter(pk__in=ids).values_list("pk", flat=True)
+        )
+
+        for index, data in list(valid_items.items()):
+            if data.get(field) is not None and data[field] not in existing_ids:
+                results[index] = {
+                    "client_id": data.get("client_id"),
+                    "result": "invalid",
+                    "errors": {
+                        field: [
+                            'Invalid pk "{}" - object does not exist.'.format(
+                                data[field]
+                            )
+                        ]
+                    },
+                }
+                del valid_items[index]
+
+
+def _validate_batch(request, key, item_serializer_class):
+    """
+    Validate each item of a batch of payments or sessions sent by a terminal
+
+    Return the results list, with the result of invalid items set, and the validated data of valid items by index
+    """
+
+    items = request.data.get(key)
+
+    if not isinstance(items, list):
+        raise ValidationError({key: "{} must be a list".format(key)})
+
+    if len(items) > BATCH_MAX_SIZE:
+        raise ValidationError(
+            {key: "At most {} items can be sent at once".format(BATCH_MAX_SIZE)}
+        )
+
+    results = [None] * len(items)
+    valid_items = {}
+
+    for index, item in enumerate(items):
+        serializer = item_serializer_class(data=item)
+
+        if serializer.is_valid():
+            valid_items[index] = serializer.validated_data
+        else:
+            results[index] = {
+                "client_id": item.get("client_id") if isinstance(item, dict) else None,
+                "result": "invalid",
+                "errors": serializer.errors,
+            }
+
+    _check_batch_relations(valid_items, results)
+
+    return results, valid_items
+
+
 # Session Model
 class SessionViewSet(viewsets.ModelViewSet):
     serializer_class = SessionSerializer
     queryset = Session.objects.all()
     permission_classes = [IsAuthenticated]
+    authentication_classes = TERMINAL_AUTHENTICATION_CLASSES
+
+    @action(
+        detail=False, methods=["post"], permission_classes=[TerminalIsAuthenticated]
+    )
+    def batch(self, request):
+        """
+        Endpoint for terminals to send many sessions at once
+
+        Data : {"sessions": [...]}, each session having the fields of SessionBatchItemSerializer.
+        Durations are computed from start and end times. Sessions with a client_id (generated by the terminal)
+        are updated if they were already received, so that a session can be sent when it starts and again when it ends.
 
+        Return a result for each session, in the same order :
+        - {"client_id", "result": "created"}
+        - {"client_id", "result": "updated"}
+        - {"client_id", "result": "invalid", "errors"}
+        """
+        terminal: Terminal = request.user.get_terminal()
+
+        results, valid_items = _validate_batch(
+            request, "sessions", SessionBatchItemSerializer
+        )
+
+        try:
+            updated_client_ids = self._save_batch(terminal, valid_items)
+        except IntegrityError:
+            # Some sessions were created meanwhile by a concurrent request, they are updated now
+            updated_client_ids = self._save_batch(terminal, valid_items)
 
-class AvgSessionByTerminal(APIView):
+        for index, data in valid_items.items():
+            client_id = data.get("client_id")
+
+            results[index] = {
+                "client_id": client_id,
+                "result": "updated" if client_id in updated_client_ids else "created",
+            }
+
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+    def _save_batch(self, terminal: Terminal, valid_items):
+        """
+        Create or update sessions of a batch in one transaction
+
+        Return client ids of updated sessions
+        """
+
+        with transaction.atomic():
+            client_ids = {
+                data["client_id"]
+                for data in valid_items.values()
+                if data.get("client_id")
+            }
+            existing_sessions = {
+                session.client_id: session
+                for session in Session.objects.filter(
+                    terminal=terminal, client_id__in=client_ids
+                )
+            }
+
+            new_sessions = {}  # By client id, or by index without client id
+
+            for index, data in valid_items.items():
+                client_id = data.get("client_id")
+
+                session = existing_sessions.get(client_id) or Session(
+                    terminal=terminal, client_id=client_id
+                )
+                session.campaign_id = data["campaign"]
+                session.game_id = data.get("game")
+                session.donator_id = data.get("donator")
+                session.start_time = data.get("start_time")
+                session.end_time = data.get("end_time")
+                session.start_global = data.get("start_global")
+                session.end_global = data.get("end_global")
+                session.position_asso = data["position_asso"]
+                session.compute_durations()
+
+                if client_id not in existing_sessions:
+                    # The last one is kept if a session is sent twice in the batch
+                    new_sessions[client_id or index] = session
+
+            Session.objects.bulk_update(
+                existing_sessions.values(),
+                SESSION_BATCH_FIELDS,
+                batch_size=BATCH_MAX_SIZE,
+            )
+            Session.objects.bulk_create(new_sessions.values())
+
+        return set(existing_sessions)
+
+
+class AvgSessionByTerminal(ReadReplicaMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, terminal, format=None):
         try:
-            avg = (
-                Session.objects.filter(terminal=terminal)
-                .aggregate(Avg("timesession"))["timesession__avg"]
-                .seconds
-            )
-            hours, remainder = divmod(avg, 3600)
-            minutes, seconds = divmod(remainder, 60)
-            string = "{:02}:{:02}:{:02}".format(int(hours), int(minutes), int(seconds))
+            string = format_duration(
+                Session.objects.filter(terminal=terminal).aggregate(Avg("timesession"))[
+                    "timesession__avg"
+                ]
+            )
             serializer = json.dumps(string)
             return Response(serializer, status=status.HTTP_200_OK)
         except ObjectDoesNotExist:
@@ -756,6 +1023,28 @@ class _PaymentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Payment
         fields = "__all__"
+        read_only_fields = ("date",)  # Date of reception
+
+
+class _TerminalPaymentSerializer(_PaymentSerializer):
+    """
+    Serializer of payments sent by a terminal, for the terminal given in context (see Terminal.get_donation_settings)
+    """
+
+    terminal = serializers.PrimaryKeyRelatedField(read_only=True)
+
+    def validate(self, attrs):
+        terminal_id = self.initial_data.get("terminal")
+
+        if terminal_id is not None and str(terminal_id) != str(
+            self.context["terminal"].pk
+        ):
+            raise ValidationError(
+                {"terminal": "Payments can only be sent for this terminal"}
+            )
+
+        attrs["terminal"] = self.context["terminal"]
+        return attrs
 
 
 # Payment Model
@@ -763,117 +1052,260 @@ class PaymentViewSet(viewsets.ModelViewSet):
     serializer_class = _PaymentSerializer
     queryset = Payment.objects.all()
     permission_classes = [IsAuthenticated]
+    authentication_classes = TERMINAL_AUTHENTICATION_CLASSES
+
+    def perform_create(self, serializer):
+        # Payment rollups are maintained by the receivers of Payment (see PaymentDailyRollup)
+        with transaction.atomic():
+            serializer.save()
+
+    @action(
+        detail=False, methods=["post"], permission_classes=[TerminalIsAuthenticated]
+    )
+    def batch(self, request):
+        """
+        Endpoint for terminals to send many payments at once, for example payments made while offline
+
+        Data : {"payments": [...]}, each payment having the fields of PaymentBatchItemSerializer.
+        client_id is generated by the terminal to identify the payment among its own payments,
+        so that a payment sent again is not created twice. sequence_number is incremented by the terminal
+        for each payment, so that missing payments can be found (see sequence). date is the date of the payment
+        on the terminal, defaulting to the date of reception, and can not be in the future.
+
+        Return a result for each payment, in the same order :
+        - {"client_id", "result": "created", "id"}
+        - {"client_id", "result": "duplicate", "id"} if this payment was already received
+        - {"client_id", "result": "invalid", "errors"}
+        """
+        terminal: Terminal = request.user.get_terminal()
 
-    def paymentLog(self, paymentSerializer):
-        # file : ${settings.LOG_PATH}/${terminalName}/${%Y-%m}-payments.log
-        terminalName = LightTerminalSerializer(
-            Terminal.objects.get(pk=paymentSerializer.data.get("terminal"))
-        ).data.get("name")
-        filePath = os.path.join(settings.LOG_PATH, terminalName)
-        if not os.path.exists(filePath):
-            os.makedirs(filePath)
-        fileName = (
-            filePath + "/" + datetime.datetime.now().strftime("%Y-%m") + "-payments.log"
+        results, valid_items = _validate_batch(
+            request, "payments", PaymentBatchItemSerializer
         )
-        logLine = (
-            str(datetime.datetime.now())
-            + " - [PAYMENT] - "
-            + str(paymentSerializer.data)
-            + "\n"
+
+        try:
+            payments, payment_ids = self._create_batch(terminal, valid_items)
+        except IntegrityError:
+            # Some payments were created meanwhile by a concurrent request, they are duplicates now
+            payments, payment_ids = self._create_batch(terminal, valid_items)
+
+        created_client_ids = {payment.client_id for payment in payments}
+
+        for index, data in valid_items.items():
+            client_id = data["client_id"]
+
+            results[index] = {
+                "client_id": client_id,
+                "result": "created" if client_id in created_client_ids else "duplicate",
+                "id": payment_ids[client_id],
+            }
+            created_client_ids.discard(
+                client_id
+            )  # Same payment sent twice in this batch
+
+        for payment in payments:
+            audit.log_payment(_PaymentSerializer(payment).data)
+
+        return Response(
+            {
+                "results": results,
+                "last_sequence_number": self._get_last_sequence_number(terminal),
+            },
+            status=status.HTTP_200_OK,
         )
 
-        log_file = open(fileName, "a")
-        log_file.write(logLine)
-        log_file.close()
-
-    def paymentLogException(self, exception, paymentSerializer, request):
-        if paymentSerializer.data.get("terminal"):
-            # file : ${settings.LOG_PATH}/${terminalName}/${%Y-%m}-payments.log
-            terminalName = LightTerminalSerializer(
-                Terminal.objects.get(pk=paymentSerializer.data.get("terminal"))
-            ).data.get("name")
-            filePath = os.path.join(settings.LOG_PATH, terminalName)
-            if not os.path.exists(filePath):
-                os.makedirs(filePath)
-            fileName = (
-                filePath
-                + "/"
-                + datetime.datetime.now().strftime("%Y-%m")
-                + "-payments.log"
-            )
-            logLine = (
-                str(datetime.datetime.now()) + " - [ERROR] - " + str(exception) + "\n"
+    def _create_batch(self, terminal: Terminal, valid_items):
+        """
+        Create payments of a batch that were not received yet, in one transaction
+
+        Return created payments and the ids of every payments of the batch by client id
+        """
+
+        with transaction.atomic():
+            # Locked before payments are inserted, so that concurrent batches of the terminal wait for each other
+            # instead of deadlocking when their rollups are rebuilt (see PaymentDailyRollup.lock_terminals)
+            PaymentDailyRollup.lock_terminals(terminal.pk)
+
+            client_ids = {data["client_id"] for data in valid_items.values()}
+            payment_ids = dict(
+                Payment.objects.filter(
+                    terminal=terminal, client_id__in=client_ids
+                ).values_list("client_id", "id")
             )
-        else:
-            fileName = settings.LOG_PATH + "error-payments.log"
-            logLine = (
-                str(datetime.datetime.now()) + " - [ERROR] - Unknown terminal ID\n"
+
+            payments = []
+            known_client_ids = set(payment_ids)
+
+            for data in valid_items.values():
+                if data["client_id"] in known_client_ids:
+                    continue
+
+                known_client_ids.add(data["client_id"])
+
+                payment = Payment(
+                    terminal=terminal,
+                    campaign_id=data["campaign"],
+                    game_id=data.get("game"),
+                    donator_id=data.get("donator"),
+                    date=data.get("date") or timezone.now(),
+                    method=data["method"],
+                    status=data["status"],
+                    amount=data["amount"],
+                    currency=data["currency"],
+                    payment_terminal=data.get("payment_terminal"),
+                    donation_formula=data.get("donation_formula"),
+                    client_id=data["client_id"],
+                    sequence_number=data["sequence_number"],
+                )
+                payment.apply_terminal_settings(terminal)
+                payments.append(payment)
+
+            if not payments:
+                return payments, payment_ids
+
+            Payment.objects.bulk_create(payments)
+
+            # bulk_create does not set primary keys on every database
+            created_ids = dict(
+                Payment.objects.filter(
+                    terminal=terminal,
+                    client_id__in=[payment.client_id for payment in payments],
+                ).values_list("client_id", "id")
             )
+            for payment in payments:
+                payment.id = created_ids[payment.client_id]
+            payment_ids.update(created_ids)
+
+            for day in {
+                timezone.localtime(payment.date).date() for payment in payments
+            }:
+                PaymentDailyRollup.rebuild(
+                    day_from=day,
+                    day_to=day + datetime.timedelta(days=1),
+                    terminal_id=terminal.pk,
+                )
+
+        return payments, payment_ids
+
+    def _get_last_sequence_number(self, terminal: Terminal):
+        return (
+            Payment.objects.filter(terminal=terminal, sequence_number__isnull=False)
+            .order_by("-sequence_number")
+            .values_list("sequence_number", flat=True)
+            .first()
+        )
 
-        logLine += "[REQUEST] - " + str(request) + "\n"
+    @action(detail=False, methods=["get"], permission_classes=[TerminalIsAuthenticated])
+    def sequence(self, request):
+        """
+        Endpoint for terminals to find payments that were not received
 
-        log_file = open(fileName, "a")
-        log_file.write(logLine)
-        log_file.close()
+        Possible query params :
+        - since : first sequence number to check, 0 by default
+
+        Return the last sequence number received, and the sequence numbers missing from since to this last one
+        (at most BATCH_MAX_SIZE of them)
+        """
+        terminal: Terminal = request.user.get_terminal()
+
+        try:
+            since = int(request.query_params.get("since", 0))
+        except ValueError:
+            raise ValidationError({"since": "since must be an integer"})
+
+        sequence_numbers = (
+            Payment.objects.filter(terminal=terminal, sequence_number__gte=since)
+            .order_by("sequence_number")
+            .values_list("sequence_number", flat=True)
+            .distinct()
+        )
+
+        missing = []
+        expected = since
+
+        for sequence_number in sequence_numbers.iterator():
+            missing.extend(
+                range(
+                    expected,
+                    min(
+                        sequence_number,
+                        expected + BATCH_MAX_SIZE - len(missing),
+                    ),
+                )
+            )
+            expected = sequence_number + 1
+
+            if len(missing) >= BATCH_MAX_SIZE:
+                break
+
+        return Response(
+            {
+                "last_sequence_number": self._get_last_sequence_number(terminal),
+                "missing_sequence_numbers": missing,
+            },
+            status=status.HTTP_200_OK,
+        )
 
     def create(self, request, *args, **kwargs):
-        serializer = self.get_serializer(data=request.data)
+        # Payments sent by terminals are created for the authenticated terminal, which is not queried
+        terminal = Terminal.get_donation_settings(request.user.pk)
+
+        if terminal is not None:
+            serializer = _TerminalPaymentSerializer(
+                data=request.data, context={"terminal": terminal}
+            )
+        else:
+            serializer = self.get_serializer(data=request.data)
+
         try:
             serializer.is_valid(raise_exception=True)
             self.perform_create(serializer)
 
-            self.paymentLog(serializer)
+            audit.log_payment(serializer.data)
 
             headers = self.get_success_headers(serializer.data)
             return Response(
                 serializer.data, status=status.HTTP_201_CREATED, headers=headers
             )
+        except (APIException, PermissionDenied):
+            # Refused payments are logged, and answered with their status (400, 403...)
+            self._log_payment_error(request)
+            raise
         except:
-            self.paymentLogException(sys.exc_info(), serializer, request.data)
+            self._log_payment_error(request)
             return Response(None, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def _log_payment_error(self, request):
+        # The body may be any JSON value, not only an object
+        terminal_id = (
+            request.data.get("terminal") if isinstance(request.data, dict) else None
+        )
+        audit.log_payment_error(terminal_id, sys.exc_info(), request.data)
+
 
-class StatsByTerminal(APIView):
+class StatsByTerminal(ReadReplicaMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, terminal, format=None):
         try:
-            payment = Payment.objects.filter(
-                terminal=terminal, status="Accepted"
-            ).order_by("date")[:5]
-            avg = Payment.objects.filter(
-                terminal=terminal, status="Accepted"
-            ).aggregate(Avg("amount"))
-            avg_ts = Session.objects.filter(terminal=terminal).aggregate(
-                Avg("timesession_global")
-            )["timesession_global__avg"]
-            avg_game_ts = Session.objects.filter(terminal=terminal).aggregate(
-                Avg("timesession")
-            )["timesession__avg"]
-            ts_string = ""
-            ts_game_string = ""
-            if avg_ts:
-                avg_ts = avg_ts.seconds
-                hours, remainder = divmod(avg_ts, 3600)
-                minutes, seconds = divmod(remainder, 60)
-                ts_string = "{:02}:{:02}:{:02}".format(
-                    int(hours), int(minutes), int(seconds)
-                )
-            if avg_game_ts:
-                avg_game_ts = avg_game_ts.seconds
-                hours, remainder = divmod(avg_game_ts, 3600)
-                minutes, seconds = divmod(remainder, 60)
-                ts_game_string = "{:02}:{:02}:{:02}".format(
-                    int(hours), int(minutes), int(seconds)
-                )
-            serializer = {
-                "avg_amount": avg["amount__avg"] or 0,
-                "payments": PaymentFullSerializer(payment, many=True).data,
-                "avg_ts": ts_string,
-                "avg_game_ts": ts_game_string,
+            payments = (
+                Payment.objects.filter(terminal=terminal, status="Accepted")
+                .select_related("campaign", "terminal", "game")
+                .order_by("-date", "-id")[:LAST_DONATIONS_COUNT]
+            )
+            avg = get_accepted_payments_stats(
+                PaymentDailyRollup.objects.filter(terminal=terminal)
+            )
+            sessions = Session.objects.filter(terminal=terminal).aggregate(
+                avg_ts=Avg("timesession_global"), avg_game_ts=Avg("timesession")
+            )
+            stats = {
+                "avg_amount": avg["avg_amount"] or 0,
+                "payments": PaymentStatsSerializer(payments, many=True).data,
+                "avg_ts": format_duration(sessions["avg_ts"]),
+                "avg_game_ts": format_duration(sessions["avg_game_ts"]),
             }
-            serializer = json.dumps(serializer)
-            return Response(serializer, status=status.HTTP_200_OK)
+            return Response(stats, status=status.HTTP_200_OK)
         except ObjectDoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
 
@@ -918,6 +1350,7 @@ class _GameSerializer(serializers.ModelSerializer):
 class TerminalByOwner(APIView):
     # TODO remove after july 2023
     permission_classes = [IsAuthenticated]
+    authentication_classes = TERMINAL_AUTHENTICATION_CLASSES
 
     def get(self, request, format=None):
         try:
@@ -929,7 +1362,7 @@ class TerminalByOwner(APIView):
                 context={"request": request},
             )
             games_serializer = _GameSerializer(
-                terminal.games.order_by("-featured", "name"),
+                terminal.games.with_files().order_by("-featured", "name"),
                 many=True,
                 context={"request": request},
             )
@@ -949,12 +1382,13 @@ class TerminalByOwner(APIView):
 class TurnOnTerminal(APIView):
     # TODO remove after july 2023
     permission_classes = [IsAuthenticated]
+    authentication_classes = TERMINAL_AUTHENTICATION_CLASSES
 
     def get(self, request, format=None):
         try:
             terminal = Terminal.objects.get(owner=request.user.id)
             terminal.is_on = True
-            terminal.save()
+            terminal.save(update_fields=["is_on"])
             serializer = LightTerminalSerializer(terminal)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except ObjectDoesNotExist:
@@ -964,13 +1398,14 @@ class TurnOnTerminal(APIView):
 class TurnOffTerminal(APIView):
     # TODO remove after july 2023
     permission_classes = [IsAuthenticated]
+    authentication_classes = TERMINAL_AUTHENTICATION_CLASSES
 
     def get(self, request, format=None):
         try:
             terminal = Terminal.objects.get(owner=request.user.id)
             terminal.is_on = False
             terminal.is_playing = False
-            terminal.save()
+            terminal.save(update_fields=["is_on", "is_playing"])
             serializer = LightTerminalSerializer(terminal)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except ObjectDoesNotExist:
@@ -980,12 +1415,13 @@ class TurnOffTerminal(APIView):
 class PlayingOnTerminal(APIView):
     # TODO remove after july 2023
     permission_classes = [IsAuthenticated]
+    authentication_classes = TERMINAL_AUTHENTICATION_CLASSES
 
     def get(self, request, format=None):
         try:
             terminal = Terminal.objects.get(owner=request.user.id)
             terminal.is_playing = True
-            terminal.save()
+            terminal.save(update_fields=["is_playing"])
             serializer = LightTerminalSerializer(terminal)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except ObjectDoesNotExist:
@@ -995,12 +1431,13 @@ class PlayingOnTerminal(APIView):
 class PlayingOffTerminal(APIView):
     # TODO remove after july 2023
     permission_classes = [IsAuthenticated]
+    authentication_classes = TERMINAL_AUTHENTICATION_CLASSES
 
     def get(self, request, format=None):
         try:
             terminal = Terminal.objects.get(owner=request.user.id)
             terminal.is_playing = False
-            terminal.save()
+            terminal.save(update_fields=["is_playing"])
             serializer = LightTerminalSerializer(terminal)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except ObjectDoesNotExist:
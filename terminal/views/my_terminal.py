@@ -1,4 +1,11 @@
+import hashlib
+import os
+
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
 
 from rest_framework.response import Response
 from rest_framework.decorators import action
@@ -8,11 +15,14 @@ from rest_framework import status, serializers
 from fleet.models import Customer
 from fleet.serializers import CampaignSerializer
 
+from backend.authentication import TERMINAL_AUTHENTICATION_CLASSES
 from backend.permissions import TerminalIsAuthenticated
 
-from terminal.models import Terminal
+from terminal.models import Terminal, TerminalBandwidthUsage
+from terminal.models.terminal import CONFIG_ETAG_PERIOD
 
-from game.models import CoreFile, BiosFile, Core, Game
+from game.downloads import UnsatisfiableRange, iter_file_range, parse_range
+from game.models import CoreFile, BiosFile, Core, Game, GameFile
 
 from screensaver.serializers.screensaver_broadcast import ScreenSaverBroadcastSerializer
 
@@ -84,32 +94,240 @@ class LightTerminalSerializer(serializers.ModelSerializer):
 
 class MyTerminalViewSet(GenericViewSet):
     permission_classes = [TerminalIsAuthenticated]
+    authentication_classes = TERMINAL_AUTHENTICATION_CLASSES
 
     def list(self, request):
-        try:
-            terminal = Terminal.objects.get(owner=request.user.id)
-            terminal_serializer = LightTerminalSerializer(terminal)
-            campaigns_serializer = CampaignSerializer(
-                terminal.campaigns.order_by("-featured", "name"),
-                many=True,
-                context={"request": request},
+        """
+        Endpoint to download the configuration of the terminal
+
+        The response has the ETag of the configuration (see Terminal.config_etag). If it matches
+        the If-None-Match header, nothing is serialized and 304 is returned. Otherwise the configuration
+        is cached under this ETag. State fields of the terminal are always read from the database,
+        as they do not change the ETag (the terminal gets them through heartbeat).
+        """
+        terminal = (
+            Terminal.objects.filter(owner=request.user.id)
+            .only("id", "config_version", *Terminal.STATE_FIELDS)
+            .first()
+        )
+
+        if terminal is None:
+            return Response(
+                status=status.HTTP_404_NOT_FOUND, data={"error": "Terminal not found"}
             )
-            games_serializer = _GameSerializer(
-                terminal.games.order_by("-featured", "name"),
-                many=True,
-                context={"request": request},
+
+        etag = terminal.config_etag
+
+        if_none_match = parse_etags(request.META.get("HTTP_IF_NONE_MATCH", ""))
+        if etag in if_none_match or "*" in if_none_match:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        cache_key = "my_terminal_config:{}".format(etag.strip('"'))
+        data = cache.get(cache_key)
+
+        if data is None:
+            data = self._serialize_config(request, terminal.pk)
+            cache.set(cache_key, data, CONFIG_ETAG_PERIOD)
+
+        data["terminal"].update(
+            {field: getattr(terminal, field) for field in Terminal.STATE_FIELDS}
+        )
+
+        return Response(data, status=status.HTTP_200_OK, headers={"ETag": etag})
+
+    def _serialize_config(self, request, terminal_id):
+        terminal = Terminal.objects.select_related("customer").get(pk=terminal_id)
+        terminal_serializer = LightTerminalSerializer(terminal)
+        campaigns_serializer = CampaignSerializer(
+            terminal.campaigns.prefetch_related("donationSteps").order_by(
+                "-featured", "name"
+            ),
+            many=True,
+            context={"request": request},
+        )
+        games_serializer = _GameSerializer(
+            terminal.games.with_files().order_by("-featured", "name"),
+            many=True,
+            context={"request": request},
+        )
+        return {
+            "terminal": terminal_serializer.data,
+            "campaigns": campaigns_serializer.data,
+            "games": games_serializer.data,
+        }
+
+    @action(detail=False, methods=["get"])
+    def manifest(self, request):
+        """
+        Endpoint to list the files needed by the terminal : roms of its games, with their cores and bios files
+
+        Each file has its SHA-256 and its size (see StoredFile), so that the terminal only downloads files
+        whose hash changed. The response has an ETag computed from these hashes, if it matches
+        the If-None-Match header, 304 is returned.
+        """
+        terminal_id = request.user.role.terminal_id
+
+        if terminal_id is None:
+            return Response(
+                status=status.HTTP_404_NOT_FOUND, data={"error": "Terminal not found"}
             )
+
+        files = {}
+
+        for game in Game.objects.filter(terminals=terminal_id).with_files():
+            files[("rom", game.file_id)] = (game.file, game.path)
+
+            if game.core is not None:
+                files[("core", game.core.file_id)] = (game.core.file, game.core.path)
+
+                if game.core.bios is not None:
+                    files[("bios", game.core.bios_id)] = (
+                        game.core.bios,
+                        game.core.bios_path,
+                    )
+
+        entries = [
+            {
+                "type": kind,
+                "id": stored_file.pk,
+                "path": path,
+                "sha256": stored_file.sha256 or None,
+                "size": stored_file.size,
+                "url": request.build_absolute_uri(stored_file.file.url),
+                "download_url": request.build_absolute_uri(
+                    reverse(
+                        "my_terminal-download",
+                        kwargs={"kind": kind, "file_id": stored_file.pk},
+                    )
+                ),
+            }
+            for (kind, _), (stored_file, path) in sorted(files.items())
+        ]
+
+        # Urls of files are signed, so they are not part of the ETag
+        etag = '"{}"'.format(
+            hashlib.sha256(
+                "\n".join(
+                    "{type}:{id}:{path}:{sha256}".format(**entry) for entry in entries
+                ).encode()
+            ).hexdigest()
+        )
+
+        if etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        return Response({"files": entries}, headers={"ETag": etag})
+
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path=r"download/(?P<kind>rom|core|bios)/(?P<file_id>[0-9]+)",
+    )
+    def download(self, request, kind, file_id):
+        """
+        Endpoint to download a file listed in the manifest, as an alternative to its storage url,
+        streamed by chunks (see game.downloads). Bytes served are counted per terminal
+        (see TerminalBandwidthUsage).
+
+        Interrupted downloads are resumed with a Range header ("bytes=<first>-<last>", a single range),
+        and an If-Range header with the ETag (the SHA-256 of the file) or the Last-Modified date
+        of the first response, so that the whole file is sent again if it changed meanwhile.
+        """
+        terminal_id = request.user.role.terminal_id
+
+        # Only files of the games of the terminal can be downloaded
+        files = {
+            "rom": GameFile.objects.filter(rom__terminals=terminal_id),
+            "core": CoreFile.objects.filter(core__games__terminals=terminal_id),
+            "bios": BiosFile.objects.filter(core__games__terminals=terminal_id),
+        }
+        stored_file = (
+            files[kind].filter(pk=file_id).first() if terminal_id is not None else None
+        )
+
+        if stored_file is None:
             return Response(
-                {
-                    "terminal": terminal_serializer.data,
-                    "campaigns": campaigns_serializer.data,
-                    "games": games_serializer.data,
-                },
-                status=status.HTTP_200_OK,
+                status=status.HTTP_404_NOT_FOUND, data={"error": "File not found"}
             )
 
-        except ObjectDoesNotExist:
-            status = status.HTTP_404_NOT_FOUND, data = {"error": "Terminal not found"}
+        size = stored_file.size
+        if size is None:  # Checksum not computed yet (see compute_file_checksums)
+            size = stored_file.file.size
+
+        headers = {
+            "Accept-Ranges": "bytes",
+            "Last-Modified": http_date(stored_file.last_update.timestamp()),
+        }
+        if stored_file.sha256:
+            headers["ETag"] = '"{}"'.format(stored_file.sha256)
+
+        byte_range = None
+
+        if self._if_range_matches(request, headers):
+            try:
+                byte_range = parse_range(request.META.get("HTTP_RANGE"), size)
+            except UnsatisfiableRange:
+                response = Response(
+                    status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+                )
+                response["Content-Range"] = "bytes */{}".format(size)
+                return response
+
+        if byte_range is None:
+            first, last = 0, size - 1
+            response_status = status.HTTP_200_OK
+        else:
+            first, last = byte_range
+            response_status = status.HTTP_206_PARTIAL_CONTENT
+            headers["Content-Range"] = "bytes {}-{}/{}".format(first, last, size)
+
+        response = StreamingHttpResponse(
+            self._count_bytes_served(
+                terminal_id, iter_file_range(stored_file.file, first, last)
+            ),
+            status=response_status,
+            content_type="application/octet-stream",
+        )
+        response["Content-Length"] = last - first + 1
+        response["Content-Disposition"] = 'attachment; filename="{}"'.format(
+            os.path.basename(stored_file.file.name)
+        )
+        for header, value in headers.items():
+            response[header] = value
+
+        return response
+
+    def _if_range_matches(self, request, headers):
+        """
+        Whether the Range header must be honored : there is no If-Range header,
+        or it matches the ETag or the Last-Modified date of the file
+        """
+        if_range = request.META.get("HTTP_IF_RANGE")
+
+        if not if_range:
+            return True
+
+        if if_range.startswith('"'):  # Weak ETags never match
+            return if_range == headers.get("ETag")
+
+        return parse_http_date_safe(if_range) == parse_http_date_safe(
+            headers["Last-Modified"]
+        )
+
+    def _count_bytes_served(self, terminal_id, chunks):
+        """
+        Yield chunks of a download, and record the bytes actually sent once the response is closed,
+        even if the download is interrupted
+        """
+        bytes_served = 0
+
+        try:
+            for chunk in chunks:
+                bytes_served += len(chunk)
+                yield chunk
+        finally:
+            chunks.close()
+            TerminalBandwidthUsage.add_download(terminal_id, bytes_served)
 
     @action(detail=False, methods=["post"])
     def turn_on(self, request):
@@ -118,12 +336,14 @@ class MyTerminalViewSet(GenericViewSet):
 
             if not terminal.is_on:
                 terminal.is_on = True
-                terminal.save()
+                terminal.save(update_fields=["is_on"])
 
             return Response()
 
         except ObjectDoesNotExist:
-            status = status.HTTP_404_NOT_FOUND, data = {"error": "Terminal not found"}
+            return Response(
+                status=status.HTTP_404_NOT_FOUND, data={"error": "Terminal not found"}
+            )
 
     @action(detail=False, methods=["post"])
     def is_running(self, request):
@@ -138,7 +358,7 @@ class MyTerminalViewSet(GenericViewSet):
             check_for_updates_required = terminal.check_for_updates
             terminal.check_for_updates = False
 
-            terminal.save()
+            terminal.save(update_fields=["is_on", "version", "check_for_updates"])
 
             return Response(
                 {
@@ -147,7 +367,74 @@ class MyTerminalViewSet(GenericViewSet):
             )
 
         except ObjectDoesNotExist:
-            status = status.HTTP_404_NOT_FOUND, data = {"error": "Terminal not found"}
+            return Response(
+                status=status.HTTP_404_NOT_FOUND, data={"error": "Terminal not found"}
+            )
+
+    @action(detail=False, methods=["post"])
+    def heartbeat(self, request):
+        """
+        Endpoint called periodically by the terminal, replacing is_running and commands
+
+        Possible data :
+        - version : version of Hera running on the terminal
+        - is_playing : whether a game is being played
+
+        Return the commands to execute, whether updates must be checked,
+        and the ETag of the current configuration of the terminal (see list)
+        """
+        terminal = (
+            Terminal.objects.filter(owner=request.user.id)
+            .only(
+                "id",
+                "is_on",
+                "is_playing",
+                "version",
+                "check_for_updates",
+                "restart",
+                "config_version",
+            )
+            .first()
+        )
+
+        if terminal is None:
+            return Response(
+                status=status.HTTP_404_NOT_FOUND, data={"error": "Terminal not found"}
+            )
+
+        changes = {}
+
+        if not terminal.is_on:
+            changes["is_on"] = True
+
+        if "version" in request.data and request.data["version"] != terminal.version:
+            changes["version"] = request.data["version"]
+
+        if "is_playing" in request.data:
+            is_playing = request.data["is_playing"] in (True, "true", "True")
+            if is_playing != terminal.is_playing:
+                changes["is_playing"] = is_playing
+
+        if terminal.check_for_updates:
+            changes["check_for_updates"] = False
+
+        commands = []
+
+        if terminal.restart:
+            commands.append("sudo reboot")
+            changes["restart"] = False
+
+        if changes:
+            # Update only what changed, without rewriting the whole row nor changing the configuration version
+            Terminal.objects.filter(pk=terminal.pk).update(**changes)
+
+        return Response(
+            {
+                "commands": commands,
+                "check_for_updates": terminal.check_for_updates,
+                "config_etag": terminal.config_etag,
+            }
+        )
 
     @action(detail=False, methods=["post"])
     def start_playing(self, request):
@@ -156,12 +443,14 @@ class MyTerminalViewSet(GenericViewSet):
 
             if not terminal.is_playing:
                 terminal.is_playing = True
-                terminal.save()
+                terminal.save(update_fields=["is_playing"])
 
             return Response()
 
         except ObjectDoesNotExist:
-            status = status.HTTP_404_NOT_FOUND, data = {"error": "Terminal not found"}
+            return Response(
+                status=status.HTTP_404_NOT_FOUND, data={"error": "Terminal not found"}
+            )
 
     @action(detail=False, methods=["post"])
     def stop_playing(self, request):
@@ -170,12 +459,14 @@ class MyTerminalViewSet(GenericViewSet):
 
             if terminal.is_playing:
                 terminal.is_playing = False
-                terminal.save()
+                terminal.save(update_fields=["is_playing"])
 
             return Response()
 
         except ObjectDoesNotExist:
-            status = status.HTTP_404_NOT_FOUND, data = {"error": "Terminal not found"}
+            return Response(
+                status=status.HTTP_404_NOT_FOUND, data={"error": "Terminal not found"}
+            )
 
     @action(detail=False, methods=["post"])
     def turn_off(self, request):
@@ -185,12 +476,14 @@ class MyTerminalViewSet(GenericViewSet):
             if terminal.is_on:
                 terminal.is_on = False
                 terminal.is_playing = False
-                terminal.save()
+                terminal.save(update_fields=["is_on", "is_playing"])
 
             return Response()
 
         except ObjectDoesNotExist:
-            status = status.HTTP_404_NOT_FOUND, data = {"error": "Terminal not found"}
+            return Response(
+                status=status.HTTP_404_NOT_FOUND, data={"error": "Terminal not found"}
+            )
 
     @action(detail=False, methods=["post"])
     def restart(self, request):
@@ -200,7 +493,7 @@ class MyTerminalViewSet(GenericViewSet):
         try:
             terminal = Terminal.objects.get(owner=request.user.id)
             terminal.restart = True
-            terminal.save()
+            terminal.save(update_fields=["restart"])
 
             return Response()
 
@@ -222,7 +515,7 @@ class MyTerminalViewSet(GenericViewSet):
             if terminal.restart:
                 commands.append("sudo reboot")
                 terminal.restart = False
-                terminal.save()
+                terminal.save(update_fields=["restart"])
 
             return Response({"commands": commands})
 
@@ -1,22 +1,29 @@
 from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db.models import Prefetch
 
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework import status, viewsets, serializers
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 
 from fleet.models import User, Campaign, Customer
 
+from backend.authentication import allow_terminal_tokens, deny_terminal_tokens
 from backend.permissions import IsAdminOrCustomerUser
 
-from terminal.models import Terminal
+from terminal.models import Terminal, TerminalApiKey
 
 from terminal.serializers import (
     FullTerminalSerializer,
+    PaymentForTerminalSerializer,
 )
 
 from game.models import Game
 
+from screensaver.models import ScreensaverBroadcast
+
 
 class _CampaignSerializerNameOnly(serializers.ModelSerializer):
     class Meta:
@@ -71,25 +78,50 @@ class TerminalViewSet(viewsets.ModelViewSet):
         user: User = self.request.user
 
         if user.is_customer_user():
-            return Terminal.objects.filter(
-                is_archived=False, customer=user.get_customer()
+            queryset = Terminal.objects.filter(
+                is_archived=False, customer_id=user.role.customer_id
             )  # For customer, return all terminals that belong to this customer
 
         elif user.is_staff:
-            return Terminal.objects.filter(is_archived=False)
+            queryset = Terminal.objects.filter(is_archived=False)
 
         else:
             raise PermissionDenied()
 
+        if self.action in ("payments", "commands", "api_key"):
+            return queryset  # These actions do not serialize the terminal
+
+        return self._with_serialized_relations(queryset)
+
+    def _with_serialized_relations(self, queryset):
+        """
+        Annotate donation statistics and fetch relations serialized with terminals,
+        so that serializing any number of terminals takes a constant number of queries
+        """
+
+        return (
+            queryset.with_stats()
+            .select_related("owner", "customer")
+            .prefetch_related(
+                "campaigns",
+                "games",
+                Prefetch(
+                    "screensaver_broadcasts",
+                    queryset=ScreensaverBroadcast.objects.select_related("media"),
+                ),
+            )
+        )
+
     def get_permissions(self):
         """
-        Allow admin and customers to list, retrieve and update
+        Allow admin and customers to list, retrieve, update and read payments
         but only admin to do any other actions
         """
         if (
             self.action == "list"
             or self.action == "retrieve"
             or self.action == "update"
+            or self.action == "payments"
         ):
             permission_classes = [IsAuthenticated, IsAdminOrCustomerUser]
         else:
@@ -119,6 +151,43 @@ class TerminalViewSet(viewsets.ModelViewSet):
         serializer = _TerminalSerializerForListing(queryset, many=True, read_only=True)
         return Response(serializer.data)
 
+    @action(detail=True, methods=["get"])
+    def payments(self, request, pk):  # pylint: disable=unused-argument
+        """
+        Endpoint to retrieve the payments of a terminal, most recent first
+
+        Possible query params :
+        - page
+        - limit
+        """
+        terminal: Terminal = self.get_object()
+
+        try:
+            limit = int(request.query_params.get("limit", 10))
+        except ValueError:
+            raise ValidationError({"limit": "limit must be an integer"})
+
+        if limit < 1:
+            raise ValidationError({"limit": "limit must be positive"})
+
+        payments = terminal.payments.select_related(
+            "donator", "campaign", "game"
+        ).order_by("-date", "-id")
+
+        paginator = Paginator(payments, limit)
+        page = paginator.get_page(request.query_params.get("page", 1))
+
+        serializer = PaymentForTerminalSerializer(page, many=True)
+        return Response(
+            {
+                "payments": serializer.data,
+                "count": paginator.count,
+                "nb_pages": paginator.num_pages,
+                "page": page.number,
+            },
+            status=status.HTTP_200_OK,
+        )
+
     @action(detail=True, methods=["get", "post"])
     def activate(self, request, pk):  # pylint: disable=unused-argument
         terminal: Terminal = self.get_object()
@@ -126,6 +195,7 @@ class TerminalViewSet(viewsets.ModelViewSet):
         terminal.owner.is_active = True
         terminal.save()
         terminal.owner.save()
+        allow_terminal_tokens(terminal.pk)
         serializer = FullTerminalSerializer(terminal)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -138,6 +208,8 @@ class TerminalViewSet(viewsets.ModelViewSet):
         terminal.is_playing = False
         terminal.save()
         terminal.owner.save()
+        # Tokens of terminals are not checked against the database (see TerminalJWTAuthentication)
+        deny_terminal_tokens(terminal.pk)
         serializer = FullTerminalSerializer(terminal)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -149,9 +221,32 @@ class TerminalViewSet(viewsets.ModelViewSet):
         terminal.is_archived = True
         terminal.save()
         terminal.owner.save()
+        deny_terminal_tokens(terminal.pk)
         serializer = FullTerminalSerializer(terminal)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    @action(detail=True, methods=["post"])
+    def api_key(self, request, pk):  # pylint: disable=unused-argument
+        """
+        Endpoint to issue an API key for the terminal (see TerminalApiKey)
+        The key is returned only once, it must be configured on the terminal.
+
+        Possible data :
+        - revoke_previous : whether previous keys of the terminal must be deactivated
+        """
+        terminal: Terminal = self.get_object()
+
+        if request.data.get("revoke_previous") in (True, "true", "True"):
+            for previous_api_key in terminal.api_keys.filter(is_active=True):
+                previous_api_key.is_active = False
+                previous_api_key.save(update_fields=["is_active"])
+
+        api_key, key = TerminalApiKey.issue(terminal)
+
+        return Response(
+            {"key_id": api_key.key_id, "api_key": key}, status=status.HTTP_201_CREATED
+        )
+
     @action(detail=True, methods=["post"])
     def check_for_updates(self, request, pk):  # pylint: disable=unused-argument
         """
@@ -159,7 +254,7 @@ class TerminalViewSet(viewsets.ModelViewSet):
         """
         terminal: Terminal = self.get_object()
         terminal.check_for_updates = True
-        terminal.save()
+        terminal.save(update_fields=["check_for_updates"])
         serializer = FullTerminalSerializer(terminal)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -170,7 +265,7 @@ class TerminalViewSet(viewsets.ModelViewSet):
         """
         terminal: Terminal = self.get_object()
         terminal.restart = True
-        terminal.save()
+        terminal.save(update_fields=["restart"])
         serializer = FullTerminalSerializer(terminal)
         return Response(serializer.data, status=status.HTTP_200_OK)
 